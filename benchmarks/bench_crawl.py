@@ -0,0 +1,302 @@
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import platform
+import multiprocessing
+import typer
+from datetime import datetime
+from typing import Dict, List, Optional
+
+SRC_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(SRC_DIRECTORY)
+
+from mock_site import MockSiteConfig, start_mock_site
+
+app = typer.Typer()
+
+SPIDERS = {
+    "syosetu": "syosetu_spider.spiders.syosetu_spider.SyosetuSpider",
+    "syosetu-text": "syosetu_spider.spiders.syosetu_spider.SyosetuSpider",
+    "nocturne": "syosetu_spider.spiders.nocturne_spider.NocturneSpider",
+}
+# Extra spider arguments per benchmarked spider
+SPIDER_ARGUMENTS = {"syosetu-text": {"text_download": True}}
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _crawl_worker(
+    spider: str,
+    base_url: str,
+    ncodes: List[str],
+    overrides: Dict,
+    storage_directory: str,
+    results: multiprocessing.Queue,
+):
+    """Run one crawl in a fresh process, a Twisted reactor cannot be restarted."""
+    sys.path.append(SRC_DIRECTORY)
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "syosetu_spider.settings")
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.misc import load_object
+    from scrapy.utils.project import get_project_settings
+    from syosetu_spider.extensions import page_loaded
+
+    settings = get_project_settings()
+    settings.set("LOG_LEVEL", "WARNING", priority="cmdline")
+    settings.set("NOVEL_STORAGE_DIR", storage_directory, priority="cmdline")
+    settings.set(
+        "CRAWLSTATS_DIR",
+        os.path.join(storage_directory, "crawl_stats"),
+        priority="cmdline",
+    )
+    for name, value in overrides.items():
+        settings.set(name, value, priority="cmdline")
+
+    latencies: List[float] = []
+    page_loads: List[float] = []
+    counters = {"chapters": 0, "errors": 0}
+
+    def response_received(response, request, spider):
+        latencies.append(request.meta.get("download_latency", 0.0))
+
+    def item_scraped(item, response, spider):
+        counters["chapters"] += 1
+
+    def spider_error(failure, response, spider):
+        counters["errors"] += 1
+
+    def page_load(url, seconds, spider):
+        page_loads.append(seconds)
+
+    spider_class = load_object(SPIDERS[spider])
+    process = CrawlerProcess(settings)
+    crawlers = []
+    for ncode in ncodes:
+        crawler = process.create_crawler(spider_class)
+        crawlers.append(crawler)
+        crawler.signals.connect(response_received, signal=signals.response_received)
+        crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(spider_error, signal=signals.spider_error)
+        crawler.signals.connect(page_load, signal=page_loaded)
+        process.crawl(
+            crawler,
+            start_urls=f"{base_url}/{ncode}/",
+            allowed_domains=["127.0.0.1"],
+            **SPIDER_ARGUMENTS.get(spider, {}),
+        )
+
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (usage_end.ru_utime - usage_start.ru_utime) + (
+        usage_end.ru_stime - usage_start.ru_stime
+    )
+    results.put(
+        {
+            "seconds": elapsed,
+            "cpu_seconds": cpu,
+            "chapters": counters["chapters"],
+            "errors": counters["errors"],
+            "response_bytes": sum(
+                crawler.stats.get_value("downloader/response_bytes", 0)
+                for crawler in crawlers
+            ),
+            "latencies": latencies,
+            "page_loads": page_loads,
+        }
+    )
+
+
+def run_crawl_case(
+    server, spider: str, novels: int, overrides: Dict, timeout: float
+) -> Dict:
+    """Crawl `novels` mock novels with one spider and collect metrics."""
+    server.config.age_gate = spider == "nocturne"
+    # Only the browser fetches the page assets, they are what its profiles differ in
+    server.config.assets = spider == "nocturne"
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    ncodes = [f"n{index:04d}bm" for index in range(novels)]
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as tmp:
+        worker = context.Process(
+            target=_crawl_worker,
+            args=(
+                spider,
+                base_url,
+                ncodes,
+                overrides,
+                tmp,
+                results,
+            ),
+        )
+        worker.start()
+        try:
+            metrics = results.get(timeout=timeout)
+        except Exception:
+            worker.kill()
+            return {"error": f"crawl did not finish within {timeout}s"}
+        finally:
+            worker.join()
+
+    latencies = metrics.pop("latencies")
+    page_loads = metrics.pop("page_loads")
+    chapters = metrics["chapters"]
+    metrics.update(
+        {
+            "pages": len(latencies),
+            "chapters_per_second": (
+                chapters / metrics["seconds"] if metrics["seconds"] else 0.0
+            ),
+            "latency_p50_ms": _percentile(latencies, 50) * 1000,
+            "latency_p99_ms": _percentile(latencies, 99) * 1000,
+            "browser_pages": len(page_loads),
+            "page_load_p50_ms": _percentile(page_loads, 50) * 1000,
+            "page_load_p99_ms": _percentile(page_loads, 99) * 1000,
+            "cpu_ms_per_chapter": (
+                metrics["cpu_seconds"] / chapters * 1000 if chapters else 0.0
+            ),
+            "kb_per_chapter": (
+                metrics["response_bytes"] / chapters / 1024 if chapters else 0.0
+            ),
+        }
+    )
+    return metrics
+
+
+@app.command()
+def run(
+    spider: Optional[List[str]] = typer.Option(
+        None,
+        "--spider",
+        "-s",
+        help="Spider to benchmark: syosetu, syosetu-text or nocturne, repeatable",
+    ),
+    chapters: int = typer.Option(
+        50, "--chapters", "-c", help="Chapters per mock novel"
+    ),
+    chapter_chars: int = typer.Option(
+        3000, "--chapter-chars", help="Approximate characters per chapter"
+    ),
+    novels: Optional[List[int]] = typer.Option(
+        None, "--novels", "-n", help="Novels crawled at once, repeatable"
+    ),
+    concurrency: Optional[List[int]] = typer.Option(
+        None, "--concurrency", help="CONCURRENT_REQUESTS_PER_DOMAIN value, repeatable"
+    ),
+    latency: float = typer.Option(
+        0.02, "--latency", help="Mock site latency in seconds"
+    ),
+    jitter: float = typer.Option(0.01, "--jitter", help="Mock site latency jitter"),
+    error_rate: float = typer.Option(
+        0.0, "--error-rate", help="Fraction of mock responses that are 503"
+    ),
+    adaptive_throttle: bool = typer.Option(
+        False,
+        "--adaptive-throttle",
+        help="Let the adaptive throttle tune concurrency instead of --concurrency",
+    ),
+    browser_profile: Optional[List[str]] = typer.Option(
+        None,
+        "--browser-profile",
+        help="NOCTURNE_BROWSER_PROFILE for the nocturne spider: light or full, repeatable",
+    ),
+    timeout: float = typer.Option(600, "--timeout", help="Seconds allowed per case"),
+    output: str = typer.Option(
+        "bench_crawl_results.json", "--output", "-o", help="JSON results file"
+    ),
+):
+    """Benchmark the spiders against a local mock Syosetu/Nocturne site."""
+    spiders = spider or ["syosetu"]
+    for name in spiders:
+        if name not in SPIDERS:
+            typer.echo(f"Unknown spider: {name}")
+            raise typer.Exit(1)
+    profiles = browser_profile or ["light"]
+    for profile in profiles:
+        if profile not in ("light", "full"):
+            typer.echo(f"Unknown browser profile: {profile}")
+            raise typer.Exit(1)
+
+    config = MockSiteConfig(
+        chapters=chapters,
+        chapter_chars=chapter_chars,
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+    )
+    server = start_mock_site(config)
+    cases = []
+    try:
+        for name in spiders:
+            # Only the nocturne spider drives a browser
+            for profile in profiles if name == "nocturne" else [None]:
+                for novel_count in novels or [1]:
+                    for per_domain in concurrency or [8]:
+                        overrides = {
+                            "CONCURRENT_REQUESTS_PER_DOMAIN": per_domain,
+                            "ADAPTIVE_THROTTLE_ENABLED": adaptive_throttle,
+                        }
+                        label = name
+                        if profile:
+                            overrides["NOCTURNE_BROWSER_PROFILE"] = profile
+                            label = f"{name} ({profile})"
+                        metrics = run_crawl_case(
+                            server, name, novel_count, overrides, timeout
+                        )
+                        case = {
+                            "spider": name,
+                            "novels": novel_count,
+                            "settings": overrides,
+                            **metrics,
+                        }
+                        cases.append(case)
+                        if "error" in metrics:
+                            typer.echo(
+                                f"{label:<9} novels={novel_count} {metrics['error']}"
+                            )
+                            continue
+                        page_loads = (
+                            f" page load p50 {metrics['page_load_p50_ms']:.1f} ms "
+                            f"p99 {metrics['page_load_p99_ms']:.1f} ms"
+                            if metrics["browser_pages"]
+                            else ""
+                        )
+                        typer.echo(
+                            f"{label:<9} novels={novel_count} concurrency={per_domain} "
+                            f"{metrics['chapters_per_second']:.1f} ch/s "
+                            f"p50 {metrics['latency_p50_ms']:.1f} ms "
+                            f"p99 {metrics['latency_p99_ms']:.1f} ms "
+                            f"cpu {metrics['cpu_ms_per_chapter']:.1f} ms/ch "
+                            f"{metrics['kb_per_chapter']:.1f} KB/ch{page_loads}"
+                        )
+    finally:
+        server.shutdown()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "site": config.__dict__,
+        "results": cases,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    typer.echo(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,325 @@
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import socket
+import asyncio
+import platform
+import tempfile
+import multiprocessing
+import typer
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+SRC_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(SRC_DIRECTORY)
+
+from corpus import generate_novel
+from reading_server import run_server
+
+app = typer.Typer()
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Server did not start on port {port}")
+
+
+class Client:
+    """Minimal keep-alive HTTP/1.1 client, enough for the reading server."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def get(
+        self, path: str, headers: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                "127.0.0.1", self.port
+            )
+        lines = [f"GET {path} HTTP/1.1", "Host: 127.0.0.1"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        body = await self.reader.readexactly(
+            int(response_headers.get("content-length", "0"))
+        )
+        if response_headers.get("connection") == "close":
+            self.close()
+        return status, response_headers, body
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def check_server(port: int, ncode: str) -> List[str]:
+    """Exercise the routes and HTTP features once, returns the failed checks."""
+    client = Client(port)
+    failures = []
+
+    def check(name: str, condition: bool) -> None:
+        if not condition:
+            failures.append(name)
+
+    status, _, body = await client.get("/novels")
+    check("novel list", status == 200 and ncode in json.loads(body)[0]["novel_code"])
+    status, _, body = await client.get(f"/novels/{ncode}")
+    info = json.loads(body) if status == 200 else {}
+    check("novel info", status == 200 and info["chapters"] > 0 and info["volumes"])
+
+    status, headers, plain = await client.get(f"/novels/{ncode}/chapters/1-10")
+    check("chapter range", status == 200 and plain.startswith(b"1-10 "))
+    etag = headers.get("etag", "")
+    status, _, _ = await client.get(
+        f"/novels/{ncode}/chapters/1-10", {"If-None-Match": etag}
+    )
+    check("etag revalidation", status == 304)
+    status, headers, compressed = await client.get(
+        f"/novels/{ncode}/chapters/1-10", {"Accept-Encoding": "gzip"}
+    )
+    check(
+        "gzip",
+        status == 200
+        and headers.get("content-encoding") == "gzip"
+        and gzip.decompress(compressed) == plain,
+    )
+    status, headers, part = await client.get(
+        f"/novels/{ncode}/chapters/1-10", {"Range": "bytes=100-199"}
+    )
+    check(
+        "range request",
+        status == 206
+        and part == plain[100:200]
+        and headers.get("content-range") == f"bytes 100-199/{len(plain)}",
+    )
+    status, _, _ = await client.get(
+        f"/novels/{ncode}/chapters/1-10", {"Range": f"bytes={len(plain)}-"}
+    )
+    check("unsatisfiable range", status == 416)
+    status, _, _ = await client.get(f"/novels/{ncode}/volumes/1")
+    check("volume", status == 200)
+    status, _, _ = await client.get(f"/novels/{ncode}/chapters/999999")
+    check("missing chapter", status == 404)
+    client.close()
+    return failures
+
+
+async def run_load(
+    port: int,
+    paths: List[str],
+    weights: List[float],
+    concurrency: int,
+    duration: float,
+    use_gzip: bool,
+    seed: int,
+) -> Dict:
+    """Request weighted random paths from concurrency keep-alive clients."""
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    received = [0]
+    errors = [0]
+    headers = {"Accept-Encoding": "gzip"} if use_gzip else {}
+    deadline = time.perf_counter() + duration
+
+    async def worker(number: int) -> None:
+        rng = random.Random(seed + number)
+        client = Client(port)
+        while time.perf_counter() < deadline:
+            path = rng.choices(paths, weights)[0]
+            start = time.perf_counter()
+            try:
+                status, _, body = await client.get(path, headers)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                errors[0] += 1
+                client.close()
+                continue
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            received[0] += len(body)
+        client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "statuses": statuses,
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "mb_per_second": received[0] / elapsed / 1024 / 1024 if elapsed else 0.0,
+        "latency_p50_ms": _percentile(latencies, 50) * 1000,
+        "latency_p99_ms": _percentile(latencies, 99) * 1000,
+        "latency_max_ms": max(latencies, default=0.0) * 1000,
+    }
+
+
+async def fetch_stats(port: int) -> Dict:
+    client = Client(port)
+    _, _, body = await client.get("/stats")
+    client.close()
+    return json.loads(body)
+
+
+def _request_mix(
+    ncodes: List[str], chapters: int, hot_share: float, range_length: int
+) -> Tuple[List[str], List[float]]:
+    """Single chapters and chapter ranges, the first hot_share of chapters read most."""
+    paths = []
+    weights = []
+    hot = max(1, int(chapters * hot_share))
+    for ncode in ncodes:
+        for number in range(1, chapters + 1):
+            weight = 8.0 if number <= hot else 1.0
+            paths.append(f"/novels/{ncode}/chapters/{number}")
+            weights.append(weight)
+            if range_length and (number - 1) % range_length == 0:
+                last = min(chapters, number + range_length - 1)
+                paths.append(f"/novels/{ncode}/chapters/{number}-{last}")
+                weights.append(weight)
+    return paths, weights
+
+
+@app.command()
+def run(
+    novels: int = typer.Option(4, "--novels", "-n", help="Novels in the corpus"),
+    chapters: int = typer.Option(200, "--chapters", "-c", help="Chapters per novel"),
+    chapter_chars: int = typer.Option(
+        3000, "--chapter-chars", help="Approximate characters per chapter"
+    ),
+    concurrency: Optional[List[int]] = typer.Option(
+        None, "--concurrency", help="Clients requesting at once, repeatable"
+    ),
+    duration: float = typer.Option(
+        10.0, "--duration", "-d", help="Seconds of load per case"
+    ),
+    cache_mb: Optional[List[int]] = typer.Option(
+        None, "--cache-mb", help="Server LRU size in MB, repeatable"
+    ),
+    use_gzip: bool = typer.Option(
+        False, "--gzip", help="Ask for gzip encoded responses"
+    ),
+    hot_share: float = typer.Option(
+        0.2, "--hot-share", help="Share of chapters requested 8 times as often"
+    ),
+    range_length: int = typer.Option(
+        10,
+        "--range-length",
+        help="Also request chapter ranges of this length, 0 for none",
+    ),
+    output: str = typer.Option(
+        "bench_serve_results.json", "--output", "-o", help="JSON results file"
+    ),
+):
+    """Check the reading server routes, then load test it and report requests/s and p99."""
+    with tempfile.TemporaryDirectory() as storage:
+        ncodes = [f"n{number:04d}aa" for number in range(novels)]
+        for seed, ncode in enumerate(ncodes):
+            generate_novel(
+                os.path.join(storage, "syosetu_spider", f"{ncode}.jl"),
+                chapters=chapters,
+                chapter_chars=chapter_chars,
+                seed=seed,
+            )
+        paths, weights = _request_mix(ncodes, chapters, hot_share, range_length)
+
+        cases = []
+        context = multiprocessing.get_context("spawn")
+        for cache in cache_mb or [64]:
+            for clients in concurrency or [16]:
+                # A fresh server per case, so every case starts with a cold cache
+                port = _free_port()
+                server = context.Process(
+                    target=run_server,
+                    args=(storage, "127.0.0.1", port, cache * 1024 * 1024),
+                    daemon=True,
+                )
+                server.start()
+                try:
+                    _wait_for_port(port)
+                    failures = asyncio.run(check_server(port, ncodes[0]))
+                    if failures:
+                        typer.echo(f"Failed checks: {', '.join(failures)}")
+                        raise typer.Exit(1)
+                    metrics = asyncio.run(
+                        run_load(
+                            port, paths, weights, clients, duration, use_gzip, seed=0
+                        )
+                    )
+                    metrics["cache"] = asyncio.run(fetch_stats(port))["cache"]
+                finally:
+                    server.terminate()
+                    server.join()
+                cases.append(
+                    {
+                        "cache_mb": cache,
+                        "concurrency": clients,
+                        "gzip": use_gzip,
+                        **metrics,
+                    }
+                )
+                typer.echo(
+                    f"cache={cache}MB clients={clients} "
+                    f"{metrics['requests_per_second']:.0f} req/s "
+                    f"p50 {metrics['latency_p50_ms']:.2f} ms "
+                    f"p99 {metrics['latency_p99_ms']:.2f} ms "
+                    f"{metrics['mb_per_second']:.1f} MB/s "
+                    f"hit ratio {metrics['cache']['hit_ratio']:.1%} "
+                    f"errors {metrics['errors']}"
+                )
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "corpus": {
+            "novels": novels,
+            "chapters": chapters,
+            "chapter_chars": chapter_chars,
+        },
+        "results": cases,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    typer.echo(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import tracemalloc
+import typer
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import novel_package
+import novel_package_v2
+import chunk_plan
+from typer_func import process_jsonl_file
+from typer_func_old import process_jsonl_file_old
+from novel_package_v2 import process_jsonl_file3
+from corpus import generate_novel
+
+app = typer.Typer()
+
+
+def _stub_translation():
+    """Replace network translation with identity so only unpack work is timed."""
+    novel_package.translate_title = lambda title: title
+    novel_package_v2.translate_title = lambda title: title
+    chunk_plan.translate_title = lambda title: title
+
+
+def _run_old(filepath: str, output_dir: str, length: int):
+    process_jsonl_file_old(filepath, os.path.dirname(filepath), length)
+
+
+def _run_unpack(filepath: str, output_dir: str, length: int):
+    process_jsonl_file(filepath, os.path.dirname(filepath), length)
+
+
+def _run_unpack_planned(filepath: str, output_dir: str, length: int):
+    chunk_plan.process_jsonl_file_planned(filepath, length, workers=os.cpu_count())
+
+
+def _run_unpack3(filepath: str, output_dir: str, length: int):
+    process_jsonl_file3(filepath, output_dir, length)
+
+
+ENGINES: Dict[str, Callable[[str, str, int], None]] = {
+    "unpack-old": _run_old,
+    "unpack": _run_unpack,
+    "unpack-planned": _run_unpack_planned,
+    "unpack3": _run_unpack3,
+}
+
+
+def _run_once(engine: Callable, corpus_file: str, length: int, trace: bool) -> Dict:
+    """Run an engine on a private copy of the corpus and return timing data."""
+    with tempfile.TemporaryDirectory() as tmp:
+        # The old engines write next to the input's parent directory, so give
+        # every run its own storage tree to keep outputs apart.
+        storage_dir = os.path.join(tmp, "storage")
+        os.makedirs(storage_dir)
+        filepath = os.path.join(storage_dir, os.path.basename(corpus_file))
+        shutil.copyfile(corpus_file, filepath)
+        output_dir = os.path.join(tmp, "storage_text")
+
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        engine(filepath, output_dir, length)
+        elapsed = time.perf_counter() - start
+        peak = 0
+        if trace:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    return {"seconds": elapsed, "peak_bytes": peak}
+
+
+def run_benchmark(
+    corpus_file: str,
+    chapters: int,
+    engines: List[str],
+    lengths: List[int],
+    repeat: int = 3,
+) -> List[Dict]:
+    """Benchmark engines over a corpus file for every chunk length.
+
+    Wall time is the best of `repeat` untraced runs; peak memory comes from
+    one extra run under tracemalloc, since tracing slows the code down.
+    """
+    size_mb = os.path.getsize(corpus_file) / (1024 * 1024)
+    results = []
+    for name in engines:
+        for length in lengths:
+            runs = [
+                _run_once(ENGINES[name], corpus_file, length, trace=False)
+                for _ in range(repeat)
+            ]
+            best = min(run["seconds"] for run in runs)
+            peak = _run_once(ENGINES[name], corpus_file, length, trace=True)
+            results.append(
+                {
+                    "engine": name,
+                    "length": length,
+                    "corpus": os.path.basename(corpus_file),
+                    "seconds": best,
+                    "mb_per_second": size_mb / best if best else 0.0,
+                    "chapters_per_second": chapters / best if best else 0.0,
+                    "peak_memory_mb": peak["peak_bytes"] / (1024 * 1024),
+                }
+            )
+            typer.echo(
+                f"{name:<11} length={length:<4} {best:.3f}s "
+                f"{results[-1]['mb_per_second']:.1f} MB/s "
+                f"{results[-1]['chapters_per_second']:.0f} ch/s "
+                f"peak {results[-1]['peak_memory_mb']:.1f} MB"
+            )
+    return results
+
+
+def find_regressions(
+    results: List[Dict], baseline: List[Dict], tolerance: float
+) -> List[str]:
+    """Compare results against a baseline and describe any slowdowns."""
+    previous = {(r["engine"], r["length"], r["corpus"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result["engine"], result["length"], result["corpus"])
+        if key not in previous:
+            continue
+        allowed = previous[key]["seconds"] * (1 + tolerance)
+        if result["seconds"] > allowed:
+            regressions.append(
+                f"{key[0]} length={key[1]} {key[2]}: "
+                f"{result['seconds']:.3f}s > {previous[key]['seconds']:.3f}s (+{tolerance:.0%})"
+            )
+    return regressions
+
+
+@app.command()
+def run(
+    chapters: int = typer.Option(
+        500, "--chapters", "-c", help="Chapters in the corpus"
+    ),
+    chapter_chars: int = typer.Option(
+        3000, "--chapter-chars", help="Approximate characters per chapter"
+    ),
+    skip_density: float = typer.Option(
+        0.02, "--skip-density", help="Probability of a skipped chapter title"
+    ),
+    engine: Optional[List[str]] = typer.Option(
+        None, "--engine", "-e", help="Engine to benchmark, repeatable (default all)"
+    ),
+    length: Optional[List[int]] = typer.Option(
+        None, "--length", "-l", help="Chunk length to benchmark, repeatable"
+    ),
+    repeat: int = typer.Option(3, "--repeat", "-r", help="Timed runs per case"),
+    output: str = typer.Option(
+        "bench_results.json", "--output", "-o", help="JSON results file"
+    ),
+    baseline: Optional[str] = typer.Option(
+        None, "--baseline", "-b", help="Previous results file to compare against"
+    ),
+    tolerance: float = typer.Option(
+        0.15, "--tolerance", help="Allowed slowdown against the baseline"
+    ),
+):
+    """Benchmark the unpack engines on a synthetic corpus."""
+    _stub_translation()
+    engines = engine or list(ENGINES)
+    for name in engines:
+        if name not in ENGINES:
+            typer.echo(f"Unknown engine: {name}")
+            raise typer.Exit(1)
+    lengths = length or [10, 50]
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        corpus_file = os.path.join(
+            corpus_dir, f"novel_{chapters}x{chapter_chars}_{skip_density}.jl"
+        )
+        generate_novel(corpus_file, chapters, chapter_chars, skip_density)
+        results = run_benchmark(corpus_file, chapters, engines, lengths, repeat)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "corpus": {
+            "chapters": chapters,
+            "chapter_chars": chapter_chars,
+            "skip_density": skip_density,
+        },
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    typer.echo(f"Results written to {output}")
+
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            previous = json.load(f)["results"]
+        regressions = find_regressions(results, previous, tolerance)
+        for regression in regressions:
+            typer.echo(f"Regression: {regression}")
+        if regressions:
+            raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,101 @@
+import os
+import random
+import typer
+import jsonlines
+from typing import List
+
+SKIP_CHAPTER_TITLES = ["登場人物", "人物紹介"]
+# Mix of kana, kanji and punctuation so the text encodes like real novel text
+SAMPLE_SENTENCES = [
+    "彼は静かに扉を開けた。",
+    "「おはようございます、先輩」",
+    "森の奥から冷たい風が吹いてきた。",
+    "魔法陣が淡く光り始める。",
+    "「そんなこと、聞いてないぞ！」",
+    "ギルドの受付嬢は困ったように笑った。",
+    "遠くで鐘の音が三度鳴り響いた。",
+    "俺は剣を握り直し、前を見据えた。",
+]
+
+app = typer.Typer()
+
+
+def _make_text(rng: random.Random, chapter_chars: int) -> str:
+    """Build chapter text of roughly chapter_chars characters split into lines."""
+    lines: List[str] = []
+    size = 0
+    while size < chapter_chars:
+        line = "".join(rng.choice(SAMPLE_SENTENCES) for _ in range(rng.randint(1, 4)))
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+
+def generate_novel(
+    filepath: str,
+    chapters: int = 100,
+    chapter_chars: int = 3000,
+    skip_density: float = 0.02,
+    seed: int = 0,
+) -> str:
+    """Write a synthetic novel .jl file shaped like the spiders feed output.
+
+    Args:
+        filepath (str): Output path of the .jl file.
+        chapters (int): Number of chapters to generate.
+        chapter_chars (int): Approximate number of characters per chapter text.
+        skip_density (float): Probability a chapter gets a skipped title pattern.
+        seed (int): Random seed so corpora are reproducible between runs.
+    Returns:
+        str: The path of the written file.
+    """
+    rng = random.Random(seed)
+    novel_title = f"ベンチマーク用の小説{seed}"
+    novel_description = _make_text(rng, 400)
+
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    with jsonlines.open(filepath, "w") as writer:
+        for number in range(1, chapters + 1):
+            if rng.random() < skip_density:
+                chapter_title = rng.choice(SKIP_CHAPTER_TITLES)
+            else:
+                chapter_title = f"第{number}話　{rng.choice(SAMPLE_SENTENCES)}"
+            record = {
+                "novel_title": novel_title,
+                "novel_description": novel_description,
+                "volume_title": (
+                    f"第{(number - 1) // 50 + 1}章" if number % 50 == 1 else ""
+                ),
+                "chapter_start_end": f"{number}/{chapters}",
+                "chapter_number": str(number),
+                "chapter_title": chapter_title,
+                "chapter_text": _make_text(rng, chapter_chars),
+            }
+            if rng.random() < 0.3:
+                record["chapter_foreword"] = _make_text(rng, 80)
+            if rng.random() < 0.3:
+                record["chapter_afterword"] = _make_text(rng, 120)
+            writer.write(record)
+    return filepath
+
+
+@app.command()
+def generate(
+    output: str = typer.Argument(..., help="Output .jl file path"),
+    chapters: int = typer.Option(100, "--chapters", "-c", help="Number of chapters"),
+    chapter_chars: int = typer.Option(
+        3000, "--chapter-chars", help="Approximate characters per chapter"
+    ),
+    skip_density: float = typer.Option(
+        0.02, "--skip-density", help="Probability of a skipped chapter title"
+    ),
+    seed: int = typer.Option(0, "--seed", help="Random seed"),
+):
+    """Generate a synthetic novel .jl file."""
+    generate_novel(output, chapters, chapter_chars, skip_density, seed)
+    size_mb = os.path.getsize(output) / (1024 * 1024)
+    typer.echo(f"Wrote {output} - Size: {size_mb:.2f} MB")
+
+
+if __name__ == "__main__":
+    app()
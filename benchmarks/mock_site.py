@@ -0,0 +1,375 @@
+import json
+import gzip
+import time
+import random
+import hashlib
+import threading
+import typer
+from dataclasses import dataclass
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+from corpus import _make_text, SKIP_CHAPTER_TITLES, SAMPLE_SENTENCES
+
+app = typer.Typer()
+
+
+@dataclass
+class MockSiteConfig:
+    """Behaviour of the mock Syosetu/Nocturne site."""
+
+    chapters: int = 100
+    chapter_chars: int = 3000
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    skip_density: float = 0.02
+    # Serve the #yes18 age gate page until the request carries over18=yes
+    age_gate: bool = False
+    # Link the plain-text chapter download from the main page
+    text_download: bool = True
+    # Link a stylesheet, a web font and images from every page like the real
+    # site, only browsers fetch them
+    assets: bool = False
+
+
+def _novel_rng(ncode: str, chapter_number: int = 0) -> random.Random:
+    """Deterministic random source so every fetch of a page returns the same content."""
+    seed = hashlib.sha1(f"{ncode}/{chapter_number}".encode()).hexdigest()
+    return random.Random(int(seed[:16], 16))
+
+
+# Separators of the Syosetu text export, see syosetu_spider/parsing.py
+FOREWORD_SEPARATOR = "*" * 44
+AFTERWORD_SEPARATOR = "*" * 48
+TOC_PAGE_SIZE = 100
+
+# Served under /static/, sizes in the range of the real site's assets
+STATIC_ASSETS = {
+    "site.css": (
+        "text/css",
+        (
+            "@font-face{font-family:mock;src:url(/static/font.woff2)}"
+            "body{font-family:mock}" + "/* padding */" * 2000
+        ).encode(),
+    ),
+    "font.woff2": ("font/woff2", bytes(48 * 1024)),
+    "banner.png": ("image/png", bytes(64 * 1024)),
+    "cover.jpg": ("image/jpeg", bytes(96 * 1024)),
+}
+ASSET_HEAD = '<link rel="stylesheet" href="/static/site.css">'
+ASSET_BODY = '<img src="/static/banner.png"><img src="/static/cover.jpg">'
+
+
+def _page_start(config: MockSiteConfig) -> str:
+    """Opening markup of a page, with the asset links when config.assets is set."""
+    if config.assets:
+        return f"<html><head><title>mock</title>{ASSET_HEAD}</head><body>{ASSET_BODY}"
+    return "<html><head><title>mock</title></head><body>"
+
+
+def text_download_id(ncode: str) -> str:
+    """Numeric novel id used by the text download urls, reversible to the ncode."""
+    return str(int.from_bytes(ncode.encode("ascii"), "big"))
+
+
+def ncode_from_text_download_id(novel_id: str) -> str:
+    number = int(novel_id)
+    return number.to_bytes((number.bit_length() + 7) // 8, "big").decode("ascii")
+
+
+def chapter_parts(ncode: str, chapter_number: int, config: MockSiteConfig) -> Dict:
+    """Generate the title, text, foreword and afterword of a chapter."""
+    rng = _novel_rng(ncode, chapter_number)
+    if rng.random() < config.skip_density:
+        chapter_title = rng.choice(SKIP_CHAPTER_TITLES)
+    else:
+        chapter_title = f"第{chapter_number}話　{rng.choice(SAMPLE_SENTENCES)}"
+    text = _make_text(rng, config.chapter_chars)
+    foreword = _make_text(rng, 80) if rng.random() < 0.3 else ""
+    afterword = _make_text(rng, 120) if rng.random() < 0.3 else ""
+    return {
+        "title": chapter_title,
+        "volume": "第一章" if chapter_number == 1 else "",
+        "text": text,
+        "foreword": foreword,
+        "afterword": afterword,
+    }
+
+
+def render_toc_page(ncode: str, config: MockSiteConfig, page: int = 1) -> str:
+    """Render a novel main page with the summary and one page of the chapter list."""
+    rng = _novel_rng(ncode)
+    first = (page - 1) * TOC_PAGE_SIZE + 1
+    last = min(config.chapters, page * TOC_PAGE_SIZE)
+    chapter_links = ""
+    for number in range(first, last + 1):
+        parts = chapter_parts(ncode, number, config)
+        if parts["volume"]:
+            chapter_links += (
+                f'<div class="p-eplist__chapter-title">{escape(parts["volume"])}</div>'
+            )
+        chapter_links += (
+            f'<div class="p-eplist__sublist"><a href="/{ncode}/{number}/" '
+            f'class="p-eplist__subtitle">{escape(parts["title"])}</a></div>'
+        )
+    next_link = (
+        f'<a href="/{ncode}/?p={page + 1}" class="c-pager__item c-pager__item--next">次へ</a>'
+        if last < config.chapters
+        else ""
+    )
+    text_download = (
+        f'<a href="/txtdownload/top/ncode/{text_download_id(ncode)}/">TXTダウンロード</a>'
+        if config.text_download
+        else ""
+    )
+    return (
+        _page_start(config) + f'<h1 class="p-novel__title">モック小説 {ncode}</h1>'
+        f'<div id="novel_ex" class="p-novel__summary">{escape(_make_text(rng, 400))}</div>'
+        f'<div class="p-eplist">{chapter_links}</div>'
+        f'<div class="c-pager">{next_link}</div>'
+        f"{text_download}"
+        "</body></html>"
+    )
+
+
+def render_chapter_page(ncode: str, chapter_number: int, config: MockSiteConfig) -> str:
+    """Render a chapter page with the markup the spiders select on."""
+    parts = chapter_parts(ncode, chapter_number, config)
+    text_lines = "".join(
+        f'<p id="L{index}">{escape(line)}</p>'
+        for index, line in enumerate(parts["text"].split("\n"), start=1)
+    )
+    volume = f"<span>{parts['volume']}</span>" if parts["volume"] else ""
+    foreword = (
+        '<div class="js-novel-text p-novel__text--preface">'
+        f'<p id="Lp1">{escape(parts["foreword"])}</p></div>'
+        if parts["foreword"]
+        else ""
+    )
+    afterword = (
+        '<div class="js-novel-text p-novel__text--afterword">'
+        f'<p id="La1">{escape(parts["afterword"])}</p></div>'
+        if parts["afterword"]
+        else ""
+    )
+    next_link = (
+        f'<a href="/{ncode}/{chapter_number + 1}/" class="c-pager__item c-pager__item--next">次へ</a>'
+        if chapter_number < config.chapters
+        else ""
+    )
+    return (
+        _page_start(config) + '<div class="c-announce-box"><div class="c-announce">'
+        f'<a href="/">トップ</a><a href="/{ncode}/">モック小説 {ncode}</a>'
+        f"</div>{volume}</div>"
+        '<article class="p-novel">'
+        f'<div class="p-novel__number">{chapter_number}/{config.chapters}</div>'
+        f'<h1 class="p-novel__title p-novel__title--rensai">{escape(parts["title"])}</h1>'
+        '<div class="p-novel__body">'
+        f"{foreword}"
+        f'<div class="js-novel-text p-novel__text">{text_lines}</div>'
+        f"{afterword}"
+        "</div></article>"
+        f'<div class="c-pager">{next_link}</div>'
+        "</body></html>"
+    )
+
+
+def render_chapter_text(ncode: str, chapter_number: int, config: MockSiteConfig) -> str:
+    """Render the plain-text export of a chapter."""
+    parts = chapter_parts(ncode, chapter_number, config)
+    sections = []
+    if parts["foreword"]:
+        sections += [parts["foreword"], FOREWORD_SEPARATOR]
+    sections.append(parts["text"])
+    if parts["afterword"]:
+        sections += [AFTERWORD_SEPARATOR, parts["afterword"]]
+    return "\n".join(sections) + "\n"
+
+
+def render_age_gate(path: str, config: MockSiteConfig) -> str:
+    """Render the Nocturne age confirmation page."""
+    return (
+        _page_start(config) + "<div id='modal'>"
+        f'<a id="yes18" href="{escape(path)}?over18=yes">Enter</a>'
+        '<a id="no18" href="/">Leave</a>'
+        "</div></body></html>"
+    )
+
+
+def render_api_response(query: dict, config: MockSiteConfig) -> bytes:
+    """Answer a novel API query like api.syosetu.com, every ncode exists."""
+    ncodes = [code.lower() for code in query.get("ncode", [""])[0].split("-") if code]
+    rows = [{"allcount": len(ncodes)}] + [
+        {
+            "title": f"モック小説 {ncode}",
+            "ncode": ncode.upper(),
+            "general_all_no": config.chapters,
+            "novelupdated_at": "2025-01-01 12:00:00",
+            "general_firstup": "2024-01-01 12:00:00",
+            "general_lastup": "2025-01-01 12:00:00",
+        }
+        for ncode in ncodes
+    ]
+    body = json.dumps(rows, ensure_ascii=False).encode("utf-8")
+    # gzip=N asks for a gzip compressed body, the same as the real API
+    return gzip.compress(body) if query.get("gzip") else body
+
+
+def _parse_path(path: str) -> Tuple[Optional[str], Optional[int]]:
+    """Split '/n1234ab/5/' into novel code and chapter number."""
+    parts = [part for part in path.split("/") if part]
+    if not parts:
+        return None, None
+    if len(parts) == 1:
+        return parts[0], None
+    if parts[1].isdigit():
+        return parts[0], int(parts[1])
+    return parts[0], None
+
+
+class MockSiteHandler(BaseHTTPRequestHandler):
+    """Serve generated novels, the config lives on the server instance."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str, content_type: str = "text/html"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_bytes(self, status: int, data: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        config: MockSiteConfig = self.server.config
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+        if config.error_rate and random.random() < config.error_rate:
+            self._send(503, "<html><body>Service Unavailable</body></html>")
+            return
+
+        url = urlsplit(self.path)
+        if url.path == "/robots.txt":
+            self._send(200, "User-agent: *\nAllow: /\n", "text/plain")
+            return
+
+        if url.path in ("/novelapi/api/", "/novel18api/api/"):
+            body = render_api_response(parse_qs(url.query), config)
+            self._send_bytes(200, body, "application/json")
+            return
+
+        if url.path.startswith("/txtdownload/dlstart/ncode/"):
+            query = parse_qs(url.query)
+            novel_id = url.path.rstrip("/").split("/")[-1]
+            chapter_number = int(query.get("no", ["0"])[0])
+            if not config.text_download or not 1 <= chapter_number <= config.chapters:
+                self._send(404, "<html><body>Not Found</body></html>")
+                return
+            text = render_chapter_text(
+                ncode_from_text_download_id(novel_id), chapter_number, config
+            )
+            self._send(200, text, "text/plain")
+            return
+
+        if url.path.startswith("/static/"):
+            asset = STATIC_ASSETS.get(url.path[len("/static/") :])
+            if asset is None:
+                self._send(404, "<html><body>Not Found</body></html>")
+            else:
+                self._send_bytes(200, asset[1], asset[0])
+            return
+
+        over18 = parse_qs(url.query).get("over18") == ["yes"] or "over18=yes" in (
+            self.headers.get("Cookie") or ""
+        )
+        if config.age_gate and not over18:
+            self._send(200, render_age_gate(url.path, config))
+            return
+
+        ncode, chapter_number = _parse_path(url.path)
+        if ncode is None:
+            self._send(200, "<html><body>mock syosetu</body></html>")
+        elif chapter_number is None:
+            page = int(parse_qs(url.query).get("p", ["1"])[0])
+            self._send(200, render_toc_page(ncode, config, page))
+        elif 1 <= chapter_number <= config.chapters:
+            self._send(200, render_chapter_page(ncode, chapter_number, config))
+        else:
+            self._send(404, "<html><body>Not Found</body></html>")
+
+
+def start_mock_site(
+    config: MockSiteConfig, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    """Start the mock site on a background thread and return the server.
+
+    Use port 0 to pick a free port, the bound port is server.server_address[1].
+    """
+    server = ThreadingHTTPServer((host, port), MockSiteHandler)
+    server.daemon_threads = True
+    server.config = config
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@app.command()
+def serve(
+    port: int = typer.Option(8800, "--port", "-p", help="Port to listen on"),
+    chapters: int = typer.Option(100, "--chapters", "-c", help="Chapters per novel"),
+    chapter_chars: int = typer.Option(
+        3000, "--chapter-chars", help="Approximate characters per chapter"
+    ),
+    latency: float = typer.Option(0.0, "--latency", help="Base latency in seconds"),
+    jitter: float = typer.Option(
+        0.0, "--jitter", help="Random extra latency in seconds"
+    ),
+    error_rate: float = typer.Option(
+        0.0, "--error-rate", help="Fraction of requests answered with 503"
+    ),
+    age_gate: bool = typer.Option(
+        False, "--age-gate", help="Serve the Nocturne #yes18 age gate"
+    ),
+    text_download: bool = typer.Option(
+        True,
+        "--text-download/--no-text-download",
+        help="Offer the plain-text chapter download",
+    ),
+    assets: bool = typer.Option(
+        False, "--assets", help="Link a stylesheet, a font and images from pages"
+    ),
+):
+    """Serve generated novels at http://127.0.0.1:PORT/<ncode>/."""
+    config = MockSiteConfig(
+        chapters=chapters,
+        chapter_chars=chapter_chars,
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+        age_gate=age_gate,
+        text_download=text_download,
+        assets=assets,
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockSiteHandler)
+    server.config = config
+    typer.echo(f"Mock site listening on http://127.0.0.1:{port}/n0000aa/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    app()
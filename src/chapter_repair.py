@@ -0,0 +1,87 @@
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from novel_store import scan_chapters
+from syosetu_api import NCODE_PATTERN, NOVEL_URLS, site_of
+
+
+@dataclass
+class NovelGaps:
+    """Chapters missing from a stored novel file."""
+
+    ncode: str
+    site: str
+    filepath: str
+    chapter_total: int
+    novel_description: str = ""
+    missing: List[int] = field(default_factory=list)
+
+
+def missing_chapters(chapters: List[int], chapter_total: int) -> List[int]:
+    """Chapter numbers from 1 to chapter_total that are not in chapters."""
+    stored = set(chapters)
+    return [number for number in range(1, chapter_total + 1) if number not in stored]
+
+
+def find_gaps(jsonl_files: List[str]) -> List[NovelGaps]:
+    """Find holes and missing last chapters of stored novels.
+
+    Each file is checked against the highest chapter_start_end total it holds,
+    chapters released after the last crawl are left to sync-check.
+    """
+    gaps = []
+    for filepath in jsonl_files:
+        novel = scan_chapters(filepath)
+        missing = missing_chapters(novel["chapters"], novel["chapter_total"])
+        # Files from before novel_code was stored are named by ncode
+        name = os.path.basename(filepath).split(".")[0].lower()
+        ncode = novel["novel_code"] or (name if NCODE_PATTERN.match(name) else "")
+        if not ncode or not missing:
+            continue
+        gaps.append(
+            NovelGaps(
+                ncode=ncode,
+                site=site_of(filepath),
+                filepath=filepath,
+                chapter_total=novel["chapter_total"],
+                novel_description=novel["novel_description"],
+                missing=missing,
+            )
+        )
+    return gaps
+
+
+def repair_targets(
+    gaps: List[NovelGaps], base_url: Optional[str] = None
+) -> Dict[str, Dict]:
+    """Build the repair spider argument, {novel_code: target}, for one site.
+
+    Args:
+        gaps (list): Novels of a single site.
+        base_url (str): Host to fetch from instead of the site, e.g. a mock site.
+    """
+    targets = {}
+    for novel in gaps:
+        url = NOVEL_URLS[novel.site].format(ncode=novel.ncode)
+        if base_url:
+            url = f"{base_url.rstrip('/')}/{novel.ncode}/"
+        targets[novel.ncode] = {
+            "url": url,
+            "path": novel.filepath,
+            "chapters": novel.missing,
+            "novel_description": novel.novel_description,
+        }
+    return targets
+
+
+def format_ranges(numbers: List[int]) -> str:
+    """Write sorted chapter numbers as ranges, [3, 4, 5, 9] -> '3-5, 9'."""
+    ranges = []
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(
+        f"{start}-{end}" if start != end else str(start) for start, end in ranges
+    )
@@ -0,0 +1,201 @@
+import gzip
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from novel_package import Chapter, NovelPackage
+from novel_store import decode_metadata, expand_record, is_header
+from utils_translate import translate_title
+from profiling import NULL_PROFILER
+
+# Planned chunks handed to a worker process at a time
+RENDER_BATCH = 8
+
+
+@dataclass
+class PlannedChunk:
+    """One output file of the NovelPackage engine, planned before any text is read.
+
+    Offsets are (offset, length) of the chapter lines in the uncompressed
+    stream, so a worker can render the chunk without the rest of the file.
+    """
+
+    start: int
+    end: int
+    novel_title: str
+    novel_description: str
+    chapter_numbers: List[int] = field(default_factory=list)
+    offsets: List[Tuple[int, int]] = field(default_factory=list)
+
+
+def plan_chunks(
+    filepath: str, output_chapter_length: int = 10, profiler=NULL_PROFILER
+) -> List[PlannedChunk]:
+    """Plan the chunks process_jsonl_file would write for a .jl or .jl.gz file.
+
+    Runs the chunk counters of NovelPackage over the chapter metadata only, so
+    skip patterns, --length and the last chapter give the same boundaries.
+    Chapters after the last planned chunk are left out, as they are today.
+    """
+    novel = NovelPackage(
+        filepath_jl=filepath,
+        directory_path="",
+        output_chapter_length=output_chapter_length,
+    )
+    chunks: List[PlannedChunk] = []
+    numbers: List[int] = []
+    offsets: List[Tuple[int, int]] = []
+    header = None
+    offset = 0
+    opener = gzip.open if filepath.endswith(".gz") else open
+    with opener(filepath, "rb") as f:
+        for line in profiler.iterate("read_decode", f):
+            line_offset, offset = offset, offset + len(line)
+            # isspace stops at the first visible byte, strip would copy the line
+            if line.isspace():
+                continue
+            record = decode_metadata(line)
+            if is_header(record):
+                header = record
+                continue
+            record = expand_record(record, header)
+            chapter_number = int(record["chapter_number"])
+
+            with profiler.stage("skip_check"):
+                chapter = Chapter(
+                    chapter_number=chapter_number,
+                    chapter_title=record.get("chapter_title"),
+                )
+                skip_chapter = chapter.check_skip_chapter()
+            if skip_chapter:
+                novel.process_chunk_position(chapter_number)
+                continue
+
+            with profiler.stage("chunk_assembly"):
+                novel.lastest_chapter = int(record["chapter_start_end"].split("/")[1])
+                numbers.append(chapter_number)
+                offsets.append((line_offset, len(line)))
+                novel.check_start_new_chunk(chapter_number)
+                if novel.should_write_chunk(chapter_number):
+                    chunks.append(
+                        PlannedChunk(
+                            start=novel.current_chapter_number,
+                            end=chapter_number,
+                            novel_title=record.get("novel_title", ""),
+                            novel_description=record.get("novel_description", ""),
+                            chapter_numbers=numbers,
+                            offsets=offsets,
+                        )
+                    )
+                    numbers, offsets = [], []
+    return chunks
+
+
+def _chunk_text(prefix: str, lines: List[bytes]) -> str:
+    chapters = []
+    for line in lines:
+        data = json.loads(line)
+        chapters.append(
+            Chapter(
+                chapter_number=int(data.get("chapter_number")),
+                volume_title=data.get("volume_title"),
+                chapter_title=data.get("chapter_title"),
+                chapter_foreword=data.get("chapter_foreword"),
+                chapter_text=data.get("chapter_text"),
+                chapter_afterword=data.get("chapter_afterword"),
+            ).get_chapter_text()
+        )
+    return prefix + "".join(chapters)
+
+
+def _render_chunks(tasks: List[Tuple[str, List[Tuple[int, int]], str, str]]) -> int:
+    """Read, render and write planned chunks of an uncompressed file.
+
+    Runs in a worker process, each task is (filepath, offsets, prefix, output path).
+    """
+    for filepath, offsets, prefix, file_path in tasks:
+        lines = []
+        with open(filepath, "rb") as f:
+            for offset, length in offsets:
+                f.seek(offset)
+                lines.append(f.read(length))
+        with open(file_path, "w", encoding="utf-8") as output:
+            output.write(_chunk_text(prefix, lines))
+    return len(tasks)
+
+
+def render_planned_chunks(
+    filepath: str,
+    chunks: List[PlannedChunk],
+    output_chapter_length: int = 10,
+    workers: Optional[int] = 1,
+    profiler=NULL_PROFILER,
+) -> None:
+    """Render and write planned chunks, on a pool of worker processes if asked.
+
+    Titles are translated once here, not per chunk. Compressed files cannot be
+    read at random offsets, so they are rendered in this process in one
+    forward pass.
+    """
+    novel = NovelPackage(
+        filepath_jl=filepath,
+        directory_path="",
+        output_chapter_length=output_chapter_length,
+    )
+    english_titles: Dict[str, str] = {}
+    tasks = []
+    for chunk in chunks:
+        if chunk.novel_title not in english_titles:
+            with profiler.stage("translate"):
+                english_titles[chunk.novel_title] = translate_title(chunk.novel_title)
+        novel.novel_title = chunk.novel_title
+        novel.novel_description = chunk.novel_description
+        chapter_start_end, prefix = novel.add_chapter_prefix_start_end(
+            chunk.start, chunk.end
+        )
+        file_path = novel.chunk_file_path(
+            chapter_start_end, chunk.novel_title, english_titles[chunk.novel_title]
+        )
+        tasks.append((filepath, chunk.offsets, prefix, file_path))
+
+    if filepath.endswith(".gz") or workers == 1 or len(tasks) < 2:
+        opener = gzip.open if filepath.endswith(".gz") else open
+        with opener(filepath, "rb") as f:
+            for _, offsets, prefix, file_path in tasks:
+                lines = []
+                with profiler.stage("read_decode"):
+                    for offset, length in offsets:
+                        # Chunks are in file order, so gzip only ever seeks forward
+                        f.seek(offset)
+                        lines.append(f.read(length))
+                with profiler.stage("chunk_assembly"):
+                    text_content = _chunk_text(prefix, lines)
+                with profiler.stage("write"):
+                    with open(file_path, "w", encoding="utf-8") as output:
+                        output.write(text_content)
+        return
+
+    batches = [
+        tasks[start : start + RENDER_BATCH]
+        for start in range(0, len(tasks), RENDER_BATCH)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for _ in profiler.iterate("write", executor.map(_render_chunks, batches)):
+            pass
+
+
+def process_jsonl_file_planned(
+    filepath_jl: str,
+    output_chapter_length: int = 10,
+    workers: Optional[int] = 1,
+    profiler=NULL_PROFILER,
+) -> List[PlannedChunk]:
+    """process_jsonl_file as two phases: plan the chunks, then render them in parallel.
+
+    Writes the same files as process_jsonl_file and returns the plan.
+    """
+    chunks = plan_chunks(filepath_jl, output_chapter_length, profiler=profiler)
+    render_planned_chunks(
+        filepath_jl, chunks, output_chapter_length, workers, profiler=profiler
+    )
+    return chunks
@@ -0,0 +1,426 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+from scrapy.crawler import CrawlerRunner
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.log import configure_logging
+from scrapy.utils.reactor import install_reactor
+from twisted.internet.defer import Deferred
+from crawl_workers import SPIDERS
+from feed_watch import WATCH_STATE_FILENAME, FeedWatcher
+from novel_store import novel_code_from_url
+from syosetu_api import (
+    API_BASE_URL,
+    NOVEL_URLS,
+    LocalNovel,
+    compare_library,
+    find_local_novels,
+    site_of,
+)
+from syosetu_spider.parse_pool import shutdown_parse_pool
+from typer_func import find_jsonl_files, get_new_directory
+from utils_translate import close_title_translator, use_title_translator
+
+DAEMON_SOCKET_FILENAME = "daemon.sock"
+JOB_KINDS = ["crawl", "unpack", "sync"]
+# Finished jobs kept for the status request
+FINISHED_JOBS_KEPT = 100
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DaemonJob:
+    """A crawl, unpack or sync job run by the daemon."""
+
+    id: int
+    kind: str
+    novel_code: str = ""
+    url: str = ""
+    start_chapter: int = 0
+    status: str = "queued"
+    result: str = ""
+    error: str = ""
+    submitted: float = field(default_factory=time.time)
+    started: float = 0.0
+    finished: float = 0.0
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.kind, self.novel_code
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _ncode_of_path(filepath: str) -> str:
+    return os.path.basename(filepath).split(".")[0].lower()
+
+
+class CrawlDaemon:
+    """Run crawl, unpack and sync jobs in one long-running process.
+
+    Crawls are crawlers of one CrawlerRunner on a reactor that is started
+    once, and the parse pool, the title translation client and the catalog of
+    stored novels stay warm between jobs, so a job starts in milliseconds
+    instead of paying the interpreter, Scrapy and translator startup.
+
+    Jobs come from the sync schedule and from clients on a Unix socket. A job
+    for a novel that already has a job of the same kind queued or running is
+    answered with that job, and the jobs of one novel run one at a time, so a
+    crawl and an unpack never work on the same file at once. Unpacking is
+    incremental, with the FeedWatcher state unpack3 --watch keeps.
+    """
+
+    def __init__(
+        self,
+        settings,
+        socket_path: str,
+        sync_interval: float = 0.0,
+        api_url: str = API_BASE_URL,
+        base_url: Optional[str] = None,
+        unpack: bool = False,
+        length: int = 10,
+        max_crawls: int = 2,
+    ):
+        self.settings = settings
+        self.socket_path = socket_path
+        self.sync_interval = sync_interval
+        self.api_url = api_url
+        self.base_url = base_url
+        self.unpack_after_crawl = unpack
+        self.storage_directory = os.path.expanduser(
+            settings.get("NOVEL_STORAGE_DIR", "~/storage_jl")
+        )
+        self.extension = (
+            ".jl.gz" if settings.get("NOVEL_STORAGE_COMPRESSION") == "gzip" else ".jl"
+        )
+        self.runner = CrawlerRunner(settings)
+        self.crawl_slots = asyncio.Semaphore(max_crawls)
+        # FeedWatcher is not thread safe, unpack jobs run one after another
+        self.unpack_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="daemon-unpack"
+        )
+        text_directory = f"{self.storage_directory}_text"
+        self.watcher = FeedWatcher(
+            self.storage_directory,
+            output_directory=lambda file: get_new_directory(
+                file,
+                os.path.dirname(text_directory),
+                self.storage_directory,
+                os.path.basename(text_directory),
+            ),
+            state_path=os.path.join(text_directory, WATCH_STATE_FILENAME),
+            chunk_size=length,
+            log=logger.info,
+        )
+        self.catalog: Dict[str, LocalNovel] = {}
+        self.jobs: Dict[int, DaemonJob] = {}
+        self.tasks: Dict[int, asyncio.Future] = {}
+        # Queued or running job per (kind, novel code)
+        self.pending: Dict[Tuple[str, str], DaemonJob] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.next_id = 1
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.scheduler: Optional[asyncio.Future] = None
+        self.stopping = False
+        self.started = time.time()
+
+    def novel_path(self, site: str, novel_code: str) -> str:
+        """File the storage pipeline writes a novel to."""
+        return os.path.join(
+            self.storage_directory,
+            SPIDERS[site].name,
+            f"{novel_code}{self.extension}",
+        )
+
+    def novel_url(self, site: str, novel_code: str) -> str:
+        if self.base_url:
+            return urljoin(self.base_url, f"/{novel_code}/")
+        return NOVEL_URLS[site].format(ncode=novel_code)
+
+    async def load_catalog(self, paths: Optional[List[str]] = None) -> None:
+        """Read the chapter numbers of the given files, or of the whole storage directory.
+
+        Novels with a job running keep their entry, their index may be
+        half written.
+        """
+        loop = asyncio.get_running_loop()
+        if paths is None:
+            paths = await loop.run_in_executor(
+                None, find_jsonl_files, self.storage_directory
+            )
+            busy = {code for code, lock in self.locks.items() if lock.locked()}
+            paths = [path for path in paths if _ncode_of_path(path) not in busy]
+        paths = [path for path in paths if os.path.exists(path)]
+        novels = await loop.run_in_executor(None, find_local_novels, paths)
+        self.catalog.update({novel.ncode: novel for novel in novels})
+
+    def submit(
+        self, kind: str, novel_code: str = "", url: str = "", start_chapter: int = 0
+    ) -> DaemonJob:
+        """Queue a job, or return the queued or running job that does the same."""
+        if self.stopping:
+            raise ValueError("Daemon is stopping")
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job: {kind}, one of {', '.join(JOB_KINDS)}")
+        novel_code = novel_code.lower()
+        if kind == "crawl":
+            if not url:
+                if not novel_code:
+                    raise ValueError("A crawl job needs a novel URL or code")
+                novel = self.catalog.get(novel_code)
+                url = self.novel_url(novel.site if novel else "syosetu", novel_code)
+            novel_code = novel_code_from_url(url).lower()
+        elif kind == "unpack":
+            if novel_code and novel_code not in self.catalog:
+                raise ValueError(f"No stored novel {novel_code}")
+        else:
+            novel_code = ""
+        job = self.pending.get((kind, novel_code))
+        if job is not None:
+            return job
+        job = DaemonJob(
+            id=self.next_id,
+            kind=kind,
+            novel_code=novel_code,
+            url=url,
+            start_chapter=start_chapter,
+        )
+        self.next_id += 1
+        self.jobs[job.id] = job
+        self.pending[job.key] = job
+        self.tasks[job.id] = asyncio.ensure_future(self.run_job(job))
+        return job
+
+    async def run_job(self, job: DaemonJob) -> DaemonJob:
+        handler = {"crawl": self.crawl, "unpack": self.unpack, "sync": self.sync}
+        try:
+            if job.novel_code:
+                lock = self.locks.setdefault(job.novel_code, asyncio.Lock())
+                async with lock:
+                    job.status, job.started = "running", time.time()
+                    job.result = await handler[job.kind](job)
+            else:
+                job.status, job.started = "running", time.time()
+                job.result = await handler[job.kind](job)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.exception(f"Job {job.id} {job.kind} {job.novel_code} failed")
+            job.status, job.error = "failed", str(e) or type(e).__name__
+        finally:
+            job.finished = time.time()
+            del self.pending[job.key]
+            del self.tasks[job.id]
+            self.forget_finished_jobs()
+        logger.info(
+            f"Job {job.id} {job.kind} {job.novel_code} {job.status} in "
+            f"{job.finished - job.started:.3f}s: {job.result or job.error}"
+        )
+        return job
+
+    def forget_finished_jobs(self) -> None:
+        finished = [job.id for job in self.jobs.values() if job.finished]
+        for job_id in finished[:-FINISHED_JOBS_KEPT]:
+            del self.jobs[job_id]
+
+    async def crawl(self, job: DaemonJob) -> str:
+        site = site_of(job.url)
+        spider_class = SPIDERS[site]
+        spider_kwargs = {
+            "start_urls": job.url,
+            # So jobs against a mock site are not filtered as offsite
+            "allowed_domains": [
+                *spider_class.allowed_domains,
+                urlparse(job.url).hostname,
+            ],
+        }
+        if job.start_chapter:
+            spider_kwargs["start_chapter"] = job.start_chapter
+        async with self.crawl_slots:
+            if self.stopping:
+                raise RuntimeError("Daemon is stopping")
+            crawler = self.runner.create_crawler(spider_class)
+            await maybe_deferred_to_future(self.runner.crawl(crawler, **spider_kwargs))
+        path = self.novel_path(site, job.novel_code)
+        await self.load_catalog([path])
+        stats = crawler.stats.get_stats()
+        reason = stats.get("finish_reason")
+        if reason != "finished":
+            raise RuntimeError(f"crawl finished with {reason}")
+        result = f"{stats.get('item_scraped_count', 0)} chapters stored"
+        if self.unpack_after_crawl and os.path.exists(path):
+            chunks = await self.unpack_files([path])
+            result += f", {chunks} chunks written"
+        return result
+
+    async def unpack_files(self, paths: List[str]) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.unpack_executor, self.watcher.update, set(paths)
+        )
+
+    async def unpack(self, job: DaemonJob) -> str:
+        if job.novel_code:
+            paths = [self.catalog[job.novel_code].filepath]
+        else:
+            # Unpacking reads only complete lines, files being crawled are safe
+            paths = self.watcher.feeds()
+        chunks = await self.unpack_files(paths)
+        return f"{chunks} chunks written from {len(paths)} files"
+
+    async def sync(self, job: DaemonJob) -> str:
+        await self.load_catalog()
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            None,
+            partial(
+                compare_library, list(self.catalog.values()), base_url=self.api_url
+            ),
+        )
+        crawls = [
+            self.submit(
+                "crawl",
+                url=self.novel_url(entry["site"], entry["ncode"]),
+                start_chapter=entry["start_chapter"],
+            )
+            for entry in results
+            if entry["status"] == "new_chapters"
+        ]
+        return f"{len(crawls)} of {len(results)} novels have new chapters"
+
+    async def schedule_syncs(self) -> None:
+        while True:
+            self.submit("sync")
+            await asyncio.sleep(self.sync_interval)
+
+    def status(self) -> Dict:
+        return {
+            "uptime": round(time.time() - self.started, 3),
+            "novels": len(self.catalog),
+            "jobs": [job.to_dict() for job in self.jobs.values()],
+        }
+
+    async def handle_request(self, request: Dict) -> Dict:
+        kind = request.get("job")
+        if kind == "status":
+            return {"ok": True, **self.status()}
+        job = self.submit(
+            kind,
+            novel_code=request.get("novel") or "",
+            url=request.get("url") or "",
+            start_chapter=int(request.get("start_chapter") or 0),
+        )
+        task = self.tasks.get(job.id)
+        if request.get("wait") and task is not None:
+            # A client that disconnects does not cancel the job
+            await asyncio.shield(task)
+        return {"ok": True, "job": job.to_dict()}
+
+    async def handle_client(self, reader, writer) -> None:
+        """Answer requests, one JSON object per line, until the client disconnects."""
+        try:
+            while line := await reader.readline():
+                try:
+                    response = await self.handle_request(json.loads(line))
+                except (ValueError, TypeError, AttributeError) as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(response, ensure_ascii=False).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        await self.load_catalog()
+        if os.path.exists(self.socket_path):
+            # Left behind by a daemon that did not exit cleanly
+            os.unlink(self.socket_path)
+        self.server = await asyncio.start_unix_server(
+            self.handle_client, path=self.socket_path
+        )
+        os.chmod(self.socket_path, 0o600)
+        if self.sync_interval:
+            self.scheduler = asyncio.ensure_future(self.schedule_syncs())
+        logger.info(
+            f"Daemon listening on {self.socket_path}, {len(self.catalog)} novels stored"
+        )
+
+    async def stop(self) -> None:
+        """Stop running crawls, cancel queued jobs and release the warm resources."""
+        self.stopping = True
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+        if self.server is not None:
+            self.server.close()
+        for job_id, task in list(self.tasks.items()):
+            if self.jobs[job_id].status == "queued":
+                task.cancel()
+        await maybe_deferred_to_future(self.runner.stop())
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.unpack_executor.shutdown)
+        close_title_translator()
+        shutdown_parse_pool()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def daemon_running(socket_path: str) -> bool:
+    """Whether a daemon answers on socket_path."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+    return True
+
+
+def send_request(socket_path: str, request: Dict) -> Dict:
+    """Send one request to the daemon and return its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request, ensure_ascii=False).encode() + b"\n")
+        with client.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("Daemon closed the connection")
+    return json.loads(line)
+
+
+def run_daemon(settings, socket_path: str, **options) -> None:
+    """Run the daemon until it gets SIGINT or SIGTERM."""
+    # Crawls finish one after another, the pool is kept for the next one
+    settings.set("PARSE_POOL_KEEP_ALIVE", True, priority="cmdline")
+    install_reactor(settings["TWISTED_REACTOR"], settings["ASYNCIO_EVENT_LOOP"])
+    configure_logging(settings)
+    use_title_translator()
+    daemon = CrawlDaemon(settings, socket_path, **options)
+    from twisted.internet import reactor
+
+    def start():
+        def failed(failure):
+            logger.error(f"Daemon did not start: {failure.getErrorMessage()}")
+            reactor.stop()
+
+        Deferred.fromFuture(asyncio.ensure_future(daemon.start())).addErrback(failed)
+
+    reactor.callWhenRunning(start)
+    reactor.addSystemEventTrigger(
+        "before",
+        "shutdown",
+        lambda: Deferred.fromFuture(asyncio.ensure_future(daemon.stop())),
+    )
+    reactor.run()
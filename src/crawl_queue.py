@@ -0,0 +1,247 @@
+import os
+import time
+import sqlite3
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+from urllib.error import URLError
+from novel_store import novel_code_from_url
+from syosetu_api import API_BASE_URL, SyosetuApiClient, site_of
+
+QUEUE_FILENAME = "crawl_queue.sqlite3"
+JOB_STATUSES = ["pending", "leased", "done", "failed"]
+
+
+@dataclass
+class CrawlJob:
+    """A novel, or a chapter range of a novel, to crawl.
+
+    A start or end chapter of 0 means the first or the last chapter.
+    """
+
+    id: int
+    site: str
+    url: str
+    start_chapter: int = 0
+    end_chapter: int = 0
+    attempts: int = 0
+
+    @property
+    def novel_code(self) -> str:
+        return novel_code_from_url(self.url)
+
+
+class CrawlQueue:
+    """SQLite job queue shared by the crawl worker processes.
+
+    Workers lease a job for lease_seconds and renew the lease while its crawl
+    runs. A job whose worker died becomes available again once the lease has
+    run out. Failed jobs go back to pending after retry_delay seconds times
+    the attempts so far, until max_attempts is reached.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3, retry_delay: float = 30.0):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # Autocommit, leases open their own BEGIN IMMEDIATE transaction
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                site TEXT,
+                url TEXT,
+                start_chapter INTEGER,
+                end_chapter INTEGER,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                worker TEXT,
+                lease_expires REAL,
+                available_at REAL DEFAULT 0,
+                path TEXT,
+                error TEXT,
+                updated_at REAL,
+                UNIQUE (url, start_chapter, end_chapter)
+            )""")
+
+    def add(
+        self, site: str, url: str, start_chapter: int = 0, end_chapter: int = 0
+    ) -> None:
+        """Queue a job, a finished or failed job with the same range is queued again."""
+        self.connection.execute(
+            "INSERT INTO jobs (site, url, start_chapter, end_chapter, status, updated_at) "
+            "VALUES (?, ?, ?, ?, 'pending', ?) "
+            "ON CONFLICT (url, start_chapter, end_chapter) DO UPDATE SET "
+            "status = 'pending', attempts = 0, available_at = 0, error = NULL "
+            "WHERE status IN ('done', 'failed')",
+            (site, url, start_chapter, end_chapter, time.time()),
+        )
+
+    def lease(self, worker: str, lease_seconds: float) -> Optional[CrawlJob]:
+        """Take the oldest available job, None if there is none right now."""
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            # A lease that ran out means the worker died, that counts as an attempt
+            self.connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' "
+                "ELSE 'pending' END, worker = NULL, error = 'lease expired', "
+                "updated_at = ? WHERE status = 'leased' AND lease_expires < ?",
+                (self.max_attempts, now, now),
+            )
+            row = self.connection.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' AND available_at <= ? "
+                "ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is not None:
+                self.connection.execute(
+                    "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (worker, now + lease_seconds, now, row["id"]),
+                )
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return CrawlJob(
+            id=row["id"],
+            site=row["site"],
+            url=row["url"],
+            start_chapter=row["start_chapter"],
+            end_chapter=row["end_chapter"],
+            attempts=row["attempts"] + 1,
+        )
+
+    def renew(self, job_ids: Iterable[int], worker: str, lease_seconds: float) -> None:
+        """Extend the leases a worker still holds."""
+        now = time.time()
+        self.connection.executemany(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+            "WHERE id = ? AND worker = ? AND status = 'leased'",
+            [(now + lease_seconds, now, job_id, worker) for job_id in job_ids],
+        )
+
+    def set_path(self, job_id: int, worker: str, path: str) -> None:
+        """Record the file a job writes to, before its crawl appends anything."""
+        self.connection.execute(
+            "UPDATE jobs SET path = ? WHERE id = ? AND worker = ?",
+            (path, job_id, worker),
+        )
+
+    def complete(self, job_id: int, worker: str, path: str) -> None:
+        self.connection.execute(
+            "UPDATE jobs SET status = 'done', worker = NULL, path = ?, error = NULL, "
+            "updated_at = ? WHERE id = ? AND worker = ?",
+            (path, time.time(), job_id, worker),
+        )
+
+    def fail(self, job_id: int, worker: str, error: str) -> None:
+        """Give a job back for a retry after a delay, or mark it failed for good."""
+        now = time.time()
+        self.connection.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' "
+            "ELSE 'pending' END, available_at = ? + ? * attempts, worker = NULL, "
+            "error = ?, updated_at = ? WHERE id = ? AND worker = ?",
+            (self.max_attempts, now, self.retry_delay, error, now, job_id, worker),
+        )
+
+    def release(self, job_id: int, worker: str) -> None:
+        """Give a job back without counting the attempt, when a worker shuts down."""
+        self.connection.execute(
+            "UPDATE jobs SET status = 'pending', attempts = attempts - 1, "
+            "worker = NULL, updated_at = ? WHERE id = ? AND worker = ?",
+            (time.time(), job_id, worker),
+        )
+
+    def has_work(self) -> bool:
+        """Whether jobs are pending, waiting for a retry or still leased."""
+        row = self.connection.execute(
+            "SELECT 1 FROM jobs WHERE status IN ('pending', 'leased') LIMIT 1"
+        ).fetchone()
+        return row is not None
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        for row in self.connection.execute(
+            "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+        ):
+            counts[row[0]] = row[1]
+        return counts
+
+    def failed(self) -> List[Dict]:
+        return [
+            dict(row)
+            for row in self.connection.execute(
+                "SELECT * FROM jobs WHERE status = 'failed' ORDER BY id"
+            )
+        ]
+
+    def paths(self, since: float = 0.0) -> List[str]:
+        """Files written by jobs since a point in time, done, failed or given back.
+
+        Failed and expired range jobs can have appended chapters as well.
+        """
+        return [
+            row[0]
+            for row in self.connection.execute(
+                "SELECT DISTINCT path FROM jobs "
+                "WHERE path IS NOT NULL AND updated_at >= ?",
+                (since,),
+            )
+        ]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def chapter_ranges(total: int, range_size: int) -> List[List[int]]:
+    """Split chapters 1 to total into [start, end] ranges, the last one left open."""
+    ranges = [
+        [start, start + range_size - 1] for start in range(1, total + 1, range_size)
+    ]
+    if ranges:
+        # Chapters released after the totals were fetched go to the last range
+        ranges[-1][1] = 0
+    return ranges
+
+
+def queue_novels(
+    queue: CrawlQueue,
+    urls: List[str],
+    range_size: int = 0,
+    api_url: str = API_BASE_URL,
+) -> int:
+    """Add novel URLs to the queue, split into chapter range jobs if range_size is set.
+
+    Chapter totals come from the Syosetu API. Novels it does not know, or all
+    of them if it cannot be reached, are queued as one job each.
+
+    Returns:
+        int: Number of jobs queued.
+    """
+    totals: Dict[str, int] = {}
+    if range_size:
+        for site in ("syosetu", "nocturne"):
+            ncodes = [novel_code_from_url(url) for url in urls if site_of(url) == site]
+            if not ncodes:
+                continue
+            try:
+                remote = SyosetuApiClient(site, base_url=api_url).fetch(ncodes)
+            except (URLError, OSError, ValueError):
+                continue
+            totals.update(
+                {ncode: novel.general_all_no for ncode, novel in remote.items()}
+            )
+
+    jobs = 0
+    for url in urls:
+        total = totals.get(novel_code_from_url(url).lower(), 0)
+        ranges = chapter_ranges(total, range_size) if range_size else []
+        for start_chapter, end_chapter in ranges or [[0, 0]]:
+            queue.add(site_of(url), url, start_chapter, end_chapter)
+            jobs += 1
+    return jobs
@@ -0,0 +1,232 @@
+import os
+import time
+import socket
+import logging
+import multiprocessing
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+from twisted.internet import task
+from twisted.python.failure import Failure
+from crawl_queue import CrawlJob, CrawlQueue
+from novel_store import ChapterIndex
+from syosetu_spider.spiders.syosetu_spider import SyosetuSpider
+from syosetu_spider.spiders.nocturne_spider import NocturneSpider
+
+SPIDERS = {"syosetu": SyosetuSpider, "nocturne": NocturneSpider}
+
+logger = logging.getLogger(__name__)
+
+
+class QueueWorker:
+    """Run queued crawl jobs in one crawler process, each job as a crawler of its own.
+
+    Up to jobs_per_worker crawls run at once on the reactor of the process.
+    Leases of running jobs are renewed every third of lease_seconds, and a
+    job counts as done once its crawl finished and stored every chapter of
+    its range. The reactor is stopped when the queue has no work left.
+    """
+
+    def __init__(
+        self,
+        process: CrawlerProcess,
+        queue: CrawlQueue,
+        worker_id: str,
+        jobs_per_worker: int = 2,
+        lease_seconds: float = 300.0,
+        poll_interval: float = 1.0,
+        spider_kwargs: Optional[Dict] = None,
+    ):
+        self.process = process
+        self.queue = queue
+        self.worker_id = worker_id
+        self.jobs_per_worker = jobs_per_worker
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.spider_kwargs = spider_kwargs or {}
+        settings = process.settings
+        self.storage_directory = os.path.expanduser(
+            settings.get("NOVEL_STORAGE_DIR", "~/storage_jl")
+        )
+        self.extension = (
+            ".jl.gz" if settings.get("NOVEL_STORAGE_COMPRESSION") == "gzip" else ".jl"
+        )
+        self.active: Dict[int, CrawlJob] = {}
+        self.last_renewal = time.monotonic()
+        self.stopping = False
+        self.loop = task.LoopingCall(self.tick)
+
+    def start(self) -> None:
+        self.loop.start(self.poll_interval)
+
+    def tick(self) -> None:
+        now = time.monotonic()
+        if self.active and now - self.last_renewal >= self.lease_seconds / 3:
+            self.queue.renew(list(self.active), self.worker_id, self.lease_seconds)
+            self.last_renewal = now
+        while not self.stopping and len(self.active) < self.jobs_per_worker:
+            job = self.queue.lease(self.worker_id, self.lease_seconds)
+            if job is None:
+                break
+            self.run_job(job)
+        if not self.active and (self.stopping or not self.queue.has_work()):
+            self.loop.stop()
+            from twisted.internet import reactor
+
+            reactor.stop()
+
+    def novel_path(self, job: CrawlJob) -> str:
+        """File the storage pipeline writes the novel of a job to."""
+        return os.path.join(
+            self.storage_directory,
+            SPIDERS[job.site].name,
+            f"{job.novel_code}{self.extension}",
+        )
+
+    def run_job(self, job: CrawlJob) -> None:
+        spider_class = SPIDERS[job.site]
+        spider_kwargs = {
+            "start_urls": job.url,
+            # So jobs against a mock site are not filtered as offsite
+            "allowed_domains": [
+                *spider_class.allowed_domains,
+                urlparse(job.url).hostname,
+            ],
+            **self.spider_kwargs,
+        }
+        if job.start_chapter:
+            spider_kwargs["start_chapter"] = job.start_chapter
+        if job.end_chapter:
+            spider_kwargs["end_chapter"] = job.end_chapter
+        logger.info(
+            f"{self.worker_id} starts job {job.id}: {job.url} "
+            f"chapters {job.start_chapter or 1}-{job.end_chapter or 'end'} "
+            f"(attempt {job.attempts})"
+        )
+        crawler = self.process.create_crawler(spider_class)
+        self.active[job.id] = job
+        # Recorded up front, chapters of a job that fails are spliced as well
+        self.queue.set_path(job.id, self.worker_id, self.novel_path(job))
+        deferred = self.process.crawl(crawler, **spider_kwargs)
+        deferred.addBoth(self.job_finished, job, crawler)
+
+    def job_error(self, job: CrawlJob, crawler) -> Optional[str]:
+        """Why a finished crawl did not do its job, None if it did."""
+        stats = crawler.stats.get_stats()
+        reason = stats.get("finish_reason")
+        if reason != "finished":
+            return f"crawl finished with {reason}"
+        # Judged by the stored chapters, not item_scraped_count: chapters that
+        # were stored before are skipped by the dupefilter and scrape nothing
+        index = ChapterIndex.load(self.novel_path(job))
+        if not index.entries:
+            return "no chapters stored"
+        last = job.end_chapter or max(index.entries)
+        missing = [
+            number
+            for number in range(job.start_chapter or 1, last + 1)
+            if number not in index
+        ]
+        if missing:
+            return f"{len(missing)} chapters missing, first {missing[0]}"
+        return None
+
+    def job_finished(self, result, job: CrawlJob, crawler) -> None:
+        del self.active[job.id]
+        if isinstance(result, Failure):
+            error = result.getErrorMessage()
+        elif crawler.stats.get_value("finish_reason") == "shutdown":
+            # Stopped with Ctrl-C, another run picks the job up again
+            self.stopping = True
+            self.queue.release(job.id, self.worker_id)
+            return
+        else:
+            error = self.job_error(job, crawler)
+        if error:
+            logger.warning(f"{self.worker_id} job {job.id} failed: {error}")
+            self.queue.fail(job.id, self.worker_id, error)
+        else:
+            self.queue.complete(job.id, self.worker_id, self.novel_path(job))
+
+
+def run_worker(
+    queue_path: str,
+    settings_overrides: Dict,
+    spider_kwargs: Dict,
+    jobs_per_worker: int,
+    lease_seconds: float,
+    max_attempts: int,
+) -> None:
+    """Entry point of a worker process, crawls queued jobs until the queue is empty."""
+    settings = get_project_settings()
+    settings.setdict(settings_overrides, priority="cmdline")
+    # Other workers append to the same novel files
+    settings.set("NOVEL_STORAGE_SHARED", True, priority="cmdline")
+    # The worker processes are the parallelism, a parse pool each would oversubscribe
+    settings.set("PARSE_POOL_ENABLED", False, priority="cmdline")
+    process = CrawlerProcess(settings)
+    # Crawlers only install the reactor when the first one is created, the
+    # worker needs it before that to schedule its queue polling
+    install_reactor(settings["TWISTED_REACTOR"], settings["ASYNCIO_EVENT_LOOP"])
+    queue = CrawlQueue(queue_path, max_attempts=max_attempts)
+    worker = QueueWorker(
+        process,
+        queue,
+        worker_id=f"{socket.gethostname()}:{os.getpid()}",
+        jobs_per_worker=jobs_per_worker,
+        lease_seconds=lease_seconds,
+        spider_kwargs=spider_kwargs,
+    )
+    from twisted.internet import reactor
+
+    reactor.callWhenRunning(worker.start)
+    process.start(stop_after_crawl=False)
+    queue.close()
+
+
+def start_workers(
+    queue_path: str,
+    workers: int,
+    settings_overrides: Optional[Dict] = None,
+    spider_kwargs: Optional[Dict] = None,
+    jobs_per_worker: int = 2,
+    lease_seconds: float = 300.0,
+    max_attempts: int = 3,
+) -> List[int]:
+    """Start crawler processes on the queue and wait for them to finish.
+
+    Each process has a reactor of its own, so parsing runs on as many cores
+    as there are workers. Processes are spawned rather than forked, a forked
+    reactor is not safe to use.
+
+    Returns:
+        list: Exit codes of the worker processes.
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(
+                queue_path,
+                settings_overrides or {},
+                spider_kwargs or {},
+                jobs_per_worker,
+                lease_seconds,
+                max_attempts,
+            ),
+            name=f"crawl-worker-{number}",
+        )
+        for number in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # The workers got the signal too and release their jobs before exiting
+        for process in processes:
+            process.join()
+    return [process.exitcode for process in processes]
@@ -0,0 +1,437 @@
+import os
+import json
+import gzip
+import time
+import zlib
+import heapq
+import select
+import struct
+import ctypes
+import ctypes.util
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from novel_package_v2 import Chapter, Novel, chapter_from_record
+from novel_store import expand_record, is_header
+
+WATCH_STATE_FILENAME = ".unpack_watch.json"
+FEED_SUFFIXES = (".jl", ".jl.gz")
+
+
+def is_feed(path: str) -> bool:
+    return path.endswith(FEED_SUFFIXES) and not os.path.basename(path).startswith(".")
+
+
+class FeedUnpacker:
+    """Unpack a growing .jl feed into chunks with the novel_package_v2 Novel chunker.
+
+    Each update reads the complete lines appended since the last one, so a
+    line the crawler is still writing is read next time. Chapters pass a
+    reorder heap of at most buffer_size chapters, like StreamingUnpackPipeline,
+    and a chunk is written as soon as it has chunk_size chapters. The last,
+    shorter chunk is written once the final chapter of the novel is in, and
+    replaced by the full chunk if the novel gets more chapters later.
+
+    The saved state points at the first line whose chapter is not in a
+    written chunk yet, so after a restart those chapters are read again and
+    the same chunks come out.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        output_dir: str,
+        chunk_size: int = 10,
+        buffer_size: int = 64,
+        state: Optional[Dict] = None,
+    ):
+        self.filepath = filepath
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        if state and state.get("length") != chunk_size:
+            state = None
+        self._load(state or {})
+
+    def _load(self, state: Dict) -> None:
+        self.identity = state.get("identity")
+        self.offset = state.get("offset", 0)
+        self.header = state.get("header")
+        self.total = state.get("total", 0)
+        self.next_chapter: int = state.get("next_chapter") or 1
+        # next_chapter when the current chunk was started, restarts resume from it
+        self.chunk_next_chapter = self.next_chapter
+        self.novel = Novel(
+            title=state.get("title", ""),
+            description=state.get("description", ""),
+            source_path=self.filepath,
+            output_dir=self.output_dir,
+            chunk_size=self.chunk_size,
+            english_title=state.get("english_title", ""),
+        )
+        # (chapter_number, sequence, chapter, line offset, header of the line)
+        self.pending: List[Tuple[int, int, Chapter, int, Optional[Dict]]] = []
+        self.chunk_start: Optional[Tuple[int, Optional[Dict]]] = None
+        self.sequence = 0
+        # Highest chapter number read
+        self.highest = state.get("highest", 0)
+        # File of the shorter last chunk, while the current chunk is not full
+        self.partial_path: Optional[str] = state.get("partial_path")
+        self.partial_end = 0
+        # File size at the last update, nothing to read while it stays the same
+        self.file_size: Optional[int] = None
+
+    def _identity(self, stat: os.stat_result) -> List[int]:
+        return [stat.st_dev, stat.st_ino]
+
+    def update(self) -> int:
+        """Read the lines appended since the last update and write finished chunks.
+
+        Returns:
+            int: Number of chunks written.
+        """
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return 0
+        compressed = self.filepath.endswith(".gz")
+        identity = self._identity(stat)
+        if (self.identity is not None and identity != self.identity) or (
+            not compressed and stat.st_size < self.offset
+        ):
+            # Replaced by migrate, splice or repair, chunks are rewritten in place
+            self._load({})
+        self.identity = identity
+        if stat.st_size == self.file_size:
+            return 0
+        self.file_size = stat.st_size
+
+        written = 0
+        opener = gzip.open if compressed else open
+        with opener(self.filepath, "rb") as f:
+            # Seeking a gzip stream decompresses up to the offset
+            f.seek(self.offset)
+            try:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    line_offset = self.offset
+                    self.offset += len(line)
+                    if line.isspace():
+                        continue
+                    record = json.loads(line)
+                    if is_header(record):
+                        self.header = record
+                        continue
+                    written += self._feed(
+                        expand_record(record, self.header), line_offset
+                    )
+            except (EOFError, zlib.error):
+                # The crawler is still writing the last gzip block
+                pass
+        return written + self._flush_finished()
+
+    def _feed(self, record: Dict, line_offset: int) -> int:
+        if not self.novel.title:
+            self.novel.title = record.get("novel_title", "")
+            self.novel.description = record.get("novel_description", "")
+        total = str(record.get("chapter_start_end") or "").partition("/")[2]
+        if total.isdigit():
+            self.total = max(self.total, int(total))
+        chapter = chapter_from_record(record)
+        self.highest = max(self.highest, chapter.number)
+        self.sequence += 1
+        heapq.heappush(
+            self.pending,
+            (chapter.number, self.sequence, chapter, line_offset, self.header),
+        )
+        return self._release()
+
+    def _release(self, force: bool = False) -> int:
+        """Pass the chapters that are next in order to the chunker.
+
+        The lowest pending chapter is passed on without waiting for the
+        chapters before it once more than buffer_size chapters wait, or
+        always with force.
+        """
+        written = 0
+        novel = self.novel
+        while self.pending and (
+            force
+            or self.pending[0][0] <= self.next_chapter
+            or len(self.pending) > self.buffer_size
+        ):
+            number, _, next_chapter, offset, header = heapq.heappop(self.pending)
+            if number < self.next_chapter:
+                # Already in a written chunk, or a repeated chapter
+                continue
+            novel.add_chapter(next_chapter)
+            if not next_chapter.is_skipped and len(novel.current_chunk) == 1:
+                self.chunk_start = (offset, header)
+            self.next_chapter = number + 1
+            if novel.should_flush_chunk():
+                written += self._flush_chunk()
+        return written
+
+    def _write_chunk(self) -> str:
+        path = self.novel.write_chunk()
+        if self.partial_path not in (None, path) and os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+        self.partial_path = None
+        return path
+
+    def _flush_chunk(self) -> int:
+        if not self.novel.current_chunk:
+            return 0
+        self._write_chunk()
+        self.novel.current_chunk = []
+        # Only the current chunk is needed while watching
+        self.novel.chapters.clear()
+        self.chunk_start = None
+        self.chunk_next_chapter = self.next_chapter
+        return 1
+
+    def _flush_finished(self) -> int:
+        """Write the last, shorter chunk once the final chapter is in.
+
+        Chapters still waiting for missing ones before them, like those of a
+        novel crawled from a later start chapter, are passed on first. The
+        chapters stay in the current chunk, so later chapters complete it.
+        """
+        if not self.total or self.highest < self.total:
+            return 0
+        written = self._release(force=True)
+        chunk = self.novel.current_chunk
+        if not chunk or (self.partial_path and chunk[-1].number == self.partial_end):
+            return written
+        self.partial_path = self._write_chunk()
+        self.partial_end = chunk[-1].number
+        return written + 1
+
+    def state(self) -> Dict:
+        """Where a restarted watch continues, see the class docstring."""
+        starts = [(offset, header) for _, _, _, offset, header in self.pending]
+        if self.chunk_start is not None:
+            starts.append(self.chunk_start)
+        offset, header = (
+            min(starts, key=lambda start: start[0])
+            if starts
+            else (self.offset, self.header)
+        )
+        return {
+            "identity": self.identity,
+            "length": self.chunk_size,
+            "offset": offset,
+            "header": header,
+            "next_chapter": self.chunk_next_chapter,
+            "total": self.total,
+            "highest": self.highest,
+            "title": self.novel.title,
+            "description": self.novel.description,
+            "english_title": self.novel.english_title,
+            "partial_path": self.partial_path,
+        }
+
+
+class Inotify:
+    """Directory change events from the Linux inotify API, through ctypes.
+
+    Raises OSError where inotify is not available, callers fall back to polling.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            init = self.libc.inotify_init1
+        except (OSError, AttributeError, TypeError) as e:
+            raise OSError(f"inotify is not available: {e}")
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories: Dict[int, str] = {}
+
+    def add_watch(self, directory: str) -> None:
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), self.WATCH_MASK
+        )
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+        self.directories[wd] = directory
+
+    def read(self, timeout: Optional[float] = None) -> Optional[List[Tuple[str, int]]]:
+        """Wait for events and return them as (path, mask).
+
+        Returns None when the kernel queue overflowed and events were lost.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            position = 0
+            while position < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, position)
+                position += self.EVENT.size
+                name = data[position : position + length].rstrip(b"\0")
+                position += length
+                if mask & self.IN_Q_OVERFLOW:
+                    return None
+                directory = self.directories.get(wd)
+                if directory is not None:
+                    events.append((os.path.join(directory, os.fsdecode(name)), mask))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class FeedWatcher:
+    """Keep the text chunks of every feed under a storage directory up to date.
+
+    Feeds are updated once at start, then whenever inotify reports a change,
+    or every interval seconds on systems without inotify. The blocking wait
+    uses no CPU while the crawler is idle. Changes within settle seconds of
+    the first one are handled together, a crawler writes in many small
+    steps.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        output_directory: Callable[[str], str],
+        state_path: str,
+        chunk_size: int = 10,
+        buffer_size: int = 64,
+        interval: float = 2.0,
+        settle: float = 0.5,
+        log: Callable[[str], None] = print,
+    ):
+        self.directory = directory
+        self.output_directory = output_directory
+        self.state_path = state_path
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self.settle = settle
+        self.log = log
+        self.unpackers: Dict[str, FeedUnpacker] = {}
+        self.sizes: Dict[str, Tuple[int, float]] = {}
+        self.saved_state: Dict[str, Dict] = {}
+        if os.path.exists(state_path):
+            with open(state_path, "r", encoding="utf-8") as f:
+                self.saved_state = json.load(f)
+
+    def feeds(self) -> List[str]:
+        return sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(self.directory)
+            for name in names
+            if is_feed(name)
+        )
+
+    def update(self, paths: Set[str]) -> int:
+        """Unpack new lines of the given feeds and save the state if anything changed."""
+        written = 0
+        for path in sorted(paths):
+            unpacker = self.unpackers.get(path)
+            if unpacker is None:
+                unpacker = FeedUnpacker(
+                    path,
+                    self.output_directory(path),
+                    chunk_size=self.chunk_size,
+                    buffer_size=self.buffer_size,
+                    state=self.saved_state.get(path),
+                )
+                self.unpackers[path] = unpacker
+            chunks = unpacker.update()
+            if chunks:
+                self.log(f"{path}: wrote {chunks} chunks")
+            written += chunks
+        self.save_state()
+        return written
+
+    def save_state(self) -> None:
+        state = {
+            **self.saved_state,
+            **{path: unpacker.state() for path, unpacker in self.unpackers.items()},
+        }
+        if state == self.saved_state:
+            return
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+        self.saved_state = state
+
+    def run(self, inotify: bool = True) -> None:
+        """Watch until interrupted, with inotify if asked and available."""
+        self.update(set(self.feeds()))
+        watcher = None
+        if inotify:
+            try:
+                watcher = Inotify()
+            except OSError as e:
+                self.log(f"{e}, polling every {self.interval} seconds")
+        try:
+            if watcher is not None:
+                self._run_inotify(watcher)
+            else:
+                self._run_polling()
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+    def _watch_tree(self, watcher: Inotify, directory: str) -> None:
+        for root, _, _ in os.walk(directory):
+            watcher.add_watch(root)
+
+    def _run_inotify(self, watcher: Inotify) -> None:
+        self._watch_tree(watcher, self.directory)
+        # Feeds written between the first update and the watches being added
+        self.update(set(self.feeds()))
+        while True:
+            events = watcher.read()
+            if events:
+                time.sleep(self.settle)
+                more = watcher.read(timeout=0)
+                events = None if more is None else events + more
+            if events is None:
+                # Events were lost, look at every feed
+                self.update(set(self.feeds()))
+                continue
+            paths = set()
+            for path, mask in events:
+                if mask & Inotify.IN_ISDIR:
+                    # A new spider directory, its feeds are picked up by the next scan
+                    self._watch_tree(watcher, path)
+                    paths.update(self.feeds())
+                elif is_feed(os.path.basename(path)):
+                    paths.add(path)
+            if paths:
+                self.update(paths)
+
+    def _run_polling(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            changed = set()
+            for path in self.feeds():
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                signature = (stat.st_size, stat.st_mtime)
+                if self.sizes.get(path) != signature:
+                    self.sizes[path] = signature
+                    changed.add(path)
+            if changed:
+                self.update(changed)
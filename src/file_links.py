@@ -0,0 +1,164 @@
+import os
+import json
+import errno
+import shutil
+import hashlib
+import tempfile
+from typing import Optional
+from novel_store import open_jl
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# How copy-rename places files in the new tree
+LINK_MODES = ["copy", "reflink", "hardlink", "symlink"]
+# ioctl request of Linux to share the extents of one file with another (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+# Errors meaning the filesystem or the pair of paths does not support the operation
+UNSUPPORTED_ERRORS = {
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EINVAL,
+    errno.ENOSYS,
+}
+
+
+def file_digest(filepath: str) -> str:
+    with open(filepath, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def destination_matches(source: str, destination: str, verify: bool = False) -> bool:
+    """Check if the destination already holds the source file.
+
+    Links to the same file always match. Other files match when size and
+    modification time are equal, and with verify also the sha256 digest.
+    """
+    if not os.path.lexists(destination):
+        return False
+    try:
+        if os.path.samefile(source, destination):
+            return True
+        source_stat = os.stat(source)
+        destination_stat = os.stat(destination)
+    except FileNotFoundError:
+        # Dangling symlink
+        return False
+    if source_stat.st_size != destination_stat.st_size:
+        return False
+    # Copies keep the source mtime, allow for filesystems with coarse timestamps
+    if abs(source_stat.st_mtime - destination_stat.st_mtime) > 1:
+        return False
+    return not verify or file_digest(source) == file_digest(destination)
+
+
+def _novel_key(filepath: str) -> Optional[str]:
+    """novel_code, or novel_title for files from before novel codes, of the first record."""
+    with open_jl(filepath) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                return record.get("novel_code") or record.get("novel_title")
+    return None
+
+
+def same_novel(source: str, destination: str) -> bool:
+    """Check if destination is a copy of the same novel as source, current or not.
+
+    Different novels can translate to the same title, a destination holding
+    another novel must not be replaced.
+    """
+    try:
+        return _novel_key(source) == _novel_key(destination)
+    except (OSError, ValueError):
+        return False
+
+
+def _copy_data(source_fd: int, destination_fd: int, size: int) -> None:
+    """Copy file contents in the kernel with copy_file_range, or sendfile."""
+    if hasattr(os, "copy_file_range"):
+        try:
+            copied = 0
+            while copied < size:
+                count = os.copy_file_range(source_fd, destination_fd, size - copied)
+                if count == 0:
+                    break
+                copied += count
+            return
+        except OSError as error:
+            if error.errno not in UNSUPPORTED_ERRORS:
+                raise
+    os.lseek(source_fd, 0, os.SEEK_SET)
+    os.lseek(destination_fd, 0, os.SEEK_SET)
+    os.ftruncate(destination_fd, 0)
+    if not hasattr(os, "sendfile"):  # Windows
+        while chunk := os.read(source_fd, 1024 * 1024):
+            os.write(destination_fd, chunk)
+        return
+    offset = 0
+    while offset < size:
+        count = os.sendfile(destination_fd, source_fd, offset, size - offset)
+        if count == 0:
+            break
+        offset += count
+
+
+def _write_copy(source: str, temp_path: str, reflink: bool) -> str:
+    """Write the source to temp_path by reflink if asked and possible, else copy."""
+    with open(source, "rb") as src, open(temp_path, "wb") as dst:
+        if reflink and fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return "reflink"
+            except OSError as error:
+                if error.errno not in UNSUPPORTED_ERRORS:
+                    raise
+        _copy_data(src.fileno(), dst.fileno(), os.fstat(src.fileno()).st_size)
+    return "copy"
+
+
+def place_file(source: str, destination: str, mode: str = "copy") -> str:
+    """Put the source file at destination with the given link mode.
+
+    The new file is created next to the destination under a unique temporary
+    name and renamed over it, so a reader never sees a partial file and
+    threads placing files at the same destination do not touch each other's
+    files. Hardlinks across filesystems and reflinks on filesystems without
+    support fall back to a kernel side copy.
+
+    Returns:
+        str: The method actually used, "hardlink", "symlink", "reflink" or "copy".
+    """
+    directory = os.path.dirname(destination)
+    fd, temp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(destination)}.", suffix=".tmp", dir=directory
+    )
+    os.close(fd)
+    try:
+        method: Optional[str] = None
+        if mode in ("hardlink", "symlink"):
+            # Links are created at the unique name, not over it
+            os.remove(temp_path)
+        if mode == "hardlink":
+            try:
+                os.link(source, temp_path)
+                method = "hardlink"
+            except OSError as error:
+                if error.errno not in UNSUPPORTED_ERRORS | {errno.EPERM}:
+                    raise
+        elif mode == "symlink":
+            os.symlink(os.path.abspath(source), temp_path)
+            method = "symlink"
+
+        if method is None:
+            method = _write_copy(source, temp_path, reflink=mode != "copy")
+            shutil.copystat(source, temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+    return method
@@ -0,0 +1,262 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# NumPy and PyArrow are optional, installed with the "stats" extra
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from novel_store import iter_chapter_records
+from syosetu_api import API_BASE_URL, API_PATHS, SyosetuApiClient
+
+# Chapters decoded into one code point array at a time, bounds memory per worker
+BATCH_CHAPTERS = 2000
+NEWLINE = ord("\n")
+# Characters str.strip() removes from Japanese text, a blank line has only these
+WHITESPACE = " \t\n\r\x0b\x0c\xa0\u3000"
+# Lines starting with these brackets are counted as dialogue
+DIALOGUE_OPENERS = [ord("「"), ord("『")]
+CHAPTER_COLUMNS = [
+    "chapter_number",
+    "characters",
+    "paragraphs",
+    "dialogue_characters",
+]
+API_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise RuntimeError(
+            "The stats command needs numpy, install it with: pip install '.[stats]'"
+        )
+
+
+def require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError(
+            "Parquet export needs pyarrow, install it with: pip install '.[stats]'"
+        )
+
+
+def _batch_columns(numbers: List[int], texts: List[str]) -> Dict:
+    """Per-chapter counts of a batch of chapter texts, computed on one code point array.
+
+    The batch is joined with line breaks and decoded as UTF-32 into a NumPy
+    array. Line boundaries, blank lines and dialogue openers are then found
+    with array operations on line start offsets and summed per chapter,
+    instead of stripping and testing every line in Python.
+    """
+    chapters = len(texts)
+    codes = np.frombuffer("\n".join(texts).encode("utf-32-le"), dtype=np.uint32)
+    newlines = np.flatnonzero(codes == NEWLINE)
+    line_starts = np.concatenate(([0], newlines + 1))
+    line_ends = np.concatenate((newlines, [len(codes)]))
+    line_counts = np.fromiter(
+        (text.count("\n") + 1 for text in texts), dtype=np.int64, count=chapters
+    )
+    line_chapters = np.repeat(np.arange(chapters), line_counts)
+
+    is_whitespace = np.zeros(0x10000, dtype=bool)
+    is_whitespace[[ord(char) for char in WHITESPACE]] = True
+    # Step past leading whitespace, only lines still on whitespace move again,
+    # usually one or two rounds for the full-width space indent
+    first = line_starts.copy()
+    active = np.flatnonzero(first < line_ends)
+    while len(active):
+        active = active[is_whitespace[np.minimum(codes[first[active]], 0xFFFF)]]
+        first[active] += 1
+        active = active[first[active] < line_ends[active]]
+    text_lines = np.flatnonzero(first < line_ends)
+    dialogue_lines = text_lines[np.isin(codes[first[text_lines]], DIALOGUE_OPENERS)]
+
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=chapters)
+    return {
+        "chapter_number": np.array(numbers, dtype=np.int64),
+        "characters": lengths - (line_counts - 1),
+        "paragraphs": np.bincount(line_chapters[text_lines], minlength=chapters),
+        "dialogue_characters": np.bincount(
+            line_chapters[dialogue_lines],
+            weights=(line_ends - line_starts)[dialogue_lines],
+            minlength=chapters,
+        ).astype(np.int64),
+    }
+
+
+def file_chapter_stats(filepath: str) -> Dict:
+    """Stream a .jl file into per-chapter metric arrays.
+
+    Runs in a worker process. Characters are counted without line breaks and
+    paragraphs are the non-blank lines of the chapter text.
+
+    Returns:
+        dict: Novel fields of the file and CHAPTER_COLUMNS as NumPy arrays.
+    """
+    novel = {
+        "novel_code": os.path.basename(filepath).split(".")[0],
+        "site": os.path.basename(os.path.dirname(filepath)),
+        "novel_title": "",
+        "chapter_total": 0,
+        "file": filepath,
+    }
+    batches = []
+    numbers: List[int] = []
+    texts: List[str] = []
+    for record in iter_chapter_records(filepath, skip_invalid=True):
+        if not novel["novel_title"] and record.get("novel_title"):
+            novel["novel_code"] = record.get("novel_code") or novel["novel_code"]
+            novel["novel_title"] = record["novel_title"]
+        total = str(record.get("chapter_start_end") or "").partition("/")[2]
+        if total.isdigit():
+            novel["chapter_total"] = int(total)
+        numbers.append(int(record["chapter_number"]))
+        texts.append(record.get("chapter_text") or "")
+        if len(texts) >= BATCH_CHAPTERS:
+            batches.append(_batch_columns(numbers, texts))
+            numbers, texts = [], []
+    if texts:
+        batches.append(_batch_columns(numbers, texts))
+
+    for name in CHAPTER_COLUMNS:
+        novel[name] = (
+            np.concatenate([batch[name] for batch in batches])
+            if batches
+            else np.zeros(0, dtype=np.int64)
+        )
+    return novel
+
+
+def novel_summary(novel: Dict, target_chars: int = 50000) -> Dict:
+    """Aggregate the chapter arrays of one novel into a row of the novel table."""
+    characters = novel["characters"]
+    chapters = len(characters)
+    total_characters = int(characters.sum())
+    mean = total_characters / chapters if chapters else 0.0
+    return {
+        "novel_code": novel["novel_code"],
+        "site": novel["site"],
+        "novel_title": novel["novel_title"],
+        "chapters": chapters,
+        "chapter_total": novel["chapter_total"] or chapters,
+        "characters": total_characters,
+        "mean_chapter_chars": mean,
+        "median_chapter_chars": float(np.median(characters)) if chapters else 0.0,
+        "p90_chapter_chars": (
+            float(np.percentile(characters, 90)) if chapters else 0.0
+        ),
+        "mean_paragraphs": float(novel["paragraphs"].mean()) if chapters else 0.0,
+        "dialogue_ratio": (
+            int(novel["dialogue_characters"].sum()) / total_characters
+            if total_characters
+            else 0.0
+        ),
+        # Chapters per output file that give about target_chars characters
+        "suggested_length": max(1, round(target_chars / mean)) if mean else 1,
+    }
+
+
+def collect_stats(jsonl_files: List[str], workers: Optional[int] = None) -> List[Dict]:
+    """Compute the chapter arrays of every file, in parallel across files."""
+    require_numpy()
+    if workers == 1 or len(jsonl_files) < 2:
+        return [file_chapter_stats(file) for file in jsonl_files]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(file_chapter_stats, jsonl_files))
+
+
+def add_update_cadence(
+    summaries: List[Dict], base_url: str = API_BASE_URL, pause: float = 1.0
+) -> None:
+    """Add chapters per week between the first and last upload, from the Syosetu API.
+
+    Args:
+        summaries (list): Rows from novel_summary, updated in place.
+        base_url (str): API host, a local stand-in server can be used for testing.
+        pause (float): Seconds to wait between API requests.
+    """
+    for site in API_PATHS:
+        site_summaries = [
+            summary
+            for summary in summaries
+            if ("nocturne" in summary["site"]) == (site == "nocturne")
+        ]
+        if not site_summaries:
+            continue
+        client = SyosetuApiClient(site, base_url=base_url, pause=pause)
+        remote_novels = client.fetch(
+            summary["novel_code"] for summary in site_summaries
+        )
+        for summary in site_summaries:
+            remote = remote_novels.get(summary["novel_code"].lower())
+            summary["chapters_per_week"] = None
+            summary["last_upload"] = None
+            if (
+                remote is None
+                or not remote.general_firstup
+                or not remote.general_lastup
+            ):
+                continue
+            first = datetime.strptime(remote.general_firstup, API_DATE_FORMAT)
+            last = datetime.strptime(remote.general_lastup, API_DATE_FORMAT)
+            # At least a day, so a novel posted all at once does not divide by zero
+            weeks = max((last - first).total_seconds() / (7 * 24 * 3600), 1 / 7)
+            summary["chapters_per_week"] = remote.general_all_no / weeks
+            summary["last_upload"] = remote.general_lastup
+
+
+def library_totals(novels: List[Dict]) -> Dict:
+    """Library wide chapter length distribution over all chapters of all novels."""
+    characters = (
+        np.concatenate([novel["characters"] for novel in novels])
+        if novels
+        else np.zeros(0, dtype=np.int64)
+    )
+    dialogue = sum(int(novel["dialogue_characters"].sum()) for novel in novels)
+    total = int(characters.sum())
+    return {
+        "novels": len(novels),
+        "chapters": len(characters),
+        "characters": total,
+        "mean_chapter_chars": float(characters.mean()) if len(characters) else 0.0,
+        "median_chapter_chars": (
+            float(np.median(characters)) if len(characters) else 0.0
+        ),
+        "dialogue_ratio": dialogue / total if total else 0.0,
+    }
+
+
+def write_parquet(novels: List[Dict], summaries: List[Dict], directory: str) -> None:
+    """Write chapters.parquet with one row per chapter and novels.parquet per novel."""
+    require_pyarrow()
+    os.makedirs(directory, exist_ok=True)
+    chapters = pa.table(
+        {
+            "novel_code": pa.array(
+                np.repeat(
+                    [novel["novel_code"] for novel in novels],
+                    [len(novel["chapter_number"]) for novel in novels],
+                ).astype(str),
+                pa.string(),
+            ),
+            **{
+                name: pa.array(
+                    np.concatenate([novel[name] for novel in novels])
+                    if novels
+                    else np.zeros(0, dtype=np.int64)
+                )
+                for name in CHAPTER_COLUMNS
+            },
+        }
+    )
+    pq.write_table(chapters, os.path.join(directory, "chapters.parquet"))
+    pq.write_table(
+        pa.Table.from_pylist(summaries), os.path.join(directory, "novels.parquet")
+    )
@@ -1,8 +1,12 @@
 import os
 import sys
+import json
 import glob
-import shutil
+import time
 import typer
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from urllib.parse import urlparse
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
@@ -14,10 +18,36 @@ from utils_translate import translate_file_title
 from typer_func import (
     get_new_directory,
     find_jsonl_files,
-    process_jsonl_file,
 )
+from chunk_plan import plan_chunks, process_jsonl_file_planned
 from novel_package_v2 import process_jsonl_file3
+from parallel_unpack import process_jsonl_file3_parallel
 from typer_func_old import process_jsonl_file_old
+from profiling import NULL_PROFILER, UnpackProfile
+from paragraph_translate import BACKENDS, PARAGRAPH_CACHE_FILENAME, translate_library
+from file_links import LINK_MODES, destination_matches, place_file, same_novel
+from syosetu_api import API_BASE_URL, compare_library, find_local_novels
+from novel_store import ChapterIndex, migrate_jl_file, splice_chapters
+from chapter_repair import find_gaps, format_ranges, missing_chapters, repair_targets
+from crawl_queue import QUEUE_FILENAME, CrawlQueue, queue_novels
+from crawl_workers import start_workers
+from crawl_daemon import (
+    DAEMON_SOCKET_FILENAME,
+    JOB_KINDS,
+    daemon_running,
+    run_daemon,
+    send_request,
+)
+from feed_watch import WATCH_STATE_FILENAME, FeedWatcher
+from search_index import SearchIndex
+from reading_server import run_server
+from library_stats import (
+    add_update_cadence,
+    collect_stats,
+    library_totals,
+    novel_summary,
+    write_parquet,
+)
 
 HOME_USER = os.path.expanduser("~")
 DEFAULT_DIRECTORY = "storage_jl"
@@ -25,6 +55,11 @@ DEFAULT_DIRECTORY = "storage_jl"
 app = typer.Typer()
 
 
+def _jl_extension(file: str) -> str:
+    """Return the JSON lines extension of a file, keeping .gz compression."""
+    return ".jl.gz" if file.endswith(".jl.gz") else ".jl"
+
+
 def validate_directory(directory_path: str):
     """Validates that a directory exists."""
     if not os.path.exists(directory_path):
@@ -32,6 +67,38 @@ def validate_directory(directory_path: str):
         raise typer.Exit(1)
 
 
+def _run_unpack(
+    jsonl_files,
+    unpack_file,
+    profile: bool = False,
+    profile_report: str = "unpack_profile.json",
+    cprofile: bool = False,
+    trace_memory: bool = False,
+):
+    """Run unpack_file(file, profiler) over every file, optionally profiling stages."""
+    if not profile:
+        for file in jsonl_files:
+            typer.echo(f"Unpacking file: {file}")
+            unpack_file(file, NULL_PROFILER)
+        return
+
+    cprofile_path = f"{os.path.splitext(profile_report)[0]}.prof" if cprofile else None
+    run_profile = UnpackProfile(cprofile_path=cprofile_path, trace_memory=trace_memory)
+    run_profile.start()
+    try:
+        for file in jsonl_files:
+            typer.echo(f"Unpacking file: {file}")
+            with run_profile.file(file) as profiler:
+                unpack_file(file, profiler)
+    finally:
+        run_profile.stop()
+
+    for line in run_profile.summary_lines():
+        typer.echo(line)
+    run_profile.write(profile_report)
+    typer.echo(f"Profile report written to {profile_report}")
+
+
 @app.command()
 def list(
     directory: str = typer.Argument(
@@ -71,6 +138,29 @@ def unpack(
     length: int = typer.Option(
         10, "--length", "-l", help="chapter text length to unpack jsonl file into"
     ),
+    profile: bool = typer.Option(
+        False, "--profile", help="Time each unpack stage and print a breakdown"
+    ),
+    profile_report: str = typer.Option(
+        "unpack_profile.json", "--profile-report", help="Profile report JSON path"
+    ),
+    cprofile: bool = typer.Option(
+        False, "--cprofile", help="Also capture cProfile stats with --profile"
+    ),
+    trace_memory: bool = typer.Option(
+        False,
+        "--tracemalloc",
+        help="Also capture a tracemalloc snapshot with --profile",
+    ),
+    jobs: int = typer.Option(
+        1,
+        "--jobs",
+        "-j",
+        help="Worker processes rendering the chunks of each file, 0 for all cores",
+    ),
+    dry_run: bool = typer.Option(
+        False, "--dry-run", help="Print the chunk plan without writing any files"
+    ),
 ):
     """Unpack the JSONL file into a text file."""
     storage_directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
@@ -80,18 +170,30 @@ def unpack(
 
     jsonl_files = find_jsonl_files(storage_directory_path)
 
+    if dry_run:
+        for file in jsonl_files:
+            chunks = plan_chunks(file, length)
+            typer.echo(f"{file}: {len(chunks)} chunks")
+            for chunk in chunks:
+                typer.echo(
+                    f"  {chunk.start}-{chunk.end} {chunk.novel_title[:30]}.txt "
+                    f"({len(chunk.chapter_numbers)} chapters)"
+                )
+        return
+
     # typer.echo(
     #     f"Unpacking jsonl files in {directory} into text file with chapter length {length}"
     # )
+    def unpack_file(file, profiler):
+        # Plan the chunks from chapter metadata, then render them on the workers
+        process_jsonl_file_planned(
+            file, length, workers=jobs or None, profiler=profiler
+        )
+
     if jsonl_files:  # Check if list is not empty
-        # file = jsonl_files[0]  # Get first file only
-        for file in jsonl_files:
-            # for file in jsonl_files:
-            file_directory_path = os.path.dirname(file)
-            # typer.echo(f"directory_path: {file_directory_path}")
-            typer.echo(f"Unpacking file: {file}")
-            # process_jsonl_file_old(file, directory_path, length)
-            process_jsonl_file(file, file_directory_path, length)
+        _run_unpack(
+            jsonl_files, unpack_file, profile, profile_report, cprofile, trace_memory
+        )
 
 
 @app.command()
@@ -105,6 +207,20 @@ def unpack_old(
     length: int = typer.Option(
         10, "--length", "-l", help="chapter text length to unpack jsonl file into"
     ),
+    profile: bool = typer.Option(
+        False, "--profile", help="Time each unpack stage and print a breakdown"
+    ),
+    profile_report: str = typer.Option(
+        "unpack_profile.json", "--profile-report", help="Profile report JSON path"
+    ),
+    cprofile: bool = typer.Option(
+        False, "--cprofile", help="Also capture cProfile stats with --profile"
+    ),
+    trace_memory: bool = typer.Option(
+        False,
+        "--tracemalloc",
+        help="Also capture a tracemalloc snapshot with --profile",
+    ),
 ):
     """Unpack the JSONL file into a text file using old processing logic."""
     storage_directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
@@ -114,11 +230,14 @@ def unpack_old(
 
     jsonl_files = find_jsonl_files(storage_directory_path)
 
+    def unpack_file(file, profiler):
+        file_directory_path = os.path.dirname(file)
+        process_jsonl_file_old(file, file_directory_path, length, profiler=profiler)
+
     if jsonl_files:
-        for file in jsonl_files:
-            file_directory_path = os.path.dirname(file)
-            typer.echo(f"Unpacking file: {file}")
-            process_jsonl_file_old(file, file_directory_path, length)
+        _run_unpack(
+            jsonl_files, unpack_file, profile, profile_report, cprofile, trace_memory
+        )
 
 
 @app.command()
@@ -132,6 +251,38 @@ def unpack3(
     length: int = typer.Option(
         10, "--length", "-l", help="chapter text length to unpack jsonl file into"
     ),
+    profile: bool = typer.Option(
+        False, "--profile", help="Time each unpack stage and print a breakdown"
+    ),
+    profile_report: str = typer.Option(
+        "unpack_profile.json", "--profile-report", help="Profile report JSON path"
+    ),
+    cprofile: bool = typer.Option(
+        False, "--cprofile", help="Also capture cProfile stats with --profile"
+    ),
+    trace_memory: bool = typer.Option(
+        False,
+        "--tracemalloc",
+        help="Also capture a tracemalloc snapshot with --profile",
+    ),
+    jobs: int = typer.Option(
+        1,
+        "--jobs",
+        "-j",
+        help="Worker processes decoding each large file, 0 for all cores",
+    ),
+    watch: bool = typer.Option(
+        False,
+        "--watch",
+        "-w",
+        help="Keep running and unpack chapters as crawls append them",
+    ),
+    poll: bool = typer.Option(
+        False, "--poll", help="Watch by polling instead of inotify"
+    ),
+    poll_interval: float = typer.Option(
+        2.0, "--poll-interval", help="Seconds between checks when polling"
+    ),
 ):
     """Unpack the JSONL file into a text file using optimized processing logic."""
     storage_directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
@@ -139,15 +290,43 @@ def unpack3(
 
     validate_directory(storage_directory_path)
 
+    if watch:
+        watcher = FeedWatcher(
+            storage_directory_path,
+            output_directory=lambda file: get_new_directory(
+                file, HOME_USER, storage_directory_path, f"{directory}_text"
+            ),
+            state_path=os.path.join(
+                HOME_USER, f"{directory}_text", WATCH_STATE_FILENAME
+            ),
+            chunk_size=length,
+            interval=poll_interval,
+            log=typer.echo,
+        )
+        typer.echo("Watching for new chapters, press Ctrl-C to stop")
+        try:
+            watcher.run(inotify=not poll)
+        except KeyboardInterrupt:
+            watcher.save_state()
+        return
+
     jsonl_files = find_jsonl_files(storage_directory_path)
 
-    if jsonl_files:
-        for file in jsonl_files:
-            output_directory = get_new_directory(
-                file, HOME_USER, storage_directory_path, f"{directory}_text"
+    def unpack_file(file, profiler):
+        output_directory = get_new_directory(
+            file, HOME_USER, storage_directory_path, f"{directory}_text"
+        )
+        if jobs == 1:
+            process_jsonl_file3(file, output_directory, length, profiler=profiler)
+        else:
+            process_jsonl_file3_parallel(
+                file, output_directory, length, workers=jobs or None, profiler=profiler
             )
-            typer.echo(f"Unpacking file: {file}")
-            process_jsonl_file3(file, output_directory, length)
+
+    if jsonl_files:
+        _run_unpack(
+            jsonl_files, unpack_file, profile, profile_report, cprofile, trace_memory
+        )
 
 
 @app.command()
@@ -174,7 +353,7 @@ def rename(
         safe_title = translate_file_title(file)
 
         if safe_title and safe_title != "Translation error invalid source language":
-            new_file = os.path.join(file_dir, f"{safe_title}.jl")
+            new_file = os.path.join(file_dir, f"{safe_title}{_jl_extension(file)}")
             if file != new_file:  # Only rename if name is different
                 if not os.path.exists(new_file):
                     typer.echo(f"Renaming to: {new_file}")
@@ -194,8 +373,21 @@ def copy_rename(
         file_okay=False,
         dir_okay=True,
     ),
+    link_mode: str = typer.Option(
+        "copy",
+        "--link-mode",
+        "-m",
+        help="copy, reflink (copy-on-write clone), hardlink or symlink",
+    ),
+    jobs: int = typer.Option(8, "--jobs", "-j", help="Files processed at once"),
+    verify: bool = typer.Option(
+        False, "--verify", help="Compare sha256 before skipping existing files"
+    ),
 ):
     """Rename and translate Japanese novel titles and organize them in new directories."""
+    if link_mode not in LINK_MODES:
+        typer.echo(f"Unknown link mode: {link_mode}")
+        raise typer.Exit(1)
     typer.echo("Renaming files...")
 
     directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
@@ -210,30 +402,440 @@ def copy_rename(
     # Find all .jl files recursively
     jsonl_files = find_jsonl_files(directory_path)
 
-    for file in jsonl_files:
+    def copy_file(file) -> str:
         storage_directory_path = get_new_directory(
             file, HOME_USER, directory_path, storage_directory_name
         )
         safe_title = translate_file_title(file)
+        if not safe_title or safe_title == "Translation error invalid source language":
+            return f"Translation failed for: {file}"
 
         # Create output file path
-        new_file = os.path.join(storage_directory_path, f"{safe_title}.jl")
+        new_file = os.path.join(
+            storage_directory_path, f"{safe_title}{_jl_extension(file)}"
+        )
+        # Skip files already in place, replace outdated ones
+        if destination_matches(file, new_file, verify=verify):
+            return f"File exists, skipping: {new_file}"
+        if os.path.lexists(new_file) and not same_novel(file, new_file):
+            # Another novel whose title translates the same
+            return f"File exists, skipping: {new_file}"
+        method = place_file(file, new_file, link_mode)
+        return f"Placed by {method}: {new_file}"
 
-        # Copy file if translation successful
-        if safe_title and safe_title != "Translation error invalid source language":
-            if not os.path.exists(new_file):
-                typer.echo(f"Copying to: {new_file}")
-                shutil.copy2(file, new_file)
-            else:
-                typer.echo(f"File exists, skipping: {new_file}")
-        else:
-            typer.echo(f"Translation failed for: {file}")
+    # Title translation waits on the network, so files are handled in threads
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for message in executor.map(copy_file, jsonl_files):
+            typer.echo(message)
+
+
+@app.command()
+def translate(
+    directory: str = typer.Argument(
+        "storage_jl",
+        help="Input directory storage for raw jsonl files",
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+    ),
+    backend: str = typer.Option(
+        "google", "--backend", "-b", help="Translation backend: google or fake"
+    ),
+    concurrency: int = typer.Option(
+        4, "--concurrency", "-c", help="Translation requests in flight at once"
+    ),
+    rate: float = typer.Option(
+        2.0, "--rate", help="Maximum translation requests per second, 0 for no limit"
+    ),
+    batch_chars: int = typer.Option(
+        None, "--batch-chars", help="Maximum characters per translation request"
+    ),
+):
+    """Translate chapter text of JSONL files into English editions, paragraph by paragraph."""
+    storage_directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
+    typer.echo(f"Processing directory: {storage_directory_path}")
+
+    validate_directory(storage_directory_path)
+
+    if backend not in BACKENDS:
+        typer.echo(f"Unknown translation backend: {backend}")
+        raise typer.Exit(1)
+    translation_backend = BACKENDS[backend]()
+    if batch_chars:
+        translation_backend.max_batch_chars = batch_chars
+
+    jsonl_files = find_jsonl_files(storage_directory_path)
+    summary = translate_library(
+        jsonl_files,
+        input_directory=storage_directory_path,
+        output_directory=os.path.join(HOME_USER, f"{directory}_en"),
+        backend=translation_backend,
+        cache_path=os.path.join(storage_directory_path, PARAGRAPH_CACHE_FILENAME),
+        concurrency=concurrency,
+        rate=rate,
+        echo=typer.echo,
+    )
+    typer.echo(
+        f"Translated {summary['files']} files, {summary['translated']} new paragraphs "
+        f"of {summary['unique']} unique"
+    )
+
+
+@app.command()
+def sync_check(
+    directory: str = typer.Argument(
+        "storage_jl",
+        help="Input directory storage for raw jsonl files",
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+    ),
+    api_url: str = typer.Option(
+        API_BASE_URL, "--api-url", help="Syosetu API host, e.g. a local stand-in"
+    ),
+    batch_size: int = typer.Option(
+        100, "--batch-size", help="Novel codes per API request, at most 500"
+    ),
+    pause: float = typer.Option(
+        1.0, "--pause", help="Seconds to wait between API requests"
+    ),
+    report: str = typer.Option(
+        None, "--report", "-r", help="Also write the full comparison as JSON"
+    ),
+):
+    """Check the Syosetu API for novels with chapters not crawled yet."""
+    storage_directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
+    typer.echo(f"Processing directory: {storage_directory_path}")
+
+    validate_directory(storage_directory_path)
+
+    local_novels = find_local_novels(find_jsonl_files(storage_directory_path))
+    typer.echo(f"Checking {len(local_novels)} novels")
+    results = compare_library(
+        local_novels, base_url=api_url, batch_size=batch_size, pause=pause
+    )
+
+    for entry in results:
+        if entry["status"] == "new_chapters":
+            command = (
+                "nocturne-spider" if entry["site"] == "nocturne" else "syosetu-spider"
+            )
+            typer.echo(
+                f"{entry['ncode']} {entry['title']}: {entry['local_chapters']} -> "
+                f"{entry['remote_chapters']} chapters, "
+                f"run: typer main.py run {command} {entry['url']} -sc {entry['start_chapter']}"
+            )
+        elif entry["status"] == "not_found":
+            typer.echo(f"{entry['ncode']}: not found by the API ({entry['file']})")
+    new_count = sum(entry["status"] == "new_chapters" for entry in results)
+    typer.echo(f"{new_count} of {len(results)} novels have new chapters")
+
+    if report:
+        with open(report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        typer.echo(f"Report written to {report}")
+
+
+@app.command()
+def migrate(
+    directory: str = typer.Argument(
+        "storage_jl",
+        help="Input directory storage for raw jsonl files",
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+    ),
+):
+    """Convert JSONL files to the compact v2 layout with one header per novel."""
+    storage_directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
+    typer.echo(f"Processing directory: {storage_directory_path}")
+
+    validate_directory(storage_directory_path)
+
+    migrated = 0
+    for file in find_jsonl_files(storage_directory_path):
+        size_before = os.path.getsize(file)
+        if not migrate_jl_file(file):
+            typer.echo(f"Already v2, skipping: {file}")
+            continue
+        migrated += 1
+        size_after = os.path.getsize(file)
+        typer.echo(
+            f"Migrated {file}: {size_before / 1024:.0f} KB -> {size_after / 1024:.0f} KB"
+        )
+    typer.echo(f"Migrated {migrated} files")
+
+
+@app.command()
+def stats(
+    directory: str = typer.Argument(
+        "storage_jl",
+        help="Input directory storage for raw jsonl files",
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+    ),
+    jobs: int = typer.Option(
+        0, "--jobs", "-j", help="Worker processes reading files, 0 for all cores"
+    ),
+    target_chars: int = typer.Option(
+        50000,
+        "--target-chars",
+        help="Characters per output file used for the suggested --length",
+    ),
+    parquet: str = typer.Option(
+        None, "--parquet", "-p", help="Write chapters.parquet and novels.parquet here"
+    ),
+    cadence: bool = typer.Option(
+        False, "--cadence", help="Ask the Syosetu API for the update cadence"
+    ),
+    api_url: str = typer.Option(
+        API_BASE_URL, "--api-url", help="Syosetu API host, e.g. a local stand-in"
+    ),
+):
+    """Show chapter length, paragraph and dialogue statistics per novel."""
+    storage_directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
+    typer.echo(f"Processing directory: {storage_directory_path}")
+
+    validate_directory(storage_directory_path)
+
+    try:
+        novels = collect_stats(
+            find_jsonl_files(storage_directory_path), workers=jobs or None
+        )
+    except RuntimeError as error:
+        typer.echo(str(error))
+        raise typer.Exit(1)
+    summaries = [novel_summary(novel, target_chars) for novel in novels]
+    if cadence:
+        add_update_cadence(summaries, base_url=api_url)
+
+    typer.echo(
+        f"{'ncode':<10} {'chapters':>9} {'chars':>11} {'mean':>7} {'median':>7} "
+        f"{'p90':>7} {'paras':>6} {'dialog':>6} {'length':>6}"
+        + (f" {'ch/week':>7}" if cadence else "")
+        + "  title"
+    )
+    for summary in sorted(summaries, key=lambda row: row["novel_code"]):
+        cadence_column = ""
+        if cadence:
+            per_week = summary["chapters_per_week"]
+            cadence_column = f" {per_week:>7.1f}" if per_week is not None else " " * 8
+        typer.echo(
+            f"{summary['novel_code']:<10} "
+            f"{summary['chapters']:>4}/{summary['chapter_total']:<4} "
+            f"{summary['characters']:>11,} "
+            f"{summary['mean_chapter_chars']:>7.0f} "
+            f"{summary['median_chapter_chars']:>7.0f} "
+            f"{summary['p90_chapter_chars']:>7.0f} "
+            f"{summary['mean_paragraphs']:>6.1f} "
+            f"{summary['dialogue_ratio']:>6.1%} "
+            f"{summary['suggested_length']:>6}"
+            f"{cadence_column}  {summary['novel_title'][:30]}"
+        )
+    totals = library_totals(novels)
+    typer.echo(
+        f"{totals['novels']} novels, {totals['chapters']} chapters, "
+        f"{totals['characters']:,} characters, "
+        f"mean chapter {totals['mean_chapter_chars']:.0f} / median "
+        f"{totals['median_chapter_chars']:.0f} characters, "
+        f"{totals['dialogue_ratio']:.1%} dialogue"
+    )
+
+    if parquet:
+        try:
+            write_parquet(novels, summaries, parquet)
+        except RuntimeError as error:
+            typer.echo(str(error))
+            raise typer.Exit(1)
+        typer.echo(f"Parquet files written to {parquet}")
+
+
+@app.command()
+def search(
+    query: str = typer.Argument(
+        ..., help="Text to find, phrases separated by spaces must all match"
+    ),
+    directory: str = typer.Argument(
+        "storage_jl",
+        help="Input directory storage for raw jsonl files",
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+    ),
+    limit: int = typer.Option(10, "--limit", "-n", help="Number of hits to show"),
+    novel: str = typer.Option("", "--novel", help="Only search this novel code"),
+    jobs: int = typer.Option(
+        0, "--jobs", "-j", help="Worker processes indexing files, 0 for all cores"
+    ),
+    no_update: bool = typer.Option(
+        False, "--no-update", help="Search without indexing new chapters first"
+    ),
+    rebuild: bool = typer.Option(
+        False, "--rebuild", help="Index every file again from the start"
+    ),
+):
+    """Search the chapter text of the library through an incremental bigram index."""
+    storage_directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
+
+    validate_directory(storage_directory_path)
+
+    index = SearchIndex(storage_directory_path)
+    try:
+        if not no_update or rebuild:
+            start = time.perf_counter()
+            indexed = index.update(
+                find_jsonl_files(storage_directory_path),
+                workers=jobs or None,
+                rebuild=rebuild,
+            )
+            if indexed:
+                files, chapters = index.counts()
+                typer.echo(
+                    f"Indexed {indexed} chapters in "
+                    f"{time.perf_counter() - start:.1f}s "
+                    f"({chapters} chapters of {files} files in the index)"
+                )
+
+        start = time.perf_counter()
+        hits = index.search(query, limit=limit, novel_code=novel)
+        elapsed = (time.perf_counter() - start) * 1000
+    finally:
+        index.close()
+
+    for hit in hits:
+        before, match, after = hit["snippet"]
+        typer.echo(
+            f"{hit['novel_code']} {hit['chapter_number']:>5}  {hit['score']:6.2f}  "
+            f"{hit['novel_title'][:20]} / {hit['chapter_title'][:30]}"
+        )
+        typer.echo(f"    {before}{typer.style(match, bold=True)}{after}")
+    typer.echo(f"{len(hits)} hits in {elapsed:.1f} ms")
+
+
+@app.command()
+def serve(
+    directory: str = typer.Argument(
+        "storage_jl",
+        help="Input directory storage for raw jsonl files",
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+    ),
+    host: str = typer.Option("127.0.0.1", "--host", help="Address to listen on"),
+    port: int = typer.Option(8900, "--port", "-p", help="Port to listen on"),
+    cache_mb: int = typer.Option(
+        64, "--cache-mb", help="Memory for rendered chapters, in MB"
+    ),
+):
+    """Serve novels, volumes and chapter ranges over HTTP straight from the jsonl files."""
+    storage_directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
+
+    validate_directory(storage_directory_path)
+
+    typer.echo(
+        f"Serving {storage_directory_path} on http://{host}:{port}/novels, "
+        "press Ctrl-C to stop"
+    )
+    run_server(storage_directory_path, host, port, cache_mb * 1024 * 1024)
+
+
+@app.command()
+def repair(
+    directory: str = typer.Argument(
+        "storage_jl",
+        help="Input directory storage for raw jsonl files",
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+    ),
+    dry_run: bool = typer.Option(
+        False, "--dry-run", help="Only list the missing chapters"
+    ),
+    base_url: str = typer.Option(
+        None,
+        "--base-url",
+        help="Fetch chapters from this host instead of the novel site, e.g. a mock site",
+    ),
+):
+    """Find chapters missing from stored novels and fetch exactly those chapters."""
+    storage_directory_path = os.path.normpath(os.path.join(HOME_USER, directory))
+    typer.echo(f"Processing directory: {storage_directory_path}")
+
+    validate_directory(storage_directory_path)
+
+    gaps = find_gaps(find_jsonl_files(storage_directory_path))
+    for novel in gaps:
+        typer.echo(
+            f"{novel.ncode}: {len(novel.missing)} of {novel.chapter_total} chapters "
+            f"missing ({format_ranges(novel.missing)})"
+        )
+    if not gaps:
+        typer.echo("No missing chapters found")
+        return
+    if dry_run:
+        return
+
+    settings = get_project_settings()
+    # Crawl state goes next to the repaired files
+    settings.set("NOVEL_STORAGE_DIR", storage_directory_path)
+    process = CrawlerProcess(settings)
+    for site, spider_class in (
+        ("syosetu", SyosetuSpider),
+        ("nocturne", NocturneSpider),
+    ):
+        site_gaps = [novel for novel in gaps if novel.site == site]
+        if not site_gaps:
+            continue
+        spider_kwargs = {"repair": repair_targets(site_gaps, base_url)}
+        if base_url:
+            spider_kwargs["allowed_domains"] = [urlparse(base_url).hostname]
+        process.crawl(spider_class, **spider_kwargs)
+    process.start()
+
+    # Fetched chapters were appended, move them into chapter order
+    for novel in gaps:
+        splice_chapters(novel.filepath)
+        still_missing = missing_chapters(
+            ChapterIndex.load(novel.filepath).chapter_numbers(), novel.chapter_total
+        )
+        repaired = len(novel.missing) - len(still_missing)
+        message = f"{novel.ncode}: repaired {repaired} chapters"
+        if still_missing:
+            message += f", still missing {format_ranges(still_missing)}"
+        typer.echo(message)
 
 
-def _crawl_novel(spider_class, start_urls: str, start_chapter: int = None):
+def _crawl_novel(
+    spider_class,
+    start_urls: str,
+    start_chapter: int = None,
+    unpack: bool = False,
+    length: int = 10,
+    job_dir: str = None,
+    spider_kwargs: dict = None,
+    refetch: bool = False,
+):
     """Crawl the specified novel URL and save as JSONL file"""
-    process = CrawlerProcess(get_project_settings())
-    process.crawl(spider_class, start_urls=start_urls, start_chapter=start_chapter)
+    settings = get_project_settings()
+    if refetch:
+        # Request chapters even if they are stored already
+        settings.set("DUPEFILTER_REFETCH", True)
+    if job_dir:
+        # Persist the request queue, seen requests and novel metadata on disk
+        # so memory stays flat and an interrupted crawl can be resumed
+        settings.set("JOBDIR", os.path.expanduser(job_dir))
+    if unpack:
+        # Stream chapters into text chunks while crawling
+        settings.set("STREAM_UNPACK_ENABLED", True)
+        settings.set("STREAM_UNPACK_LENGTH", length)
+    process = CrawlerProcess(settings)
+    process.crawl(
+        spider_class,
+        start_urls=start_urls,
+        start_chapter=start_chapter,
+        **(spider_kwargs or {}),
+    )
     process.start()
 
 
@@ -251,10 +853,38 @@ def syosetu_spider(
         "-sc",
         help="Specify the novel crawl starting chapter number",
     ),
+    unpack: bool = typer.Option(
+        False, "--unpack", "-u", help="Unpack chapters into text files while crawling"
+    ),
+    length: int = typer.Option(
+        10, "--length", "-l", help="chapter text length to unpack jsonl file into"
+    ),
+    job_dir: str = typer.Option(
+        None,
+        "--job-dir",
+        "-d",
+        help="Keep the crawl queue on disk in this directory, rerun to resume",
+    ),
+    text_download: bool = typer.Option(
+        False,
+        "--text-download",
+        "-t",
+        help="Download chapters as plain text instead of HTML where available",
+    ),
+    refetch: bool = typer.Option(
+        False, "--refetch", help="Request chapters that are already stored again"
+    ),
 ):
     """Crawl the specified Syosetu novel URL and save as JSONL file"""
     _crawl_novel(
-        spider_class=SyosetuSpider, start_urls=url, start_chapter=start_chapter
+        spider_class=SyosetuSpider,
+        start_urls=url,
+        start_chapter=start_chapter,
+        unpack=unpack,
+        length=length,
+        job_dir=job_dir,
+        spider_kwargs={"text_download": text_download},
+        refetch=refetch,
     )
 
 
@@ -272,12 +902,216 @@ def nocturne_spider(
         "-sc",
         help="Specify the novel crawl starting chapter number",
     ),
+    unpack: bool = typer.Option(
+        False, "--unpack", "-u", help="Unpack chapters into text files while crawling"
+    ),
+    length: int = typer.Option(
+        10, "--length", "-l", help="chapter text length to unpack jsonl file into"
+    ),
+    job_dir: str = typer.Option(
+        None,
+        "--job-dir",
+        "-d",
+        help="Keep the crawl queue on disk in this directory, rerun to resume",
+    ),
+    refetch: bool = typer.Option(
+        False, "--refetch", help="Request chapters that are already stored again"
+    ),
 ):
     """Crawl the specified Nocturne novel URL and save as JSONL file"""
     _crawl_novel(
-        spider_class=NocturneSpider, start_urls=url, start_chapter=start_chapter
+        spider_class=NocturneSpider,
+        start_urls=url,
+        start_chapter=start_chapter,
+        unpack=unpack,
+        length=length,
+        job_dir=job_dir,
+        refetch=refetch,
     )
 
 
+@app.command()
+def crawl_workers(
+    workers: int = typer.Argument(2, help="Number of crawler processes to start"),
+    urls: List[str] = typer.Argument(
+        None, help="Novel URLs to queue, without any the queue is resumed"
+    ),
+    range_size: int = typer.Option(
+        0,
+        "--range-size",
+        "-r",
+        help="Split novels into jobs of this many chapters, 0 crawls each novel as one job",
+    ),
+    jobs_per_worker: int = typer.Option(
+        2, "--jobs-per-worker", help="Jobs each crawler process runs at once"
+    ),
+    lease: float = typer.Option(
+        300.0,
+        "--lease",
+        help="Seconds before the job of an unresponsive worker is handed out again",
+    ),
+    max_attempts: int = typer.Option(
+        3, "--max-attempts", help="Attempts per job before it is marked failed"
+    ),
+    api_url: str = typer.Option(
+        API_BASE_URL,
+        "--api-url",
+        help="Syosetu API host for chapter totals, used with --range-size",
+    ),
+    log_level: str = typer.Option("INFO", "--log-level", help="Scrapy log level"),
+):
+    """Crawl novels on several processes that share a job queue"""
+    settings = get_project_settings()
+    storage_directory_path = os.path.expanduser(settings.get("NOVEL_STORAGE_DIR"))
+    queue = CrawlQueue(
+        os.path.join(storage_directory_path, QUEUE_FILENAME), max_attempts=max_attempts
+    )
+    if urls:
+        jobs = queue_novels(queue, urls, range_size=range_size, api_url=api_url)
+        typer.echo(f"Queued {jobs} jobs for {len(urls)} novels")
+    if not queue.has_work():
+        typer.echo("No jobs in the queue")
+        queue.close()
+        return
+
+    started = time.time()
+    start_workers(
+        queue.path,
+        workers,
+        settings_overrides={"LOG_LEVEL": log_level},
+        jobs_per_worker=jobs_per_worker,
+        lease_seconds=lease,
+        max_attempts=max_attempts,
+    )
+
+    # Chapter ranges finish in any order, put the chapters of each file in order
+    for path in queue.paths(since=started):
+        if os.path.exists(path):
+            splice_chapters(path)
+    counts = queue.counts()
+    typer.echo(
+        ", ".join(f"{count} {status}" for status, count in counts.items() if count)
+    )
+    for job in queue.failed():
+        typer.echo(
+            f"Failed: {job['url']} chapters {job['start_chapter'] or 1}-"
+            f"{job['end_chapter'] or 'end'}: {job['error']}"
+        )
+    queue.close()
+
+
+def _daemon_socket(socket_path: str = None) -> str:
+    """Socket given on the command line, or the one in the storage directory."""
+    if socket_path:
+        return os.path.expanduser(socket_path)
+    settings = get_project_settings()
+    return os.path.join(
+        os.path.expanduser(settings.get("NOVEL_STORAGE_DIR")), DAEMON_SOCKET_FILENAME
+    )
+
+
+@app.command()
+def daemon(
+    socket_path: str = typer.Option(
+        None,
+        "--socket",
+        help="Unix socket to listen on, default in the storage directory",
+    ),
+    sync_every: float = typer.Option(
+        0.0,
+        "--sync-every",
+        help="Minutes between API checks that crawl novels with new chapters, 0 for none",
+    ),
+    unpack: bool = typer.Option(
+        False,
+        "--unpack",
+        "-u",
+        help="Unpack new chapters into text files after each crawl",
+    ),
+    length: int = typer.Option(
+        10, "--length", "-l", help="chapter text length to unpack jsonl file into"
+    ),
+    max_crawls: int = typer.Option(
+        2, "--max-crawls", help="Crawls running at once, of different novels"
+    ),
+    api_url: str = typer.Option(
+        API_BASE_URL, "--api-url", help="Syosetu API host, e.g. a local stand-in"
+    ),
+    base_url: str = typer.Option(
+        None,
+        "--base-url",
+        help="Crawl synced novels from this host instead of the novel site, e.g. a mock site",
+    ),
+    log_level: str = typer.Option("INFO", "--log-level", help="Scrapy log level"),
+):
+    """Keep one process running that crawls, unpacks and syncs novels on request"""
+    socket_path = _daemon_socket(socket_path)
+    if daemon_running(socket_path):
+        typer.echo(f"A daemon is already listening on {socket_path}")
+        raise typer.Exit(1)
+    settings = get_project_settings()
+    settings.set("LOG_LEVEL", log_level)
+    run_daemon(
+        settings,
+        socket_path,
+        sync_interval=sync_every * 60,
+        api_url=api_url,
+        base_url=base_url,
+        unpack=unpack,
+        length=length,
+        max_crawls=max_crawls,
+    )
+
+
+@app.command()
+def daemon_send(
+    job: str = typer.Argument(
+        "status", help=f"Job to run: {', '.join(JOB_KINDS)} or status"
+    ),
+    novel: str = typer.Argument(
+        None, help="Novel URL or code to crawl or unpack, unpack without one does all"
+    ),
+    start_chapter: int = typer.Option(
+        None,
+        "--start-chapter",
+        "-sc",
+        help="Specify the novel crawl starting chapter number",
+    ),
+    wait: bool = typer.Option(
+        False, "--wait", "-w", help="Wait for the job to finish and print its result"
+    ),
+    socket_path: str = typer.Option(
+        None,
+        "--socket",
+        help="Unix socket of the daemon, default in the storage directory",
+    ),
+):
+    """Hand a job to the running daemon, or show what it is doing"""
+    socket_path = _daemon_socket(socket_path)
+    request = {"job": job, "wait": wait, "start_chapter": start_chapter}
+    if novel:
+        request["url" if "://" in novel else "novel"] = novel
+    try:
+        response = send_request(socket_path, request)
+    except (FileNotFoundError, ConnectionError) as e:
+        typer.echo(f"No daemon on {socket_path}: {e}")
+        raise typer.Exit(1)
+    if not response["ok"]:
+        typer.echo(f"Rejected: {response['error']}")
+        raise typer.Exit(1)
+    if job == "status":
+        typer.echo(f"Up {response['uptime']:.0f}s, {response['novels']} novels stored")
+        jobs = response["jobs"]
+    else:
+        jobs = [response["job"]]
+    for entry in jobs:
+        line = f"Job {entry['id']} {entry['kind']} {entry['novel_code']}: {entry['status']}"
+        if entry["result"] or entry["error"]:
+            line += f", {entry['result'] or entry['error']}"
+        typer.echo(line)
+    if wait and job != "status" and response["job"]["status"] == "failed":
+        raise typer.Exit(1)
+
+
 if __name__ == "__main__":
     app()
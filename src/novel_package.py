@@ -2,6 +2,7 @@ import os
 from dataclasses import dataclass, field
 from typing import Optional, List, Tuple
 from utils_translate import translate_safe_title, translate_title
+from profiling import NULL_PROFILER
 
 # Chapter skipping constants
 SKIP_TITLE_PATTERNS = ["人物紹介", "登場人物"]
@@ -45,6 +46,7 @@ class NovelPackage:
     chapters: List[Chapter] = field(default_factory=list)
     chunk_start_chapter: int = 1
     chunk_end_chapter: int = 0
+    profiler: object = field(default=NULL_PROFILER, repr=False)
 
     def add_chapter(self, chapter: Chapter) -> None:
         """Add a chapter to the novel."""
@@ -91,12 +93,15 @@ class NovelPackage:
             prefix = f"{chapter_start_end} "
         return chapter_start_end, prefix
 
-    def write_chunk_to_file(self, text_content: str, chapter_start_end: str) -> None:
-        """Write a chunk of text to file with appropriate naming and directory structure.
+    def chunk_file_path(
+        self, chapter_start_end: str, novel_title: str, english_title: str
+    ) -> str:
+        """Build the output path of a chunk and create its directories.
 
         Args:
-            text_content (str): The processed text content to write
             chapter_start_end (str): Chapter range text for filename
+            novel_title (str): Japanese novel title, truncated in the filename
+            english_title (str): Translated title naming the novel directory
         """
         # Get the base directory name and add _text suffix
         base_dir = os.path.basename(os.path.dirname(self.filepath_jl))
@@ -107,20 +112,33 @@ class NovelPackage:
         # Create output directory if needed
         os.makedirs(output_text_directory, exist_ok=True)
 
-        english_title = translate_title(self.novel_title)
         if english_title == "Translation error invalid source language":
-            english_title = self.novel_title
+            english_title = novel_title
         # Create a novel-specific directory using the novel title
         novel_directory = os.path.join(output_text_directory, english_title)
         os.makedirs(novel_directory, exist_ok=True)
 
         # Create filename with chapter range and truncated novel title
         title_length = 30
-        filename = f"{chapter_start_end} {self.novel_title[:title_length]}.txt"
+        filename = f"{chapter_start_end} {novel_title[:title_length]}.txt"
 
         # Create full output path
-        file_path = os.path.join(novel_directory, filename)
+        return os.path.join(novel_directory, filename)
+
+    def write_chunk_to_file(self, text_content: str, chapter_start_end: str) -> None:
+        """Write a chunk of text to file with appropriate naming and directory structure.
+
+        Args:
+            text_content (str): The processed text content to write
+            chapter_start_end (str): Chapter range text for filename
+        """
+        with self.profiler.stage("translate"):
+            english_title = translate_title(self.novel_title)
+        file_path = self.chunk_file_path(
+            chapter_start_end, self.novel_title, english_title
+        )
 
         # Write content to file
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(text_content)
+        with self.profiler.stage("write"):
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(text_content)
@@ -1,8 +1,9 @@
 import os
-import jsonlines
 from dataclasses import dataclass, field
 from typing import Optional, List, Dict, Tuple
 from utils_translate import translate_title
+from profiling import NULL_PROFILER
+from novel_store import iter_chapter_records
 
 
 @dataclass
@@ -48,6 +49,8 @@ class Novel:
     chunk_size: int = 10
     chapters: List[Chapter] = field(default_factory=list)
     current_chunk: List[Chapter] = field(default_factory=list)
+    english_title: str = ""
+    profiler: object = field(default=NULL_PROFILER, repr=False)
 
     def add_chapter(self, chapter: Chapter) -> None:
         """Add chapter to novel, handling skip logic."""
@@ -64,11 +67,16 @@ class Novel:
         if not self.current_chunk:
             return
 
+        self.write_chunk()
+        self.current_chunk = []
+
+    def write_chunk(self) -> str:
+        """Write current chunk to file without resetting the buffer, returns the path."""
         start = self.current_chunk[0].number
         end = self.current_chunk[-1].number
-        content = self._build_chunk_content(start, end)
-        self._write_chunk_file(start, end, content)
-        self.current_chunk = []
+        with self.profiler.stage("chunk_assembly"):
+            content = self._build_chunk_content(start, end)
+        return self._write_chunk_file(start, end, content)
 
     def _build_chunk_content(self, start: int, end: int) -> str:
         """Combine chapters into formatted chunk content."""
@@ -80,13 +88,16 @@ class Novel:
         content = "".join(ch.formatted_content() for ch in self.current_chunk)
         return header + content
 
-    def _write_chunk_file(self, start: int, end: int, content: str) -> None:
+    def _write_chunk_file(self, start: int, end: int, content: str) -> str:
         """Write chunk content to appropriately named file."""
         # Use the provided output directory directly
         output_dir = self.output_dir
 
-        # Create filename with chapter range and title
-        safe_title = translate_title(self.title)
+        # Create filename with chapter range and title, translated once per novel
+        if not self.english_title:
+            with self.profiler.stage("translate"):
+                self.english_title = translate_title(self.title)
+        safe_title = self.english_title
         if "error" in safe_title.lower() or not safe_title.strip():
             safe_title = self.title if self.title.strip() else "untitled_novel"
 
@@ -96,39 +107,50 @@ class Novel:
         # Ensure novel-specific directory exists
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
 
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.write(content)
+        with self.profiler.stage("write"):
+            with open(filepath, "w", encoding="utf-8") as f:
+                f.write(content)
+        return filepath
+
+
+def chapter_from_record(data: Dict) -> Chapter:
+    """Create a Chapter from a crawled JSONL record or NovelItem dict."""
+    return Chapter(
+        number=int(data["chapter_number"]),
+        title=data.get("chapter_title", ""),
+        volume=data.get("volume_title", ""),
+        foreword=data.get("chapter_foreword", ""),
+        content=data.get("chapter_text", ""),
+        afterword=data.get("chapter_afterword", ""),
+    )
 
 
-def process_jsonl_file3(filepath: str, output_dir: str, chunk_size: int = 10) -> None:
+def process_jsonl_file3(
+    filepath: str, output_dir: str, chunk_size: int = 10, profiler=NULL_PROFILER
+) -> None:
     """Optimized JSONL processor using new Novel and Chapter classes."""
     # Initialize novel object
     novel = Novel(
         source_path=filepath,
         output_dir=output_dir,
         chunk_size=chunk_size,
+        profiler=profiler,
     )
 
-    with jsonlines.open(filepath) as reader:
-        for data in reader:
-            # Extract novel title and description from the first entry
-            if not novel.title:
-                novel.title = data.get("novel_title", "")
-                novel.description = data.get("novel_description", "")
-
-            chapter = Chapter(
-                number=int(data["chapter_number"]),
-                title=data.get("chapter_title", ""),
-                volume=data.get("volume_title", ""),
-                foreword=data.get("chapter_foreword", ""),
-                content=data.get("chapter_text", ""),
-                afterword=data.get("chapter_afterword", ""),
-            )
-
-            novel.add_chapter(chapter)
-
-            if novel.should_flush_chunk():
-                novel.flush_chunk()
+    for data in profiler.iterate("read_decode", iter_chapter_records(filepath)):
+        # Extract novel title and description from the first entry
+        if not novel.title:
+            novel.title = data.get("novel_title", "")
+            novel.description = data.get("novel_description", "")
+
+        # Chapter.__post_init__ runs the skip pattern check
+        with profiler.stage("skip_check"):
+            chapter = chapter_from_record(data)
+
+        novel.add_chapter(chapter)
+
+        if novel.should_flush_chunk():
+            novel.flush_chunk()
 
     # Flush any remaining chapters
     novel.flush_chunk()
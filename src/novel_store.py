@@ -0,0 +1,666 @@
+import os
+import io
+import gzip
+import json
+import sqlite3
+import jsonlines
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, IO, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+INDEX_SUFFIX = ".idx"
+LOCK_SUFFIX = ".lock"
+CRAWL_STATE_FILENAME = "crawl_state.sqlite3"
+NOVEL_META_FILENAME = "novel_meta.sqlite3"
+
+# Version 2 of the .jl layout writes the novel level fields once in a header
+# record, followed by slim chapter records that leave them out
+SCHEMA_VERSION = 2
+HEADER_RECORD_TYPE = "novel"
+NOVEL_FIELDS = ["novel_code", "novel_title", "novel_description"]
+# chapter_title is the last metadata key in both layouts, decode_metadata
+# decodes a line only up to the key after it
+TITLE_KEY = b'"chapter_title": '
+NEXT_KEY = b', "chapter_'
+
+
+def open_jl(filepath: str, mode: str = "r") -> IO:
+    """Open a .jl or gzip compressed .jl.gz file as utf-8 text.
+
+    Args:
+        filepath (str): Path to the JSON lines file.
+        mode (str): "r", "w" or "a".
+    Returns:
+        IO: Text file object.
+    """
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, f"{mode}t", encoding="utf-8")
+    return open(filepath, mode, encoding="utf-8")
+
+
+def novel_code_from_url(url: str) -> str:
+    """Get the novel code from a novel or chapter url, '/n1313ff/74/' -> 'n1313ff'."""
+    path = url.split("://", 1)[-1].split("/", 1)[-1]
+    return path.strip("/").split("/")[0]
+
+
+def is_header(record: Dict) -> bool:
+    return record.get("record_type") == HEADER_RECORD_TYPE
+
+
+def _chapter_total(record: Dict) -> Optional[int]:
+    """Last chapter number from chapter_start_end, '74/120' -> 120."""
+    total = str(record.get("chapter_start_end") or "").partition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+def novel_header(record: Dict) -> Dict:
+    """Build the v2 header record from a v1 record or NovelItem dict."""
+    header = {"record_type": HEADER_RECORD_TYPE, "schema_version": SCHEMA_VERSION}
+    for name in NOVEL_FIELDS:
+        if name in record:
+            header[name] = record[name]
+    header["chapter_total"] = _chapter_total(record)
+    return header
+
+
+def slim_record(record: Dict, header: Dict) -> Dict:
+    """Build the v2 chapter record of a v1 record, without the fields in the header.
+
+    chapter_number becomes an integer and chapter_start_end is only kept when it
+    does not follow from the chapter number and the header chapter_total.
+    """
+    slim = {}
+    for name, value in record.items():
+        if name in NOVEL_FIELDS:
+            continue
+        if name == "chapter_start_end":
+            if value == f"{record.get('chapter_number')}/{header['chapter_total']}":
+                continue
+        elif name == "chapter_number" and str(value).isdigit():
+            value = int(value)
+        slim[name] = value
+    return slim
+
+
+def expand_record(record: Dict, header: Optional[Dict]) -> Dict:
+    """Return a chapter record in the v1 layout, filling in the header fields.
+
+    v1 records already carry the novel fields and are returned unchanged, so
+    files mixing both layouts read fine.
+    """
+    if header is None or "novel_title" in record:
+        return record
+    expanded = {name: header[name] for name in NOVEL_FIELDS if name in header}
+    for name, value in record.items():
+        if name == "chapter_number":
+            total = header.get("chapter_total")
+            if "chapter_start_end" not in record and total is not None:
+                expanded["chapter_start_end"] = f"{value}/{total}"
+            value = str(value)
+        expanded[name] = value
+    return expanded
+
+
+class RecordEncoder:
+    """Turn v1 records into v2 records, adding a header when the novel fields change."""
+
+    def __init__(self):
+        self.header: Optional[Dict] = None
+
+    def encode(self, record: Dict) -> List[Dict]:
+        header = novel_header(record)
+        records = []
+        if header != self.header:
+            self.header = header
+            records.append(header)
+        records.append(slim_record(record, header))
+        return records
+
+
+def decode_metadata(line: bytes) -> Dict:
+    """Decode the fields up to chapter_title of a record, or all of it."""
+    title = line.find(TITLE_KEY)
+    # A quote inside a JSON string is escaped, so the next key is a real key
+    cut = line.find(NEXT_KEY, title) if title != -1 else -1
+    if cut != -1:
+        return json.loads(line[:cut] + b"}")
+    # Header records, or chapter_title last or written with other separators
+    return json.loads(line)
+
+
+def iter_chapter_records(filepath: str, skip_invalid: bool = False) -> Iterator[Dict]:
+    """Yield the chapter records of a v1 or v2 .jl file, all in the v1 layout.
+
+    Args:
+        filepath (str): Path to the JSON lines file, .jl or .jl.gz.
+        skip_invalid (bool): Skip lines that are not JSON objects instead of raising.
+    """
+    header = None
+    with open_jl(filepath) as f, jsonlines.Reader(f) as reader:
+        for record in reader.iter(type=dict, skip_invalid=skip_invalid):
+            if is_header(record):
+                header = record
+                continue
+            yield expand_record(record, header)
+
+
+def _first_record(filepath: str) -> Optional[Dict]:
+    with open_jl(filepath) as f:
+        for line in f:
+            if line.strip():
+                return json.loads(line)
+    return None
+
+
+def migrate_jl_file(filepath: str) -> bool:
+    """Rewrite a v1 .jl or .jl.gz file in the v2 layout, streaming line by line.
+
+    The new file is written next to the old one and renamed over it, and the
+    chapter index is rebuilt for the new offsets.
+
+    Returns:
+        bool: False if the file was already in the v2 layout or empty.
+    """
+    first = _first_record(filepath)
+    if first is None or is_header(first):
+        return False
+    directory, name = os.path.split(filepath)
+    # Keeps the .gz suffix so open_jl writes the same compression
+    temp_path = os.path.join(directory, f".migrate.{name}")
+    encoder = RecordEncoder()
+    try:
+        with open_jl(temp_path, "w") as writer:
+            for record in iter_chapter_records(filepath):
+                for v2_record in encoder.encode(record):
+                    writer.write(json.dumps(v2_record, ensure_ascii=False) + "\n")
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, filepath)
+    ChapterIndex(filepath).rebuild()
+    return True
+
+
+@contextmanager
+def file_lock(filepath: str) -> Iterator[None]:
+    """Hold an exclusive lock on '<file>.lock' that other processes wait for."""
+    with open(f"{filepath}{LOCK_SUFFIX}", "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def open_binary(filepath: str, mode: str = "rb") -> IO:
+    return (
+        gzip.open(filepath, mode) if filepath.endswith(".gz") else open(filepath, mode)
+    )
+
+
+def read_records(filepath: str, spans: List[Tuple[int, int]]) -> Dict[int, Dict]:
+    """Decode the records at (offset, length) spans of a .jl file, by offset.
+
+    Only those lines are decoded. The spans are read in file order, so a
+    gzip stream is decompressed once, up to the last of them.
+    """
+    records = {}
+    with open_binary(filepath) as f:
+        for offset, length in sorted(spans):
+            f.seek(offset)
+            records[offset] = json.loads(f.read(length))
+    return records
+
+
+def scan_chapters(filepath: str) -> Dict:
+    """Read the novel fields and the stored chapter numbers of a .jl file.
+
+    Only the metadata of each record is decoded. chapter_total is the highest
+    total seen in chapter_start_end or a v2 header.
+
+    Returns:
+        dict: novel_code, novel_title, novel_description, chapter_total and the
+            sorted chapter numbers as chapters.
+    """
+    novel = {
+        "novel_code": "",
+        "novel_title": "",
+        "novel_description": "",
+        "chapter_total": 0,
+    }
+    chapters = set()
+    header = None
+    with open_binary(filepath) as f:
+        for line in f:
+            if line.isspace():
+                continue
+            record = decode_metadata(line)
+            if is_header(record):
+                header = record
+                continue
+            record = expand_record(record, header)
+            chapters.add(int(record["chapter_number"]))
+            for name in NOVEL_FIELDS:
+                novel[name] = record.get(name) or novel[name]
+            novel["chapter_total"] = max(
+                novel["chapter_total"], _chapter_total(record) or 0
+            )
+    novel["chapters"] = sorted(chapters)
+    return novel
+
+
+def splice_chapters(filepath: str) -> int:
+    """Move chapters appended out of order into place and drop repeated chapters.
+
+    Chapters that come after a higher chapter number, like the ones the
+    repair command appends, are held in memory and merged into place while
+    the file is rewritten in one forward pass, so this works on .jl.gz files
+    too. v2 chapters keep the header they were written under. The new file
+    replaces the old one by rename and the chapter index is rebuilt.
+
+    Returns:
+        int: Number of chapters moved or dropped, 0 if the file was left as is.
+    """
+    moved: List[Tuple[int, int, bytes, Optional[bytes]]] = []
+    out_of_order = set()
+    seen = set()
+    highest = 0
+    header_line = None
+    with open_binary(filepath) as f:
+        for position, line in enumerate(f):
+            if line.isspace():
+                continue
+            record = decode_metadata(line)
+            if is_header(record):
+                header_line = line
+                continue
+            number = int(record["chapter_number"])
+            if number in seen or number < highest:
+                out_of_order.add(position)
+                if number not in seen:
+                    # v1 records carry their own novel fields and need no header
+                    header = header_line if "novel_title" not in record else None
+                    moved.append((number, position, line, header))
+            else:
+                highest = number
+            seen.add(number)
+    if not out_of_order:
+        return 0
+
+    moved.sort()
+    directory, name = os.path.split(filepath)
+    # Keeps the .gz suffix so the new file gets the same compression
+    temp_path = os.path.join(directory, f".splice.{name}")
+    written_header = None
+
+    def write_chapter(writer, line: bytes, header: Optional[bytes]) -> None:
+        nonlocal written_header
+        if header is not None and header != written_header:
+            writer.write(header)
+            written_header = header
+        writer.write(line)
+
+    try:
+        with open_binary(filepath) as reader, open_binary(temp_path, "wb") as writer:
+            header_line = None
+            for position, line in enumerate(reader):
+                if line.isspace() or position in out_of_order:
+                    continue
+                record = decode_metadata(line)
+                if is_header(record):
+                    header_line = line
+                    continue
+                number = int(record["chapter_number"])
+                while moved and moved[0][0] < number:
+                    _, _, moved_line, moved_header = moved.pop(0)
+                    write_chapter(writer, moved_line, moved_header)
+                write_chapter(
+                    writer, line, header_line if "novel_title" not in record else None
+                )
+            for _, _, moved_line, moved_header in moved:
+                write_chapter(writer, moved_line, moved_header)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, filepath)
+    ChapterIndex(filepath).rebuild()
+    return len(out_of_order)
+
+
+class ChapterIndex:
+    """Sidecar index of chapter byte offsets for a .jl file.
+
+    Stored next to the data file as '<file>.idx' with one tab separated
+    'chapter_number offset length' line per chapter. Offsets point into the
+    uncompressed stream so the same index works for .jl and .jl.gz files.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.index_path = f"{filepath}{INDEX_SUFFIX}"
+        self.entries: Dict[int, Tuple[int, int]] = {}
+        self.end_offset = 0
+
+    @classmethod
+    def load(cls, filepath: str, write: bool = True) -> "ChapterIndex":
+        """Load the index of a file, rebuilding it if missing or out of date.
+
+        With write=False a rebuilt index is only kept in memory, for readers
+        that must not replace an index the storage pipeline appends to.
+        """
+        index = cls(filepath)
+        if not os.path.exists(filepath):
+            return index
+        if not os.path.exists(index.index_path) or os.path.getmtime(
+            index.index_path
+        ) < os.path.getmtime(filepath):
+            index.rebuild(write=write)
+            return index
+        with open(index.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                number, offset, length = (int(value) for value in line.split("\t"))
+                index._add(number, offset, length)
+        return index
+
+    def _add(self, number: int, offset: int, length: int) -> None:
+        self.entries[number] = (offset, length)
+        self.end_offset = max(self.end_offset, offset + length)
+
+    def rebuild(self, write: bool = True) -> None:
+        """Scan the data file and write a fresh index.
+
+        A last line without a newline is still being written and left out.
+        """
+        self.entries = {}
+        self.end_offset = 0
+        opener = gzip.open if self.filepath.endswith(".gz") else open
+        offset = 0
+        with opener(self.filepath, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                if line.strip():
+                    number = json.loads(line).get("chapter_number")
+                    if number is not None:
+                        self._add(int(number), offset, len(line))
+                offset += len(line)
+        self.end_offset = offset
+        if not write:
+            return
+        with open(self.index_path, "w", encoding="utf-8") as f:
+            f.writelines(
+                f"{number}\t{offset}\t{length}\n"
+                for number, (offset, length) in sorted(self.entries.items())
+            )
+
+    def append(self, entries: List[Tuple[int, int, int]]) -> None:
+        """Append (chapter_number, offset, length) entries to the index file."""
+        if not entries:
+            return
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            for number, offset, length in entries:
+                self._add(number, offset, length)
+                f.write(f"{number}\t{offset}\t{length}\n")
+
+    def __contains__(self, chapter_number: int) -> bool:
+        return chapter_number in self.entries
+
+    def chapter_numbers(self) -> List[int]:
+        return sorted(self.entries)
+
+
+class CrawlState:
+    """SQLite store of what has been crawled per novel, keyed by novel code."""
+
+    FIELDS = [
+        "site",
+        "path",
+        "novel_title",
+        "last_chapter",
+        "total_chapters",
+        "chapters_stored",
+        "updated_at",
+    ]
+
+    def __init__(self, storage_directory: str):
+        os.makedirs(storage_directory, exist_ok=True)
+        self.path = os.path.join(storage_directory, CRAWL_STATE_FILENAME)
+        # A timeout lets several crawler processes share the database
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS novels (
+                novel_code TEXT PRIMARY KEY,
+                site TEXT,
+                path TEXT,
+                novel_title TEXT,
+                last_chapter INTEGER,
+                total_chapters INTEGER,
+                chapters_stored INTEGER,
+                first_seen TEXT,
+                updated_at TEXT
+            )""")
+        self.connection.commit()
+
+    def update(self, novel_code: str, **values) -> None:
+        """Insert or update the state of a novel."""
+        values["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        columns = [name for name in self.FIELDS if name in values]
+        self.connection.execute(
+            f"INSERT INTO novels (novel_code, first_seen, {', '.join(columns)}) "
+            f"VALUES (?, ?, {', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(novel_code) DO UPDATE SET "
+            f"{', '.join(f'{name} = excluded.{name}' for name in columns)}",
+            [novel_code, values["updated_at"], *(values[name] for name in columns)],
+        )
+        self.connection.commit()
+
+    def get(self, novel_code: str) -> Optional[Dict]:
+        row = self.connection.execute(
+            "SELECT * FROM novels WHERE novel_code = ?", (novel_code,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def all(self) -> List[Dict]:
+        return [
+            dict(row)
+            for row in self.connection.execute(
+                "SELECT * FROM novels ORDER BY novel_code"
+            )
+        ]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class NovelMetaStore:
+    """Per-novel metadata shared by all requests of a crawl, keyed by novel code.
+
+    Requests only carry the novel code in meta, so queued requests stay small.
+    The store lives in the JOBDIR when one is set so a resumed crawl finds the
+    metadata of requests queued by the previous run, otherwise in memory.
+    """
+
+    def __init__(self, job_directory: Optional[str] = None):
+        if job_directory:
+            os.makedirs(job_directory, exist_ok=True)
+            self.path = os.path.join(job_directory, NOVEL_META_FILENAME)
+        else:
+            self.path = ":memory:"
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS novel_meta "
+            "(novel_code TEXT PRIMARY KEY, meta TEXT)"
+        )
+        self.connection.commit()
+        self.cache: Dict[str, Dict] = {}
+
+    def set(self, novel_code: str, **values) -> None:
+        """Store metadata of a novel, merged into what is already stored."""
+        meta = {**self.get(novel_code), **values}
+        self.connection.execute(
+            "INSERT OR REPLACE INTO novel_meta VALUES (?, ?)",
+            (novel_code, json.dumps(meta, ensure_ascii=False)),
+        )
+        self.connection.commit()
+        self.cache[novel_code] = meta
+
+    def get(self, novel_code: str) -> Dict:
+        if novel_code not in self.cache:
+            row = self.connection.execute(
+                "SELECT meta FROM novel_meta WHERE novel_code = ?", (novel_code,)
+            ).fetchone()
+            if row is None:
+                return {}
+            self.cache[novel_code] = json.loads(row[0])
+        return self.cache[novel_code]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class NovelFileWriter:
+    """Buffered appender for one novel's canonical .jl file with its chapter index.
+
+    Index entries are only written after the data they point to has been
+    flushed and fsynced, so the index never references lost data.
+
+    A shared writer lets several processes append to the same file. Lines are
+    held in memory until sync, which takes the file lock, reloads the index
+    if another process appended, drops chapters that are stored by now and
+    appends the rest in one go.
+    """
+
+    def __init__(
+        self, filepath: str, buffer_size: int = 1024 * 1024, shared: bool = False
+    ):
+        self.filepath = filepath
+        self.shared = shared
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        self.index = ChapterIndex.load(filepath)
+        self.pending: List[Tuple[int, int, int]] = []
+        # Lines of a shared writer as (chapter_number or None for headers, line)
+        self.buffered: List[Tuple[Optional[int], bytes]] = []
+        if shared:
+            self.file_size = self._file_size()
+            return
+        if os.path.exists(filepath) and not filepath.endswith(".gz"):
+            self.offset = os.path.getsize(filepath)
+        else:
+            self.offset = self.index.end_offset
+        self.raw = open(filepath, "ab", buffering=0)
+        if filepath.endswith(".gz"):
+            self.stream = io.BufferedWriter(
+                gzip.GzipFile(fileobj=self.raw, mode="ab"), buffer_size=buffer_size
+            )
+        else:
+            self.stream = io.BufferedWriter(self.raw, buffer_size=buffer_size)
+
+    def _file_size(self) -> int:
+        return os.path.getsize(self.filepath) if os.path.exists(self.filepath) else 0
+
+    def write_header(self, line: bytes) -> None:
+        """Write a line without an index entry, like a v2 header record.
+
+        Headers are only written right before a chapter so the index end
+        offset, which gzip appends continue from, still covers them.
+        """
+        if self.shared:
+            self.buffered.append((None, line))
+            return
+        self.stream.write(line)
+        self.offset += len(line)
+
+    def write(self, chapter_number: int, line: bytes) -> None:
+        if self.shared:
+            self.buffered.append((chapter_number, line))
+            return
+        self.stream.write(line)
+        self.pending.append((chapter_number, self.offset, len(line)))
+        self.offset += len(line)
+
+    def __contains__(self, chapter_number: int) -> bool:
+        return (
+            chapter_number in self.index
+            or any(number == chapter_number for number, _, _ in self.pending)
+            or any(number == chapter_number for number, _ in self.buffered)
+        )
+
+    def sync(self) -> None:
+        """Flush buffered data, fsync it and then record the pending index entries."""
+        if self.shared:
+            self._sync_shared()
+            return
+        if not self.pending:
+            return
+        self.stream.flush()
+        if isinstance(self.stream.raw, gzip.GzipFile):
+            # Ends a deflate block so the written data is decodable after a crash
+            self.stream.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.index.append(self.pending)
+        self.pending = []
+
+    def _sync_shared(self) -> None:
+        if not self.buffered:
+            return
+        with file_lock(self.filepath):
+            if self._file_size() != self.file_size:
+                # Another process appended since the last sync
+                self.index = ChapterIndex.load(self.filepath)
+            if self.filepath.endswith(".gz"):
+                offset = self.index.end_offset
+            else:
+                offset = self._file_size()
+            with open(self.filepath, "ab") as raw:
+                # Every sync of a compressed file appends a gzip member of its own
+                stream = (
+                    gzip.GzipFile(fileobj=raw, mode="ab")
+                    if self.filepath.endswith(".gz")
+                    else raw
+                )
+                header = None
+                for chapter_number, line in self.buffered:
+                    if chapter_number is None:
+                        header = line
+                        continue
+                    if chapter_number in self.index:
+                        continue
+                    # A header is only written with the chapter it applies to
+                    if header is not None:
+                        stream.write(header)
+                        offset += len(header)
+                        header = None
+                    stream.write(line)
+                    self.pending.append((chapter_number, offset, len(line)))
+                    offset += len(line)
+                if stream is not raw:
+                    stream.close()
+                raw.flush()
+                os.fsync(raw.fileno())
+            self.index.append(self.pending)
+            self.index.end_offset = offset
+            self.file_size = self._file_size()
+        self.pending = []
+        self.buffered = []
+
+    def close(self) -> None:
+        self.sync()
+        if self.shared:
+            return
+        self.stream.close()
+        self.raw.close()
@@ -0,0 +1,395 @@
+import os
+import time
+import json
+import asyncio
+import hashlib
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional
+from googletrans import Translator
+from novel_store import open_jl
+
+# Record fields translated paragraph by paragraph
+TEXT_FIELDS = ["chapter_title", "chapter_foreword", "chapter_text", "chapter_afterword"]
+PARAGRAPH_CACHE_FILENAME = "paragraph_cache.sqlite3"
+# Where a paragraph too long for one request is split
+SENTENCE_ENDS = ["。", "！", "？", "!", "?", "」", "、"]
+
+
+def paragraph_hash(paragraph: str) -> str:
+    """Content hash used to dedupe paragraphs across the whole library."""
+    return hashlib.sha1(paragraph.encode("utf-8")).hexdigest()
+
+
+def split_paragraphs(text: str) -> List[str]:
+    """Split chapter text into paragraphs, one per line as crawled from <p> tags."""
+    return text.split("\n") if text else []
+
+
+def split_long_paragraph(paragraph: str, max_chars: int) -> List[str]:
+    """Split a paragraph into pieces of at most max_chars, after a sentence end if there is one."""
+    pieces = []
+    while len(paragraph) > max_chars:
+        cut = max(paragraph.rfind(mark, 0, max_chars) for mark in SENTENCE_ENDS) + 1
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(paragraph[:cut])
+        paragraph = paragraph[cut:]
+    if paragraph:
+        pieces.append(paragraph)
+    return pieces
+
+
+def needs_translation(paragraph: str) -> bool:
+    """Blank lines and lines without any letters are copied as they are."""
+    return any(character.isalpha() for character in paragraph)
+
+
+class ParagraphCache:
+    """Persistent SQLite cache of translated paragraphs keyed by content hash."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS paragraphs "
+            "(hash TEXT PRIMARY KEY, source TEXT, translation TEXT)"
+        )
+        self.connection.commit()
+
+    def missing(self, hashes: Iterable[str]) -> List[str]:
+        """Return the hashes that have no cached translation."""
+        hashes = list(hashes)
+        found = set()
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start : start + 500]
+            rows = self.connection.execute(
+                f"SELECT hash FROM paragraphs WHERE hash IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            found.update(row[0] for row in rows)
+        return [value for value in hashes if value not in found]
+
+    def get_many(self, hashes: Iterable[str]) -> Dict[str, str]:
+        hashes = list(hashes)
+        translations = {}
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start : start + 500]
+            rows = self.connection.execute(
+                f"SELECT hash, translation FROM paragraphs WHERE hash IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            translations.update(rows)
+        return translations
+
+    def put_many(self, entries: List[tuple]) -> None:
+        """Store (hash, source, translation) rows and commit, so runs can resume."""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO paragraphs VALUES (?, ?, ?)", entries
+        )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class TranslationBackend(ABC):
+    """Base class for translation backends, translate a batch of paragraphs."""
+
+    name = "base"
+    # Largest number of characters sent in one request
+    max_batch_chars = 4500
+    # Set by translate_missing, every request waits for it
+    limiter: Optional["RateLimiter"] = None
+
+    async def throttle(self) -> None:
+        """Wait until the rate limit allows one more request."""
+        if self.limiter is not None:
+            await self.limiter.acquire()
+
+    @abstractmethod
+    async def translate_batch(self, paragraphs: List[str]) -> List[str]:
+        """Translations of the paragraphs, in the same order."""
+
+
+class GoogleBackend(TranslationBackend):
+    """Google Translate through googletrans, the same client as translate_to_eng.
+
+    googletrans sends one request per item of a list, so a batch is sent as
+    one text with a paragraph per line and split again. If the translation
+    has another number of lines, the paragraphs are sent one by one.
+    """
+
+    name = "google"
+
+    def __init__(self, src: str = "ja", dest: str = "en"):
+        self.src = src
+        self.dest = dest
+        self.translator = Translator()
+        self.requests = 0
+
+    async def _translate(self, text: str) -> str:
+        await self.throttle()
+        self.requests += 1
+        result = await self.translator.translate(text, src=self.src, dest=self.dest)
+        return result.text
+
+    async def translate_batch(self, paragraphs: List[str]) -> List[str]:
+        lines = (await self._translate("\n".join(paragraphs))).split("\n")
+        if len(lines) == len(paragraphs):
+            return lines
+        return [await self._translate(paragraph) for paragraph in paragraphs]
+
+
+class FakeBackend(TranslationBackend):
+    """Local stand-in translator for tests and dry runs, no network access."""
+
+    name = "fake"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.requests = 0
+
+    async def translate_batch(self, paragraphs: List[str]) -> List[str]:
+        await self.throttle()
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return [f"[en] {paragraph}" for paragraph in paragraphs]
+
+
+BACKENDS = {"google": GoogleBackend, "fake": FakeBackend}
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per second with short bursts."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def iter_file_paragraphs(filepath: str) -> Iterable[str]:
+    """Yield every translatable paragraph of the text fields of a .jl file."""
+    with open_jl(filepath) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            for field_name in TEXT_FIELDS:
+                for paragraph in split_paragraphs(record.get(field_name) or ""):
+                    if needs_translation(paragraph):
+                        yield paragraph
+
+
+def make_batches(paragraphs: Dict[str, str], max_chars: int) -> List[List[tuple]]:
+    """Group (hash, paragraph) pairs into batches below the backend size limit."""
+    batches: List[List[tuple]] = []
+    batch: List[tuple] = []
+    size = 0
+    for key, paragraph in paragraphs.items():
+        if batch and size + len(paragraph) > max_chars:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append((key, paragraph))
+        size += len(paragraph)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def translate_missing(
+    paragraphs: Dict[str, str],
+    cache: ParagraphCache,
+    backend: TranslationBackend,
+    concurrency: int = 4,
+    rate: float = 2.0,
+    progress=None,
+) -> int:
+    """Translate the paragraphs not yet in the cache, storing each finished batch.
+
+    Args:
+        paragraphs (dict): Unique paragraphs keyed by content hash.
+        cache (ParagraphCache): Cache the translations are written to.
+        backend (TranslationBackend): Backend used for the requests.
+        concurrency (int): Requests in flight at the same time.
+        rate (float): Maximum requests per second, 0 for no limit.
+        progress (callable): Called with (done, total) batches.
+    Returns:
+        int: Number of paragraphs translated.
+
+    Paragraphs longer than backend.max_batch_chars are translated in pieces,
+    and cached once all their pieces are translated.
+    """
+    requests: Dict[str, str] = {}
+    long_paragraphs: Dict[str, int] = {}
+    for key, paragraph in paragraphs.items():
+        if len(paragraph) <= backend.max_batch_chars:
+            requests[key] = paragraph
+            continue
+        pieces = split_long_paragraph(paragraph, backend.max_batch_chars)
+        long_paragraphs[key] = len(pieces)
+        for number, piece in enumerate(pieces):
+            requests[f"{key}:{number}"] = piece
+    piece_translations: Dict[str, str] = {}
+    batches = make_batches(requests, backend.max_batch_chars)
+    semaphore = asyncio.Semaphore(concurrency)
+    backend.limiter = RateLimiter(rate, burst=concurrency)
+    done = 0
+
+    async def run_batch(batch):
+        nonlocal done
+        async with semaphore:
+            translations = await backend.translate_batch([text for _, text in batch])
+        entries = []
+        for (key, text), translation in zip(batch, translations):
+            if ":" in key:
+                piece_translations[key] = translation
+            else:
+                entries.append((key, text, translation))
+        cache.put_many(entries)
+        done += 1
+        if progress:
+            progress(done, len(batches))
+
+    await asyncio.gather(*(run_batch(batch) for batch in batches))
+    cache.put_many(
+        [
+            (
+                key,
+                paragraphs[key],
+                " ".join(
+                    piece_translations[f"{key}:{number}"] for number in range(count)
+                ),
+            )
+            for key, count in long_paragraphs.items()
+        ]
+    )
+    return len(paragraphs)
+
+
+def _translate_field(
+    text: Optional[str], translations: Dict[str, str]
+) -> Optional[str]:
+    if not text:
+        return text
+    return "\n".join(
+        translations.get(paragraph_hash(paragraph), paragraph)
+        for paragraph in split_paragraphs(text)
+    )
+
+
+def write_english_edition(
+    filepath: str, output_path: str, cache: ParagraphCache
+) -> None:
+    """Write a copy of a .jl file with the text fields replaced by cached translations."""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temp_path = f"{output_path}.tmp"
+    with open_jl(filepath) as reader, open(temp_path, "w", encoding="utf-8") as writer:
+        for line in reader:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            hashes = {
+                paragraph_hash(paragraph)
+                for field_name in TEXT_FIELDS
+                for paragraph in split_paragraphs(record.get(field_name) or "")
+                if needs_translation(paragraph)
+            }
+            translations = cache.get_many(hashes)
+            for field_name in TEXT_FIELDS:
+                if field_name in record:
+                    record[field_name] = _translate_field(
+                        record[field_name], translations
+                    )
+            writer.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(temp_path, output_path)
+
+
+def translate_library(
+    jsonl_files: List[str],
+    input_directory: str,
+    output_directory: str,
+    backend: TranslationBackend,
+    cache_path: str,
+    concurrency: int = 4,
+    rate: float = 2.0,
+    echo=print,
+) -> Dict[str, int]:
+    """Produce English editions of .jl files, translating each unique paragraph once.
+
+    Finished files (output newer than input) are skipped and translated
+    paragraphs are committed to the cache batch by batch, so an interrupted run
+    resumes where it stopped.
+    """
+    cache = ParagraphCache(cache_path)
+    todo = []
+    for filepath in jsonl_files:
+        relative_path = os.path.relpath(filepath, input_directory)
+        if relative_path.endswith(".gz"):
+            relative_path = relative_path[: -len(".gz")]
+        output_path = os.path.join(output_directory, relative_path)
+        if os.path.exists(output_path) and os.path.getmtime(
+            output_path
+        ) >= os.path.getmtime(filepath):
+            echo(f"Already translated, skipping: {filepath}")
+            continue
+        todo.append((filepath, output_path))
+
+    # Dedupe paragraphs across every file before asking the cache
+    unique: Dict[str, str] = {}
+    total_paragraphs = 0
+    for filepath, _ in todo:
+        for paragraph in iter_file_paragraphs(filepath):
+            total_paragraphs += 1
+            unique.setdefault(paragraph_hash(paragraph), paragraph)
+    missing = {key: unique[key] for key in cache.missing(unique)}
+    echo(
+        f"{total_paragraphs} paragraphs, {len(unique)} unique, "
+        f"{len(missing)} not in cache"
+    )
+
+    try:
+        if missing:
+            asyncio.run(
+                translate_missing(
+                    missing,
+                    cache,
+                    backend,
+                    concurrency=concurrency,
+                    rate=rate,
+                    progress=lambda done, total: echo(
+                        f"Translated batch {done}/{total}"
+                    ),
+                )
+            )
+        for filepath, output_path in todo:
+            echo(f"Writing English edition: {output_path}")
+            write_english_edition(filepath, output_path, cache)
+    finally:
+        cache.close()
+
+    return {
+        "files": len(todo),
+        "paragraphs": total_paragraphs,
+        "unique": len(unique),
+        "translated": len(missing),
+    }
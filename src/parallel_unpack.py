@@ -0,0 +1,119 @@
+import os
+import json
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from novel_package_v2 import Chapter, Novel, chapter_from_record, process_jsonl_file3
+from profiling import NULL_PROFILER
+from novel_store import is_header
+
+# Split each file into this many byte ranges per worker so workers stay busy
+RANGES_PER_WORKER = 4
+# Smaller files are unpacked sequentially, starting the pool costs more than it saves
+PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+
+
+def split_byte_ranges(filepath: str, parts: int) -> List[Tuple[int, int]]:
+    """Split a file into roughly equal byte ranges that start and end on line boundaries.
+
+    Args:
+        filepath (str): Path to an uncompressed .jl file.
+        parts (int): Number of ranges wanted.
+    Returns:
+        list: (start, end) byte offsets covering the whole file.
+    """
+    size = os.path.getsize(filepath)
+    if size == 0:
+        return []
+    with (
+        open(filepath, "rb") as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data,
+    ):
+        boundaries = [0]
+        step = max(1, size // parts)
+        for index in range(1, parts):
+            newline = data.find(b"\n", max(boundaries[-1], index * step))
+            if newline == -1:
+                break
+            if newline + 1 > boundaries[-1] and newline + 1 < size:
+                boundaries.append(newline + 1)
+        boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _decode_range(task: Tuple[str, int, int]):
+    """Decode and format the chapters in one byte range of a .jl file.
+
+    Runs in a worker process. Returns the first novel title and description
+    seen in the range, from a v1 chapter or a v2 header record, and (chapter_number, formatted_content) for every
+    chapter that is not skipped.
+    """
+    filepath, start, end = task
+    novel_info: Optional[Tuple[str, str]] = None
+    chapters = []
+    with (
+        open(filepath, "rb") as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data,
+    ):
+        for line in data[start:end].splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            # In v2 files the novel fields are in header records, chapters do without them
+            if novel_info is None and record.get("novel_title", ""):
+                novel_info = (
+                    record["novel_title"],
+                    record.get("novel_description", ""),
+                )
+            if is_header(record):
+                continue
+            chapter = chapter_from_record(record)
+            if not chapter.is_skipped:
+                chapters.append((chapter.number, chapter.formatted_content()))
+    return novel_info, chapters
+
+
+def process_jsonl_file3_parallel(
+    filepath: str,
+    output_dir: str,
+    chunk_size: int = 10,
+    workers: Optional[int] = None,
+    profiler=NULL_PROFILER,
+) -> None:
+    """process_jsonl_file3 for very large files, decoding chapters on all cores.
+
+    The file is memory-mapped and split into newline aligned byte ranges that
+    worker processes decode and format. This process stitches the results
+    back in file order into the same chunks process_jsonl_file3 writes, so the
+    output is identical to the sequential path. Compressed files, which cannot
+    be split, and files below PARALLEL_MIN_BYTES are handled sequentially.
+    """
+    if filepath.endswith(".gz") or os.path.getsize(filepath) < PARALLEL_MIN_BYTES:
+        process_jsonl_file3(filepath, output_dir, chunk_size, profiler=profiler)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    ranges = split_byte_ranges(filepath, workers * RANGES_PER_WORKER)
+    novel = Novel(
+        source_path=filepath,
+        output_dir=output_dir,
+        chunk_size=chunk_size,
+        profiler=profiler,
+    )
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            _decode_range, [(filepath, start, end) for start, end in ranges]
+        )
+        for novel_info, chapters in profiler.iterate("read_decode", results):
+            if not novel.title and novel_info:
+                novel.title, novel.description = novel_info
+            for number, content in chapters:
+                # Already formatted, so the chapter is just its content
+                novel.add_chapter(Chapter(number=number, content=content))
+                if novel.should_flush_chunk():
+                    novel.flush_chunk()
+                    novel.chapters.clear()
+
+    # Flush any remaining chapters
+    novel.flush_chunk()
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import cProfile
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Stages timed inside the process_jsonl_file* engines, in pipeline order
+STAGES = ["read_decode", "skip_check", "chunk_assembly", "translate", "write"]
+
+
+class _Stage:
+    """Context manager adding its elapsed time to a profiler counter."""
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "StageProfiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, time.perf_counter_ns() - self.start)
+        return False
+
+
+class StageProfiler:
+    """Accumulate wall time and call counts per unpack stage."""
+
+    def __init__(self):
+        self.nanoseconds: Dict[str, int] = defaultdict(int)
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    def add(self, name: str, nanoseconds: int) -> None:
+        self.nanoseconds[name] += nanoseconds
+        self.calls[name] += 1
+
+    def stage(self, name: str) -> _Stage:
+        """Time a block of code as the given stage."""
+        return _Stage(self, name)
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterator:
+        """Yield from an iterable, timing each next() call as the given stage."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter_ns()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                self.nanoseconds[name] += time.perf_counter_ns() - start
+                return
+            self.add(name, time.perf_counter_ns() - start)
+            yield value
+
+    def to_dict(self) -> Dict[str, Dict]:
+        return {
+            name: {
+                "seconds": self.nanoseconds[name] / 1e9,
+                "calls": self.calls[name],
+            }
+            for name in sorted(self.nanoseconds, key=_stage_order)
+        }
+
+
+class NullProfiler:
+    """Profiler stand-in used when profiling is off, every call is a no-op."""
+
+    @contextmanager
+    def _noop(self):
+        yield
+
+    def add(self, name: str, nanoseconds: int) -> None:
+        pass
+
+    def stage(self, name: str):
+        return self._noop()
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterable:
+        return iterable
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def _stage_order(name: str) -> int:
+    return STAGES.index(name) if name in STAGES else len(STAGES)
+
+
+class UnpackProfile:
+    """Stage timings for a whole unpack run, with optional cProfile and tracemalloc.
+
+    Args:
+        cprofile_path (str): Write cProfile stats to this path if given.
+        trace_memory (bool): Record a tracemalloc snapshot of the top allocations.
+    """
+
+    def __init__(self, cprofile_path: Optional[str] = None, trace_memory: bool = False):
+        self.cprofile_path = cprofile_path
+        self.trace_memory = trace_memory
+        self.files: List[Dict] = []
+        self.total = StageProfiler()
+        self.profile = cProfile.Profile() if cprofile_path else None
+        self.memory_top: List[Dict] = []
+        self.peak_memory = 0
+
+    def start(self) -> None:
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profile:
+            self.profile.enable()
+
+    def stop(self) -> None:
+        if self.profile:
+            self.profile.disable()
+            self.profile.dump_stats(self.cprofile_path)
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, self.peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.memory_top = [
+                {
+                    "location": str(stat.traceback),
+                    "size": stat.size,
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[:20]
+            ]
+
+    @contextmanager
+    def file(self, filepath: str):
+        """Profile the processing of one file, yields the StageProfiler to pass on."""
+        profiler = StageProfiler()
+        start = time.perf_counter()
+        try:
+            yield profiler
+        finally:
+            elapsed = time.perf_counter() - start
+            for name, nanoseconds in profiler.nanoseconds.items():
+                self.total.nanoseconds[name] += nanoseconds
+                self.total.calls[name] += profiler.calls[name]
+            self.files.append(
+                {
+                    "file": filepath,
+                    "size_bytes": os.path.getsize(filepath),
+                    "seconds": elapsed,
+                    "stages": profiler.to_dict(),
+                }
+            )
+
+    def summary_lines(self) -> List[str]:
+        """Human readable per-file and aggregate stage breakdown."""
+        lines = []
+        for entry in self.files + [self._aggregate()]:
+            lines.append(f"{entry['file']} - {entry['seconds']:.3f}s")
+            for name, stage in entry["stages"].items():
+                share = (
+                    stage["seconds"] / entry["seconds"] * 100 if entry["seconds"] else 0
+                )
+                lines.append(
+                    f"  {name:<15} {stage['seconds']:9.3f}s {share:5.1f}% ({stage['calls']} calls)"
+                )
+        if self.trace_memory:
+            lines.append(
+                f"Peak traced memory: {self.peak_memory / (1024 * 1024):.2f} MB"
+            )
+        if self.cprofile_path:
+            lines.append(f"cProfile stats written to {self.cprofile_path}")
+        return lines
+
+    def _aggregate(self) -> Dict:
+        return {
+            "file": "TOTAL",
+            "seconds": sum(entry["seconds"] for entry in self.files),
+            "stages": self.total.to_dict(),
+        }
+
+    def write(self, report_path: str) -> None:
+        """Write the machine readable report as JSON."""
+        report = {
+            "files": self.files,
+            "aggregate": self._aggregate(),
+            "cprofile": self.cprofile_path,
+            "peak_memory_bytes": self.peak_memory if self.trace_memory else None,
+            "memory_top": self.memory_top,
+        }
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,556 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+from novel_package_v2 import Chapter, chapter_from_record
+from novel_store import (
+    decode_metadata,
+    is_header,
+    open_binary,
+    read_records,
+)
+from typer_func import find_jsonl_files
+
+# Seconds between scans of the storage directory for new novel files
+RESCAN_SECONDS = 5.0
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+
+class LRUCache:
+    """Least recently used cache of byte strings, bounded by their total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Tuple, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self) -> Dict:
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+        }
+
+
+@dataclass
+class StoredNovel:
+    """Chapter list and offsets of one novel file, valid while the file is unchanged."""
+
+    path: str
+    site: str
+    novel_code: str
+    stamp: Tuple[int, int, int]
+    novel_title: str = ""
+    novel_description: str = ""
+    chapter_total: int = 0
+    # chapter_number -> (offset, length) of its line
+    offsets: Dict[int, Tuple[int, int]] = field(default_factory=dict)
+    # (chapter_number, chapter_title, volume_title) in chapter order
+    chapters: List[Tuple[int, str, str]] = field(default_factory=list)
+
+    def volumes(self) -> List[Dict]:
+        """Volumes in chapter order, chapters before the first heading form one too."""
+        volumes: List[Dict] = []
+        for number, _, volume_title in self.chapters:
+            if volume_title or not volumes:
+                volumes.append(
+                    {
+                        "volume": len(volumes) + 1,
+                        "title": volume_title,
+                        "first": number,
+                        "last": number,
+                    }
+                )
+            volumes[-1]["last"] = number
+        return volumes
+
+    def summary(self) -> Dict:
+        return {
+            "site": self.site,
+            "novel_code": self.novel_code,
+            "novel_title": self.novel_title,
+            "chapters": len(self.chapters),
+            "chapter_total": self.chapter_total or len(self.chapters),
+        }
+
+
+def _file_stamp(path: str) -> Tuple[int, int, int]:
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def load_novel(path: str) -> StoredNovel:
+    """Read the chapter metadata and line offsets of a file.
+
+    The offsets are collected in memory, the chapter index next to the file
+    belongs to the crawl that appends to it. A last line without a newline
+    is still being written and left out.
+    """
+    novel = StoredNovel(
+        path=path,
+        site=os.path.basename(os.path.dirname(path)),
+        novel_code=os.path.basename(path).split(".")[0].lower(),
+        stamp=_file_stamp(path),
+    )
+    offset = 0
+    with open_binary(path) as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            line_offset = offset
+            offset += len(line)
+            if not line.strip():
+                continue
+            record = decode_metadata(line)
+            if record.get("chapter_number") is not None:
+                novel.offsets[int(record["chapter_number"])] = (line_offset, len(line))
+            novel.novel_title = novel.novel_title or record.get("novel_title", "")
+            novel.novel_description = novel.novel_description or record.get(
+                "novel_description", ""
+            )
+            total = str(record.get("chapter_start_end") or "").partition("/")[2]
+            if total.isdigit():
+                novel.chapter_total = max(novel.chapter_total, int(total))
+            if is_header(record) or record.get("chapter_number") is None:
+                continue
+            novel.chapters.append(
+                (
+                    int(record["chapter_number"]),
+                    record.get("chapter_title") or "",
+                    record.get("volume_title") or "",
+                )
+            )
+    novel.chapters.sort(key=lambda chapter: chapter[0])
+    return novel
+
+
+class ChapterStore:
+    """Rendered chapters of the novels in a storage directory.
+
+    Chapters are rendered like the unpacked text files and kept in an LRU
+    cache. A novel file that changed on disk is loaded again, and the cache
+    keys hold the file stamp, so old renderings are never served.
+    """
+
+    def __init__(self, storage_directory: str, cache_bytes: int = 64 * 1024 * 1024):
+        self.storage_directory = storage_directory
+        self.cache = LRUCache(cache_bytes)
+        self.paths: Dict[str, str] = {}
+        self.novels: Dict[str, StoredNovel] = {}
+        self.scanned = 0.0
+
+    def scan(self, force: bool = False) -> None:
+        if not force and time.monotonic() - self.scanned < RESCAN_SECONDS:
+            return
+        self.paths = {}
+        for path in sorted(find_jsonl_files(self.storage_directory)):
+            self.paths.setdefault(os.path.basename(path).split(".")[0].lower(), path)
+        self.scanned = time.monotonic()
+
+    def novel(self, novel_code: str) -> Optional[StoredNovel]:
+        """The novel with a code, loaded again if its file changed. Blocking."""
+        self.scan()
+        path = self.paths.get(novel_code.lower())
+        if path is None:
+            self.scan(force=True)
+            path = self.paths.get(novel_code.lower())
+        if path is None:
+            return None
+        try:
+            stamp = _file_stamp(path)
+        except FileNotFoundError:
+            return None
+        novel = self.novels.get(novel_code.lower())
+        if novel is None or novel.stamp != stamp:
+            novel = load_novel(path)
+            self.novels[novel_code.lower()] = novel
+        return novel
+
+    def all_novels(self) -> List[StoredNovel]:
+        self.scan()
+        return [
+            novel
+            for novel in (self.novel(novel_code) for novel_code in sorted(self.paths))
+            if novel is not None
+        ]
+
+    def _chapter_key(self, novel: StoredNovel, number: int) -> Tuple:
+        return ("chapter", novel.path, novel.stamp, number)
+
+    def cached_chapters(
+        self, novel: StoredNovel, numbers: List[int]
+    ) -> Tuple[Dict[int, bytes], List[int]]:
+        """Rendered chapters found in the cache, and the numbers that are not."""
+        found = {}
+        missing = []
+        for number in numbers:
+            rendered = self.cache.get(self._chapter_key(novel, number))
+            if rendered is None:
+                missing.append(number)
+            else:
+                found[number] = rendered
+        return found, missing
+
+    def load_chapters(self, novel: StoredNovel, numbers: List[int]) -> Dict[int, bytes]:
+        """Read and render chapters through their offsets. Blocking."""
+        spans = {number: novel.offsets[number] for number in numbers}
+        records = read_records(novel.path, list(spans.values()))
+        return {
+            number: chapter_from_record(records[offset])
+            .formatted_content()
+            .encode("utf-8")
+            for number, (offset, _) in spans.items()
+        }
+
+    def remember(self, novel: StoredNovel, rendered: Dict[int, bytes]) -> None:
+        for number, body in rendered.items():
+            self.cache.put(self._chapter_key(novel, number), body)
+
+    def chunk_header(self, novel: StoredNovel, start: int, end: int) -> bytes:
+        """The first line of an unpacked text file for a chapter range."""
+        if start == 1:
+            return (
+                f"{start}-{end} {novel.novel_title}\n{novel.novel_description}\n"
+            ).encode("utf-8")
+        return f"{start}-{end} ".encode("utf-8")
+
+
+def parse_range(header: str, length: int) -> Optional[Tuple[int, int]]:
+    """First and last byte of a single 'bytes=' range, None if not satisfiable.
+
+    Raises ValueError for ranges this server does not handle, like several
+    ranges at once, the full body is sent for those.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise ValueError(header)
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        if not last.isdigit() or int(last) == 0:
+            return None
+        return (max(0, length - int(last)), length - 1)
+    if not first.isdigit() or (last and not last.isdigit()):
+        raise ValueError(header)
+    start = int(first)
+    end = min(int(last), length - 1) if last else length - 1
+    if start >= length or end < start:
+        return None
+    return (start, end)
+
+
+@dataclass
+class Response:
+    status: int
+    body: bytes = b""
+    content_type: str = "application/json"
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+REASONS = {
+    200: "OK",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    416: "Range Not Satisfiable",
+    500: "Internal Server Error",
+}
+
+
+def json_response(status: int, data) -> Response:
+    return Response(status, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+class ReadingServer:
+    """HTTP/1.1 server for reading novels straight from the .jl files.
+
+    GET /novels                       novel list (JSON)
+    GET /novels/<ncode>               chapters and volumes (JSON)
+    GET /novels/<ncode>/chapters/<n>  one chapter as text
+    GET /novels/<ncode>/chapters/<a>-<b>  a chapter range, like an unpacked file
+    GET /novels/<ncode>/volumes/<v>   the chapters of a volume
+    GET /stats                        cache and request counters (JSON)
+
+    Text responses carry an ETag from the file stamp, so a repeated request
+    is answered with 304 before anything is rendered. They are gzip encoded
+    for clients that accept it, and single byte ranges are served with 206.
+    Connections are kept alive between requests.
+    """
+
+    def __init__(self, store: ChapterStore):
+        self.store = store
+        self.requests = 0
+        self.statuses: Dict[int, int] = {}
+        self.started = time.time()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if headers.get("content-length", "0").isdigit():
+                    # Bodies are not used, but have to be read past
+                    await reader.readexactly(int(headers.get("content-length", "0")))
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    writer.write(
+                        self.encode(
+                            json_response(400, {"error": "bad request"}), "GET", False
+                        )
+                    )
+                    break
+                method, target, version = parts
+                connection = headers.get("connection", "").lower()
+                keep_alive = (
+                    connection != "close"
+                    if version == "HTTP/1.1"
+                    else connection == "keep-alive"
+                )
+                try:
+                    response = await self.respond(method, target, headers)
+                except Exception as error:
+                    response = json_response(500, {"error": str(error)})
+                self.requests += 1
+                self.statuses[response.status] = (
+                    self.statuses.get(response.status, 0) + 1
+                )
+                writer.write(self.encode(response, method, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # ValueError is a header line over the stream limit
+            pass
+        finally:
+            writer.close()
+
+    def encode(self, response: Response, method: str, keep_alive: bool) -> bytes:
+        headers = {
+            "Content-Type": response.content_type,
+            "Content-Length": str(len(response.body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **response.headers,
+        }
+        head = f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        body = b"" if method == "HEAD" or response.status == 304 else response.body
+        return head.encode("latin-1") + b"\r\n" + body
+
+    async def respond(
+        self, method: str, target: str, headers: Dict[str, str]
+    ) -> Response:
+        if method not in ("GET", "HEAD"):
+            return Response(405, b"", headers={"Allow": "GET, HEAD"})
+        parts = [unquote(part) for part in urlsplit(target).path.split("/") if part]
+        if parts in ([], ["novels"]):
+            novels = await asyncio.to_thread(self.store.all_novels)
+            return json_response(200, [novel.summary() for novel in novels])
+        if parts == ["stats"]:
+            return json_response(
+                200,
+                {
+                    "requests": self.requests,
+                    "statuses": self.statuses,
+                    "uptime_seconds": time.time() - self.started,
+                    "cache": self.store.cache.stats(),
+                },
+            )
+        if parts[0] != "novels" or len(parts) not in (2, 4):
+            return json_response(404, {"error": "not found"})
+
+        # Checking the file stamp is a stat call, kept off the event loop
+        novel = await asyncio.to_thread(self.store.novel, parts[1])
+        if novel is None:
+            return json_response(404, {"error": f"unknown novel {parts[1]}"})
+        if len(parts) == 2:
+            return json_response(
+                200,
+                {
+                    **novel.summary(),
+                    "novel_description": novel.novel_description,
+                    "volumes": novel.volumes(),
+                    "chapter_list": [
+                        {"chapter_number": number, "chapter_title": title}
+                        for number, title, _ in novel.chapters
+                    ],
+                },
+            )
+
+        numbers = self.select_chapters(novel, parts[2], parts[3])
+        if numbers is None:
+            return json_response(404, {"error": f"no such {parts[2]} {parts[3]}"})
+        etag = '"{}"'.format(
+            hashlib.blake2s(
+                repr((novel.path, novel.stamp, parts[2], parts[3])).encode(),
+                digest_size=12,
+            ).hexdigest()
+        )
+        use_gzip = (
+            "gzip" in headers.get("accept-encoding", "") and "range" not in headers
+        )
+        response_etag = f'{etag[:-1]}-gzip"' if use_gzip else etag
+        common = {
+            "ETag": response_etag,
+            "Vary": "Accept-Encoding",
+            "Accept-Ranges": "bytes",
+            "Cache-Control": "no-cache",
+        }
+        if_none_match = headers.get("if-none-match", "")
+        if if_none_match == "*" or any(
+            tag.strip().removeprefix("W/") in (etag, response_etag)
+            for tag in if_none_match.split(",")
+        ):
+            return Response(304, headers=common)
+
+        body = await self.render(
+            novel, numbers, parts[2] != "chapters" or "-" in parts[3]
+        )
+        content_type = "text/plain; charset=utf-8"
+        if use_gzip and len(body) >= GZIP_MIN_BYTES:
+            key = ("gzip", novel.path, novel.stamp, parts[2], parts[3])
+            compressed = self.store.cache.get(key)
+            if compressed is None:
+                compressed = await asyncio.to_thread(gzip.compress, body, GZIP_LEVEL)
+                self.store.cache.put(key, compressed)
+            return Response(
+                200, compressed, content_type, {**common, "Content-Encoding": "gzip"}
+            )
+        common["ETag"] = etag
+        range_header = headers.get("range")
+        if range_header and headers.get("if-range", etag) == etag:
+            try:
+                span = parse_range(range_header, len(body))
+            except ValueError:
+                return Response(200, body, content_type, common)
+            if span is None:
+                return Response(
+                    416,
+                    b"",
+                    content_type,
+                    {**common, "Content-Range": f"bytes */{len(body)}"},
+                )
+            start, end = span
+            return Response(
+                206,
+                body[start : end + 1],
+                content_type,
+                {**common, "Content-Range": f"bytes {start}-{end}/{len(body)}"},
+            )
+        return Response(200, body, content_type, common)
+
+    def select_chapters(
+        self, novel: StoredNovel, kind: str, value: str
+    ) -> Optional[List[int]]:
+        """Chapter numbers a chapters or volumes path asks for, None if there are none."""
+        if kind == "volumes":
+            volumes = novel.volumes()
+            if not value.isdigit() or not 1 <= int(value) <= len(volumes):
+                return None
+            volume = volumes[int(value) - 1]
+            first, last = volume["first"], volume["last"]
+        elif kind == "chapters":
+            first, _, last = value.partition("-")
+            if not first.isdigit() or not (last or first).isdigit():
+                return None
+            first, last = int(first), int(last or first)
+        else:
+            return None
+        # The stored chapters bound the work, not the range a client asks for
+        numbers = sorted(number for number in novel.offsets if first <= number <= last)
+        return numbers or None
+
+    async def render(
+        self, novel: StoredNovel, numbers: List[int], chunk: bool
+    ) -> bytes:
+        """Chapters as text, with the header of an unpacked file for ranges.
+
+        Ranges leave out skipped chapters like unpack does.
+        """
+        if chunk:
+            titles = {number: title for number, title, _ in novel.chapters}
+            numbers = [
+                number
+                for number in numbers
+                if not Chapter(number, titles.get(number, "")).is_skipped
+            ] or numbers
+        rendered, missing = self.store.cached_chapters(novel, numbers)
+        if missing:
+            loaded = await asyncio.to_thread(self.store.load_chapters, novel, missing)
+            # The cache is only touched from the event loop
+            self.store.remember(novel, loaded)
+            rendered.update(loaded)
+        body = b"".join(rendered[number] for number in numbers)
+        if chunk:
+            body = self.store.chunk_header(novel, numbers[0], numbers[-1]) + body
+        return body
+
+
+async def serve(
+    storage_directory: str,
+    host: str = "127.0.0.1",
+    port: int = 8900,
+    cache_bytes: int = 64 * 1024 * 1024,
+) -> None:
+    """Serve a storage directory until cancelled."""
+    server = ReadingServer(ChapterStore(storage_directory, cache_bytes))
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+    async with listener:
+        await listener.serve_forever()
+
+
+def run_server(
+    storage_directory: str,
+    host: str = "127.0.0.1",
+    port: int = 8900,
+    cache_bytes: int = 64 * 1024 * 1024,
+) -> None:
+    try:
+        asyncio.run(serve(storage_directory, host, port, cache_bytes))
+    except KeyboardInterrupt:
+        pass
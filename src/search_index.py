@@ -0,0 +1,460 @@
+import os
+import re
+import json
+import math
+import zlib
+import sqlite3
+import unicodedata
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from novel_store import HEADER_RECORD_TYPE, open_binary, read_records
+
+SEARCH_INDEX_FILENAME = "search_index.sqlite3"
+# Record fields that are searched, in the order they are joined for snippets
+TEXT_FIELDS = ["chapter_title", "chapter_foreword", "chapter_text", "chapter_afterword"]
+# Runs of letters and digits, punctuation and spaces end a run
+WORD_RUN = re.compile(r"[^\W_]+")
+# A file with more update batches than this is indexed again in one batch
+MAX_BATCHES = 16
+# Candidates whose text is read together to check the phrases
+VERIFY_BATCH = 32
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def normalize(text: str) -> str:
+    """Fold half and full width forms and case, so ｱ matches ア and Ａ matches a."""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def text_terms(text: str) -> Counter:
+    """Count the character unigrams and bigrams of every word run of a text.
+
+    Japanese has no spaces between words, so overlapping bigrams stand in for
+    words. Unigrams are kept for one character queries.
+    """
+    counts: Counter = Counter()
+    for run in WORD_RUN.findall(normalize(text)):
+        counts.update(run)
+        counts.update(map(str.__add__, run, run[1:]))
+    return counts
+
+
+def query_terms(phrase: str) -> Set[str]:
+    """Terms a chapter needs to contain a phrase, bigrams or a lone unigram."""
+    terms = set()
+    for run in WORD_RUN.findall(normalize(phrase)):
+        terms.update(map(str.__add__, run, run[1:]) if len(run) > 1 else run)
+    return terms
+
+
+def record_text(record: Dict) -> str:
+    return "\n".join(record[field] for field in TEXT_FIELDS if record.get(field))
+
+
+def index_file(task: Tuple[str, int]) -> Dict:
+    """Read the chapters of a .jl file from an offset and count their terms.
+
+    Runs in a worker process. Offsets are into the uncompressed stream like
+    the ChapterIndex ones, and reading stops before a line that is not
+    complete yet, so the next update starts there.
+
+    Returns:
+        dict: New offset, novel title, chapter rows and packed postings, an
+            array of chapter_number, term count pairs per term.
+    """
+    filepath, offset = task
+    novel_title = ""
+    chapters = []
+    postings: Dict[str, array] = {}
+    with open_binary(filepath) as f:
+        # Seeking a gzip stream decompresses up to the offset
+        f.seek(offset)
+        try:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                line_offset = offset
+                offset += len(line)
+                if line.isspace():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict):
+                    continue
+                novel_title = record.get("novel_title") or novel_title
+                if (
+                    record.get("record_type") == HEADER_RECORD_TYPE
+                    or record.get("chapter_number") is None
+                ):
+                    continue
+                number = int(record["chapter_number"])
+                terms = text_terms(record_text(record))
+                for term, count in terms.items():
+                    postings.setdefault(term, array("I")).extend((number, count))
+                chapters.append(
+                    (
+                        number,
+                        record.get("chapter_title") or "",
+                        line_offset,
+                        len(line),
+                        sum(terms.values()),
+                    )
+                )
+        except (EOFError, zlib.error):
+            # The crawler is still writing the last gzip block
+            pass
+    return {
+        "path": filepath,
+        "offset": offset,
+        "novel_title": novel_title,
+        "chapters": chapters,
+        "postings": {term: values.tobytes() for term, values in postings.items()},
+    }
+
+
+def snippet(text: str, phrases: List[str], width: int = 40) -> Tuple[str, str, str]:
+    """Context around the first phrase found in a text, as (before, match, after)."""
+    for phrase in phrases:
+        start = text.find(phrase)
+        if start == -1:
+            # Matched after folding width or case, show the folded text
+            text = normalize(text)
+            start = text.find(normalize(phrase))
+        if start != -1:
+            end = start + len(phrase)
+            before = text[max(0, start - width) : start]
+            after = text[end : end + width]
+            return (
+                before.replace("\n", " ").lstrip(),
+                text[start:end],
+                after.replace("\n", " ").rstrip(),
+            )
+    return (text[: width * 2].replace("\n", " "), "", "")
+
+
+class SearchIndex:
+    """Inverted index of the chapters of a storage directory, in SQLite.
+
+    Postings are stored per term and file update batch as packed
+    chapter_number, term count pairs, so an update only adds rows for the
+    chapters appended since the last one. A chapter stored again in a later
+    batch, like a re-crawled one, is listed in the stale table and its older
+    postings are ignored. Files that were replaced, by migrate or splice for
+    example, are indexed again from the start.
+    """
+
+    def __init__(self, storage_directory: str):
+        self.storage_directory = storage_directory
+        self.path = os.path.join(storage_directory, SEARCH_INDEX_FILENAME)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE,
+                novel_code TEXT,
+                novel_title TEXT,
+                identity TEXT,
+                size INTEGER,
+                offset INTEGER DEFAULT 0,
+                batches INTEGER DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS chapters (
+                file_id INTEGER,
+                chapter_number INTEGER,
+                chapter_title TEXT,
+                offset INTEGER,
+                length INTEGER,
+                terms INTEGER,
+                batch INTEGER,
+                PRIMARY KEY (file_id, chapter_number)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT,
+                file_id INTEGER,
+                batch INTEGER,
+                data BLOB,
+                PRIMARY KEY (term, file_id, batch)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_file ON postings (file_id);
+            CREATE TABLE IF NOT EXISTS stale (
+                file_id INTEGER,
+                batch INTEGER,
+                chapter_number INTEGER
+            );
+            """)
+
+    def _forget(self, file_id: int) -> None:
+        for table in ("postings", "chapters", "stale"):
+            self.connection.execute(
+                f"DELETE FROM {table} WHERE file_id = ?", (file_id,)
+            )
+
+    def update(
+        self,
+        jsonl_files: List[str],
+        workers: Optional[int] = None,
+        rebuild: bool = False,
+        progress: Callable[[str, int], None] = lambda path, chapters: None,
+    ) -> int:
+        """Index what was appended to the files since the last update.
+
+        Files are read in parallel, the results are written as they come in.
+
+        Returns:
+            int: Number of chapters indexed.
+        """
+        known = {
+            row[1]: row
+            for row in self.connection.execute(
+                "SELECT id, path, identity, size, offset, batches FROM files"
+            )
+        }
+        with self.connection:
+            for path in set(known) - set(jsonl_files):
+                self._forget(known[path][0])
+                self.connection.execute(
+                    "DELETE FROM files WHERE id = ?", (known[path][0],)
+                )
+
+        tasks = []
+        for path in sorted(jsonl_files):
+            stat = os.stat(path)
+            identity = f"{stat.st_dev}:{stat.st_ino}"
+            row = known.get(path)
+            if row is None:
+                self.connection.execute(
+                    "INSERT INTO files (path, novel_code, novel_title, identity) "
+                    "VALUES (?, ?, '', ?)",
+                    (path, os.path.basename(path).split(".")[0], identity),
+                )
+                self.connection.commit()
+                tasks.append((path, 0))
+                continue
+            file_id, _, old_identity, size, offset, batches = row
+            if (
+                rebuild
+                or identity != old_identity
+                or batches >= MAX_BATCHES
+                or (not path.endswith(".gz") and stat.st_size < offset)
+            ):
+                with self.connection:
+                    self._forget(file_id)
+                    self.connection.execute(
+                        "UPDATE files SET identity = ?, size = NULL, offset = 0, "
+                        "batches = 0 WHERE id = ?",
+                        (identity, file_id),
+                    )
+                tasks.append((path, 0))
+            elif stat.st_size != size:
+                tasks.append((path, offset))
+
+        indexed = 0
+        if workers == 1 or len(tasks) < 2:
+            for task in tasks:
+                indexed += self._store(index_file(task), progress)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(index_file, task) for task in tasks]
+                for future in as_completed(futures):
+                    indexed += self._store(future.result(), progress)
+        return indexed
+
+    def _store(self, result: Dict, progress: Callable[[str, int], None]) -> int:
+        path = result["path"]
+        file_id, batches = self.connection.execute(
+            "SELECT id, batches FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        batch = batches + 1
+        chapters = result["chapters"]
+        with self.connection:
+            if chapters:
+                current = dict(
+                    self.connection.execute(
+                        "SELECT chapter_number, batch FROM chapters WHERE file_id = ?",
+                        (file_id,),
+                    ).fetchall()
+                )
+                self.connection.executemany(
+                    "INSERT INTO stale (file_id, batch, chapter_number) VALUES (?, ?, ?)",
+                    [
+                        (file_id, current[chapter[0]], chapter[0])
+                        for chapter in chapters
+                        if chapter[0] in current
+                    ],
+                )
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO chapters (file_id, chapter_number, "
+                    "chapter_title, offset, length, terms, batch) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(file_id, *chapter, batch) for chapter in chapters],
+                )
+                self.connection.executemany(
+                    "INSERT INTO postings (term, file_id, batch, data) VALUES (?, ?, ?, ?)",
+                    [
+                        (term, file_id, batch, data)
+                        for term, data in result["postings"].items()
+                    ],
+                )
+            self.connection.execute(
+                "UPDATE files SET novel_title = CASE WHEN ? != '' THEN ? "
+                "ELSE novel_title END, size = ?, offset = ?, batches = ? WHERE id = ?",
+                (
+                    result["novel_title"],
+                    result["novel_title"],
+                    os.path.getsize(path),
+                    result["offset"],
+                    batch if chapters else batches,
+                    file_id,
+                ),
+            )
+        progress(path, len(chapters))
+        return len(chapters)
+
+    def _postings(
+        self,
+        term: str,
+        file_ids: Optional[Set[int]],
+        stale: Dict[Tuple[int, int], Set[int]],
+    ) -> Dict[Tuple[int, int], int]:
+        """Term counts of the chapters containing a term, by (file_id, chapter_number)."""
+        counts = {}
+        for file_id, batch, data in self.connection.execute(
+            "SELECT file_id, batch, data FROM postings WHERE term = ? "
+            "ORDER BY file_id, batch",
+            (term,),
+        ):
+            if file_ids is not None and file_id not in file_ids:
+                continue
+            values = array("I")
+            values.frombytes(data)
+            replaced = stale.get((file_id, batch), ())
+            for position in range(0, len(values), 2):
+                number = values[position]
+                if number not in replaced:
+                    counts[(file_id, number)] = values[position + 1]
+        return counts
+
+    def search(self, query: str, limit: int = 10, novel_code: str = "") -> List[Dict]:
+        """Find the chapters containing every phrase of a query, best BM25 score first.
+
+        Phrases are separated by spaces. Candidates come from the postings of
+        the phrase bigrams, and the phrases are checked in the chapter text,
+        read through the chapter offsets, only until limit hits are found.
+
+        Returns:
+            list: Hits with novel, chapter, score and a snippet.
+        """
+        phrases = query.split()
+        terms = set().union(*(query_terms(phrase) for phrase in phrases))
+        if not terms:
+            return []
+        files = {
+            row[0]: row
+            for row in self.connection.execute(
+                "SELECT id, path, novel_code, novel_title FROM files"
+            )
+        }
+        file_ids = (
+            {
+                file_id
+                for file_id, row in files.items()
+                if row[2].lower() == novel_code.lower()
+            }
+            if novel_code
+            else None
+        )
+        stale: Dict[Tuple[int, int], Set[int]] = {}
+        for file_id, batch, number in self.connection.execute(
+            "SELECT file_id, batch, chapter_number FROM stale"
+        ):
+            stale.setdefault((file_id, batch), set()).add(number)
+
+        # Rarest terms first, the candidate set only shrinks from there
+        term_counts = sorted(
+            (self._postings(term, file_ids, stale) for term in terms), key=len
+        )
+        candidates = set(term_counts[0])
+        for counts in term_counts[1:]:
+            candidates.intersection_update(counts)
+            if not candidates:
+                return []
+
+        chapter_count, average_terms = self.connection.execute(
+            "SELECT COUNT(*), AVG(terms) FROM chapters"
+        ).fetchone()
+        chapter_rows = {}
+        for file_id, number, title, offset, length, chapter_terms in (
+            self.connection.execute(
+                "SELECT file_id, chapter_number, chapter_title, offset, length, terms "
+                "FROM chapters WHERE file_id = ? AND chapter_number = ?",
+                key,
+            ).fetchone()
+            for key in candidates
+        ):
+            chapter_rows[(file_id, number)] = (title, offset, length, chapter_terms)
+
+        scores = {}
+        for key in candidates:
+            norm = K1 * (1 - B + B * chapter_rows[key][3] / (average_terms or 1))
+            score = 0.0
+            for counts in term_counts:
+                idf = math.log(
+                    1 + (chapter_count - len(counts) + 0.5) / (len(counts) + 0.5)
+                )
+                count = counts[key]
+                score += idf * count * (K1 + 1) / (count + norm)
+            scores[key] = score
+
+        hits = []
+        ranked = sorted(candidates, key=lambda key: (-scores[key], key))
+        batch_size = max(limit, VERIFY_BATCH)
+        for start in range(0, len(ranked), batch_size):
+            batch = ranked[start : start + batch_size]
+            spans: Dict[int, List[Tuple[int, int]]] = {}
+            for file_id, number in batch:
+                spans.setdefault(file_id, []).append(
+                    chapter_rows[(file_id, number)][1:3]
+                )
+            records = {
+                file_id: read_records(files[file_id][1], file_spans)
+                for file_id, file_spans in spans.items()
+            }
+            for key in batch:
+                file_id, number = key
+                title, offset, _, _ = chapter_rows[key]
+                text = record_text(records[file_id][offset])
+                folded = normalize(text)
+                # Bigrams in the chapter do not mean the phrase is
+                if not all(normalize(phrase) in folded for phrase in phrases):
+                    continue
+                hits.append(
+                    {
+                        "novel_code": files[file_id][2],
+                        "novel_title": files[file_id][3],
+                        "chapter_number": number,
+                        "chapter_title": title,
+                        "score": scores[key],
+                        "path": files[file_id][1],
+                        "snippet": snippet(text, phrases),
+                    }
+                )
+                if len(hits) >= limit:
+                    return hits
+        return hits
+
+    def counts(self) -> Tuple[int, int]:
+        """Number of indexed files and chapters."""
+        return (
+            self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+            self.connection.execute("SELECT COUNT(*) FROM chapters").fetchone()[0],
+        )
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import gzip
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from novel_store import ChapterIndex, open_jl
+
+API_BASE_URL = "https://api.syosetu.com"
+# API path per site, Nocturne novels are only listed by the R18 API
+API_PATHS = {"syosetu": "/novelapi/api/", "nocturne": "/novel18api/api/"}
+NOVEL_URLS = {
+    "syosetu": "https://ncode.syosetu.com/{ncode}/",
+    "nocturne": "https://novel18.syosetu.com/{ncode}/",
+}
+# Output fields: title, ncode, general_all_no, novelupdated_at, general_firstup,
+# general_lastup
+API_FIELDS = "t-n-ga-nu-gf-gl"
+NCODE_PATTERN = re.compile(r"^n\d{4}[a-z]{1,3}$")
+
+
+@dataclass
+class RemoteNovel:
+    """Novel metadata as returned by the Syosetu API."""
+
+    ncode: str
+    title: str = ""
+    general_all_no: int = 0
+    novelupdated_at: str = ""
+    general_firstup: str = ""
+    general_lastup: str = ""
+
+
+@dataclass
+class LocalNovel:
+    """Chapters of a novel found in the local storage directory."""
+
+    ncode: str
+    site: str
+    filepath: str
+    chapters: List[int] = field(default_factory=list)
+
+    @property
+    def last_chapter(self) -> int:
+        return self.chapters[-1] if self.chapters else 0
+
+
+class SyosetuApiClient:
+    """Fetch novel metadata for many ncodes at once through the Syosetu API.
+
+    Args:
+        site (str): "syosetu" for the novel API or "nocturne" for the R18 API.
+        base_url (str): API host, a local stand-in server can be used for testing.
+        batch_size (int): Ncodes per request, the API returns at most 500 rows.
+        pause (float): Seconds to wait between requests to go easy on the API.
+    """
+
+    def __init__(
+        self,
+        site: str = "syosetu",
+        base_url: str = API_BASE_URL,
+        batch_size: int = 100,
+        pause: float = 1.0,
+        timeout: float = 30.0,
+    ):
+        self.url = base_url.rstrip("/") + API_PATHS[site]
+        self.batch_size = min(batch_size, 500)
+        self.pause = pause
+        self.timeout = timeout
+        self.requests = 0
+
+    def _request(self, ncodes: List[str]) -> List[Dict]:
+        query = urlencode(
+            {
+                "out": "json",
+                "gzip": 5,
+                "of": API_FIELDS,
+                "lim": len(ncodes),
+                "ncode": "-".join(ncodes),
+            }
+        )
+        request = Request(
+            f"{self.url}?{query}", headers={"User-Agent": "webnovel-unpacker"}
+        )
+        with urlopen(request, timeout=self.timeout) as response:
+            body = response.read()
+        self.requests += 1
+        # gzip=N compresses the body itself, not through Content-Encoding
+        if body[:2] == b"\x1f\x8b":
+            body = gzip.decompress(body)
+        # The first row only holds the allcount of the query
+        return json.loads(body)[1:]
+
+    def fetch(self, ncodes: Iterable[str]) -> Dict[str, RemoteNovel]:
+        """Return metadata keyed by lower case ncode, unknown ncodes are left out."""
+        ncodes = sorted({ncode.lower() for ncode in ncodes})
+        novels: Dict[str, RemoteNovel] = {}
+        for start in range(0, len(ncodes), self.batch_size):
+            if start and self.pause:
+                time.sleep(self.pause)
+            for row in self._request(ncodes[start : start + self.batch_size]):
+                ncode = row["ncode"].lower()
+                novels[ncode] = RemoteNovel(
+                    ncode=ncode,
+                    title=row.get("title", ""),
+                    general_all_no=int(row.get("general_all_no") or 0),
+                    novelupdated_at=row.get("novelupdated_at", ""),
+                    general_firstup=row.get("general_firstup", ""),
+                    general_lastup=row.get("general_lastup", ""),
+                )
+        return novels
+
+
+def site_of(path: str) -> str:
+    """Site of a stored file or a novel URL.
+
+    Nocturne novels are stored by nocturne_spider and served from
+    novel18.syosetu.com.
+    """
+    return "nocturne" if "nocturne" in path or "novel18." in path else "syosetu"
+
+
+def _ncode_of(filepath: str) -> Optional[str]:
+    """Novel code from the file name, or the novel_code of the first record."""
+    name = os.path.basename(filepath).split(".")[0].lower()
+    if NCODE_PATTERN.match(name):
+        return name
+    with open_jl(filepath) as f:
+        for line in f:
+            if line.strip():
+                return json.loads(line).get("novel_code")
+    return None
+
+
+def find_local_novels(jsonl_files: List[str]) -> List[LocalNovel]:
+    """Collect the stored chapter numbers of every .jl file with a known ncode.
+
+    Chapter numbers come from the sidecar chapter index, so only files without
+    an up to date index are read. Nothing is written to the storage directory.
+    """
+    novels = []
+    for filepath in jsonl_files:
+        ncode = _ncode_of(filepath)
+        if not ncode:
+            continue
+        novels.append(
+            LocalNovel(
+                ncode=ncode,
+                site=site_of(filepath),
+                filepath=filepath,
+                chapters=ChapterIndex.load(filepath, write=False).chapter_numbers(),
+            )
+        )
+    return novels
+
+
+def compare_library(
+    local_novels: List[LocalNovel],
+    base_url: str = API_BASE_URL,
+    batch_size: int = 100,
+    pause: float = 1.0,
+) -> List[Dict]:
+    """Compare local novels with the API and report what needs to be crawled.
+
+    Returns:
+        list: One dict per novel with status "new_chapters", "up_to_date" or
+            "not_found", and the chapter to start the next crawl at.
+    """
+    report = []
+    for site in API_PATHS:
+        site_novels = [novel for novel in local_novels if novel.site == site]
+        if not site_novels:
+            continue
+        client = SyosetuApiClient(
+            site, base_url=base_url, batch_size=batch_size, pause=pause
+        )
+        remote = client.fetch(novel.ncode for novel in site_novels)
+        for novel in site_novels:
+            entry = {
+                "ncode": novel.ncode,
+                "site": site,
+                "file": novel.filepath,
+                "local_chapters": novel.last_chapter,
+                "url": NOVEL_URLS[site].format(ncode=novel.ncode),
+            }
+            info = remote.get(novel.ncode)
+            if info is None:
+                entry["status"] = "not_found"
+            else:
+                entry.update(
+                    title=info.title,
+                    remote_chapters=info.general_all_no,
+                    general_lastup=info.general_lastup,
+                    novelupdated_at=info.novelupdated_at,
+                    status=(
+                        "new_chapters"
+                        if info.general_all_no > novel.last_chapter
+                        else "up_to_date"
+                    ),
+                    start_chapter=novel.last_chapter + 1,
+                )
+            report.append(entry)
+    return report
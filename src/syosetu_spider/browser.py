@@ -0,0 +1,118 @@
+import time
+import logging
+from typing import List
+
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+logger = logging.getLogger(__name__)
+
+# Resources the parser never reads, blocked by URL pattern in the light profile
+BLOCKED_RESOURCE_PATTERNS = [
+    f"*.{extension}*"
+    for extension in (
+        "png",
+        "jpg",
+        "jpeg",
+        "gif",
+        "webp",
+        "svg",
+        "ico",
+        "css",
+        "woff",
+        "woff2",
+        "ttf",
+        "otf",
+        "mp4",
+        "mp3",
+    )
+]
+# Third-party analytics and ad hosts embedded in the novel pages
+BLOCKED_HOST_PATTERNS = [
+    f"*{host}*"
+    for host in (
+        "googletagmanager.com",
+        "google-analytics.com",
+        "googlesyndication.com",
+        "googleadservices.com",
+        "doubleclick.net",
+        "adservice.google.",
+        "amazon-adsystem.com",
+        "yimg.jp",
+        "yahoo.co.jp",
+        "microad.jp",
+        "i-mobile.co.jp",
+        "fluct.jp",
+        "criteo.",
+    )
+]
+
+AGE_GATE = (By.ID, "yes18")
+
+
+def blocked_url_patterns(extra: List[str]) -> List[str]:
+    """Network.setBlockedURLs patterns of the light profile plus extra ones."""
+    return BLOCKED_RESOURCE_PATTERNS + BLOCKED_HOST_PATTERNS + list(extra)
+
+
+def build_chrome_driver(settings) -> webdriver.Chrome:
+    """Start headless Chrome with the NOCTURNE_BROWSER_PROFILE settings.
+
+    The light profile returns from page loads at DOMContentLoaded (eager) and
+    blocks images, stylesheets, fonts, media and third-party scripts through
+    the DevTools protocol. The full profile loads pages like a desktop browser.
+    """
+    profile = settings.get("NOCTURNE_BROWSER_PROFILE", "light")
+    if profile not in ("light", "full"):
+        raise ValueError(f"Unknown NOCTURNE_BROWSER_PROFILE: {profile}")
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    # options.add_argument("--log-level=3") #Levels: 0=INFO, 1=WARNING, 2=ERROR, 3=FATAL
+    # options.add_experimental_option("excludeSwitches", ["enable-logging"])
+    if profile == "light":
+        options.page_load_strategy = "eager"
+        # Also catches images without a file extension, e.g. tracking pixels
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_argument("--disable-extensions")
+    driver = webdriver.Chrome(options=options)
+    driver.set_page_load_timeout(settings.getfloat("NOCTURNE_BROWSER_TIMEOUT", 30))
+    if profile == "light":
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd(
+            "Network.setBlockedURLs",
+            {"urls": blocked_url_patterns(settings.getlist("NOCTURNE_BLOCKED_URLS"))},
+        )
+    logger.info(f"Chrome started with the {profile} browser profile")
+    return driver
+
+
+def load_page(driver, url: str, ready_selector: str, timeout: float) -> float:
+    """Open url past the age gate and wait until ready_selector is parsed.
+
+    Waits on the elements the parser needs instead of an implicit wait, so a
+    page that is already past the gate (over18 cookie set) costs no extra
+    time. Returns the seconds the load took, raises TimeoutException if
+    neither the gate nor the page content showed up within timeout.
+    """
+    start = time.perf_counter()
+    driver.get(url)
+    wait = WebDriverWait(driver, timeout)
+    ready = (By.CSS_SELECTOR, ready_selector)
+    element = wait.until(
+        EC.any_of(
+            EC.element_to_be_clickable(AGE_GATE), EC.presence_of_element_located(ready)
+        )
+    )
+    if element.get_attribute("id") == AGE_GATE[1]:
+        element.click()
+        wait.until(EC.presence_of_element_located(ready))
+    # An eager load can see the first elements while the rest is still parsed
+    wait.until(
+        lambda driver: driver.execute_script("return document.readyState") != "loading"
+    )
+    return time.perf_counter() - start
@@ -0,0 +1,243 @@
+import os
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from scrapy import signals
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+
+from novel_store import INDEX_SUFFIX, ChapterIndex
+
+
+def request_chapter(request) -> Tuple[Optional[str], Optional[int]]:
+    """Novel code and chapter number a request fetches, (None, None) for other pages.
+
+    Taken from meta["chapter_number"] or from chapter urls like '/n1313ff/74/'.
+    """
+    novel_code = request.meta.get("novel_code")
+    number = request.meta.get("chapter_number")
+    if number is not None:
+        return novel_code, int(number)
+    parts = [part for part in urlsplit(request.url).path.split("/") if part]
+    if len(parts) == 2 and parts[1].isdigit():
+        return novel_code or parts[0], int(parts[1])
+    return None, None
+
+
+class StoredChapters:
+    """Sorted chapter numbers in a novel's index, reloaded when the index changes.
+
+    Only the .idx sidecar is read, 4 bytes per chapter are kept in memory.
+    """
+
+    def __init__(self, filepath: str, check_index: bool = True):
+        self.filepath = filepath
+        self.index_path = f"{filepath}{INDEX_SUFFIX}"
+        self.numbers = array("I")
+        self.index_size = 0
+        self.index_mtime = 0
+        if check_index and os.path.exists(filepath):
+            # Files from before the index, or changed by hand, get a fresh one.
+            # Not once this crawl may have written to the file, a rebuild
+            # would read chapters the storage pipeline has half flushed.
+            ChapterIndex.load(filepath)
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Reload the chapter numbers if the storage pipelines changed the index."""
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            self.numbers = array("I")
+            self.index_size = self.index_mtime = 0
+            return
+        if stat.st_size == self.index_size and stat.st_mtime_ns == self.index_mtime:
+            return
+        # Read whole, an index can also be rebuilt, about 20 bytes per chapter
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        # A line still being written is read again next time
+        data = data[: data.rfind(b"\n") + 1]
+        self.numbers = array(
+            "I", sorted({int(line.split(b"\t", 1)[0]) for line in data.splitlines()})
+        )
+        self.index_size = len(data)
+        self.index_mtime = stat.st_mtime_ns
+
+    def __contains__(self, number: int) -> bool:
+        position = bisect_left(self.numbers, number)
+        return position < len(self.numbers) and self.numbers[position] == number
+
+    def next_missing(self, number: int) -> int:
+        """First chapter from number on that is not stored."""
+        position = bisect_left(self.numbers, number)
+        while position < len(self.numbers) and self.numbers[position] == number:
+            number += 1
+            position += 1
+        return number
+
+
+class StoredChapterDupeFilter(RFPDupeFilter):
+    """Drop requests for chapters that are already stored, across crawl runs.
+
+    Chapter requests are identified by novel code and chapter number, so the
+    HTML page and the text download of a chapter are the same request. A
+    chapter counts as seen when it is in the chapter index of the novel file
+    NovelStoragePipeline writes, which makes the stored files the persistent
+    seen set: nothing to keep in sync, and removing a file crawls it again.
+    Index updates by other processes are picked up, so overlapping crawls do
+    not fetch chapters the other one stored. Other requests, like the novel
+    main page, are filtered for the current run only.
+
+    The chapter sets of at most DUPEFILTER_OPEN_NOVELS novels are held in
+    memory. The chapters requested in this run are kept for every novel, a
+    closed novel still has requests in flight that are not stored yet. With
+    DUPEFILTER_REFETCH stored chapters are requested again.
+
+    A dropped stored chapter gets request.meta["next_missing_chapter"], the
+    spider continues from there (see SkipStoredChaptersMixin).
+    """
+
+    def __init__(
+        self,
+        path=None,
+        debug=False,
+        *,
+        fingerprinter=None,
+        storage_directory: str = "",
+        extension: str = ".jl",
+        refetch: bool = False,
+        open_novels: int = 64,
+    ):
+        super().__init__(path, debug, fingerprinter=fingerprinter)
+        self.storage_directory = storage_directory
+        self.extension = extension
+        self.refetch = refetch
+        self.open_novels = open_novels
+        self.novels: "OrderedDict[str, StoredChapters]" = OrderedDict()
+        # Chapters requested in this run by novel code, stored or not yet
+        self.requested: Dict[str, Set[int]] = {}
+        # Novels whose index was checked, they are only reopened after that
+        self.checked = set()
+        self.crawler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        dupefilter = cls(
+            job_dir(settings),
+            settings.getbool("DUPEFILTER_DEBUG"),
+            fingerprinter=crawler.request_fingerprinter,
+            storage_directory=os.path.expanduser(
+                settings.get("NOVEL_STORAGE_DIR", "~/storage_jl")
+            ),
+            extension=(
+                ".jl.gz"
+                if settings.get("NOVEL_STORAGE_COMPRESSION") == "gzip"
+                else ".jl"
+            ),
+            refetch=settings.getbool("DUPEFILTER_REFETCH"),
+            open_novels=settings.getint("DUPEFILTER_OPEN_NOVELS", 64),
+        )
+        dupefilter.crawler = crawler
+        return dupefilter
+
+    def novel_path(self, novel_code: str) -> str:
+        # Same file as NovelStoragePipeline.novel_path
+        spider = self.crawler.spider
+        path = getattr(spider, "storage_paths", {}).get(novel_code)
+        if path:
+            return path
+        return os.path.join(
+            self.storage_directory, spider.name, f"{novel_code}{self.extension}"
+        )
+
+    def stored_chapters(self, novel_code: str) -> StoredChapters:
+        stored = self.novels.get(novel_code)
+        if stored is None:
+            stored = StoredChapters(
+                self.novel_path(novel_code), check_index=novel_code not in self.checked
+            )
+            self.checked.add(novel_code)
+            self.novels[novel_code] = stored
+            if len(self.novels) > self.open_novels:
+                self.novels.popitem(last=False)
+        else:
+            self.novels.move_to_end(novel_code)
+            stored.refresh()
+        return stored
+
+    def request_seen(self, request) -> bool:
+        novel_code, number = request_chapter(request)
+        if self.refetch or novel_code is None:
+            return super().request_seen(request)
+        stored = self.stored_chapters(novel_code)
+        if number in stored:
+            request.meta["next_missing_chapter"] = stored.next_missing(number)
+            self.crawler.stats.inc_value("dupefilter/stored")
+            return True
+        requested = self.requested.setdefault(novel_code, set())
+        if number in requested:
+            return True
+        requested.add(number)
+        return False
+
+    def log(self, request, spider):
+        if "next_missing_chapter" in request.meta:
+            self.logger.debug(
+                f"Chapter already stored: {request.url}", extra={"spider": spider}
+            )
+            return
+        super().log(request, spider)
+
+
+class SkipStoredChaptersMixin:
+    """Continue the chapter chain past chapters StoredChapterDupeFilter dropped.
+
+    Chapters are crawled by following next links, so a dropped chapter would
+    end the crawl. The request for the first missing chapter is scheduled
+    instead, unless that is past the last chapter (meta["chapter_total"]) or
+    the spider's end_chapter.
+    """
+
+    end_chapter = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(
+            spider.skip_stored_chapters, signal=signals.request_dropped
+        )
+        return spider
+
+    def skip_stored_chapters(self, request, spider):
+        number = request.meta.get("next_missing_chapter")
+        if number is None:
+            return
+        total = request.meta.get("chapter_total")
+        if (total and number > total) or (
+            self.end_chapter and number > self.end_chapter
+        ):
+            self.logger.info(
+                f"Chapters of {request.meta.get('novel_code')} are stored up to "
+                f"{number - 1}, nothing left to crawl"
+            )
+            return
+        next_request = self.missing_chapter_request(request, number)
+        if next_request is not None:
+            self.logger.info(f"Skipping stored chapters, continuing at {number}")
+            self.crawler.engine.crawl(next_request)
+
+    def missing_chapter_request(self, request, number: int):
+        """Request for chapter number in place of the dropped request."""
+        meta = dict(request.meta, start_time=time.time())
+        del meta["next_missing_chapter"]
+        meta.pop("chapter_number", None)
+        novel_code = meta.get("novel_code")
+        return request.replace(
+            url=urljoin(request.url, f"/{novel_code}/{number}/"), meta=meta
+        )
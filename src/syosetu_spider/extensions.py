@@ -0,0 +1,468 @@
+# Define here the extensions for your scrapy project
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+import os
+import json
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+# Sent by CrawlStatsSpiderMiddleware once a callback has been fully consumed
+parse_timed = object()
+# Sent by the Nocturne spider after Chrome loaded a page
+page_loaded = object()
+
+# Upper bounds for the seconds histograms (download latency, parse time, queue wait,
+# browser page load)
+SECONDS_BUCKETS = [
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+]
+# Upper bounds for the item size histogram in bytes
+BYTES_BUCKETS = [1024 * 2**exponent for exponent in range(0, 12)]
+
+METRIC_BUCKETS = {
+    "download_latency_seconds": SECONDS_BUCKETS,
+    "parse_time_seconds": SECONDS_BUCKETS,
+    "queue_wait_seconds": SECONDS_BUCKETS,
+    "page_load_seconds": SECONDS_BUCKETS,
+    "item_size_bytes": BYTES_BUCKETS,
+}
+
+
+class Histogram:
+    """Fixed bucket histogram, cheap enough to update on every request."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record a single value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(
+                zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)
+            ),
+        }
+
+
+class CrawlStatsExtension:
+    """Record per-domain latency, parse, queue wait, page load and item size histograms.
+
+    A summary is logged every CRAWLSTATS_INTERVAL seconds and when the spider
+    closes the histograms are written to CRAWLSTATS_DIR as JSON and as a
+    Prometheus textfile collector file.
+    """
+
+    def __init__(self, crawler, interval: float, output_dir: str):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = interval
+        self.output_dir = output_dir
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("CRAWLSTATS_ENABLED"):
+            raise NotConfigured
+        ext = cls(
+            crawler,
+            interval=crawler.settings.getfloat("CRAWLSTATS_INTERVAL", 60.0),
+            output_dir=os.path.expanduser(
+                crawler.settings.get("CRAWLSTATS_DIR", "~/storage_jl/crawl_stats")
+            ),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(
+            ext.request_reached_downloader, signal=signals.request_reached_downloader
+        )
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.parse_timed, signal=parse_timed)
+        crawler.signals.connect(ext.page_loaded, signal=page_loaded)
+        return ext
+
+    def observe(self, metric: str, url: str, value: float) -> None:
+        """Add a value to the histogram of a metric for the url's domain."""
+        domain = urlsplit(url).hostname or ""
+        key = (metric, domain)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(METRIC_BUCKETS[metric])
+        self.histograms[key].observe(value)
+
+    def spider_opened(self, spider):
+        if self.interval:
+            self.task = task.LoopingCall(self.log_summary, spider)
+            self.task.start(self.interval, now=False)
+
+    def request_scheduled(self, request, spider):
+        request.meta["crawlstats_scheduled"] = time.time()
+
+    def request_reached_downloader(self, request, spider):
+        scheduled = request.meta.get("crawlstats_scheduled")
+        if scheduled is not None:
+            self.observe("queue_wait_seconds", request.url, time.time() - scheduled)
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            self.observe("download_latency_seconds", request.url, latency)
+
+    def parse_timed(self, response, seconds, spider):
+        self.observe("parse_time_seconds", response.url, seconds)
+
+    def page_loaded(self, url, seconds, spider):
+        self.observe("page_load_seconds", url, seconds)
+
+    def item_scraped(self, item, response, spider):
+        size = len(
+            json.dumps(ItemAdapter(item).asdict(), ensure_ascii=False).encode("utf-8")
+        )
+        self.observe("item_size_bytes", response.url, size)
+
+    def log_summary(self, spider):
+        """Log the current p50/p95 per metric and domain."""
+        for (metric, domain), histogram in sorted(self.histograms.items()):
+            spider.logger.info(
+                f"{metric} {domain}: count={histogram.count} "
+                f"p50={histogram.quantile(0.5):g} p95={histogram.quantile(0.95):g} "
+                f"max={histogram.max:g}"
+            )
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        self.log_summary(spider)
+        for (metric, domain), histogram in self.histograms.items():
+            for label, quantile in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                self.stats.set_value(
+                    f"crawlstats/{domain}/{metric}/{label}",
+                    histogram.quantile(quantile),
+                )
+        self.write_metrics(spider)
+
+    def write_metrics(self, spider) -> None:
+        """Dump the histograms as JSON and as a Prometheus textfile."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        current_dt = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+
+        metrics = defaultdict(dict)
+        for (metric, domain), histogram in self.histograms.items():
+            metrics[domain][metric] = histogram.to_dict()
+        json_path = os.path.join(self.output_dir, f"{spider.name}_{current_dt}.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"spider": spider.name, "domains": metrics}, f, indent=2)
+
+        lines = []
+        for metric in METRIC_BUCKETS:
+            name = f"webnovel_crawl_{metric}"
+            lines.append(f"# TYPE {name} histogram")
+            for (hist_metric, domain), histogram in sorted(self.histograms.items()):
+                if hist_metric != metric:
+                    continue
+                labels = f'spider="{spider.name}",domain="{domain}"'
+                cumulative = 0
+                for bound, bucket_count in zip(
+                    [str(b) for b in histogram.buckets] + ["+Inf"], histogram.counts
+                ):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        # Write then rename so a textfile collector never reads a partial file
+        prom_path = os.path.join(self.output_dir, f"{spider.name}.prom")
+        # The temporary name is per process, crawl-workers runs several at once
+        tmp_path = f"{prom_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, prom_path)
+        spider.logger.info(f"Crawl metrics written to {json_path} and {prom_path}")
+
+
+class CrawlStatsSpiderMiddleware:
+    """Time how long spider callbacks spend producing their output."""
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("CRAWLSTATS_ENABLED"):
+            raise NotConfigured
+        return cls(crawler)
+
+    def _send(self, response, seconds, spider):
+        self.crawler.signals.send_catch_log(
+            parse_timed, response=response, seconds=seconds, spider=spider
+        )
+
+    def process_spider_output(self, response, result, spider):
+        # Only time spent inside the callback counts, not downstream processing
+        elapsed = 0.0
+        iterator = iter(result)
+        while True:
+            start = time.perf_counter()
+            try:
+                output = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            yield output
+        self._send(response, elapsed, spider)
+
+    async def process_spider_output_async(self, response, result, spider):
+        elapsed = 0.0
+        iterator = result.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                output = await iterator.__anext__()
+            except StopAsyncIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            yield output
+        self._send(response, elapsed, spider)
+
+
+class _SlotControl:
+    """AIMD state of one downloader slot, counters cover the current window."""
+
+    __slots__ = (
+        "responses",
+        "throttled",
+        "retried",
+        "latency",
+        "last_decrease",
+        "slot",
+    )
+
+    def __init__(self, slot):
+        self.slot = slot
+        self.responses = 0
+        self.throttled = 0
+        self.retried = 0
+        self.latency = None
+        self.last_decrease = 0.0
+
+    def reset_window(self) -> None:
+        self.responses = 0
+        self.throttled = 0
+        self.retried = 0
+
+
+class AdaptiveThrottleExtension:
+    """AIMD controller for per-domain download concurrency and delay.
+
+    Every ADAPTIVE_THROTTLE_WINDOW responses of a downloader slot are judged:
+    if the share of 429/503 responses or retried requests is above
+    ADAPTIVE_THROTTLE_ERROR_RATE, or the latency average is above
+    ADAPTIVE_THROTTLE_TARGET_LATENCY, the request rate is cut
+    multiplicatively by ADAPTIVE_THROTTLE_BACKOFF, concurrency first and the
+    delay once concurrency is at its minimum. Otherwise the delay is reduced
+    and, once it reached the minimum, concurrency grows by one. A 429/503
+    response with a Retry-After header backs off right away, at most once per
+    ADAPTIVE_THROTTLE_COOLDOWN, and raises the delay to the time asked for.
+
+    Decisions are counted in the crawl stats under adaptive_throttle/<slot>/.
+    """
+
+    THROTTLE_STATUSES = {429, 503}
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.start_concurrency = settings.getint("ADAPTIVE_THROTTLE_START_CONCURRENCY")
+        self.min_concurrency = settings.getint("ADAPTIVE_THROTTLE_MIN_CONCURRENCY")
+        self.max_concurrency = settings.getint("ADAPTIVE_THROTTLE_MAX_CONCURRENCY")
+        self.start_delay = settings.getfloat("ADAPTIVE_THROTTLE_START_DELAY")
+        self.min_delay = settings.getfloat("ADAPTIVE_THROTTLE_MIN_DELAY")
+        self.max_delay = settings.getfloat("ADAPTIVE_THROTTLE_MAX_DELAY")
+        self.target_latency = settings.getfloat("ADAPTIVE_THROTTLE_TARGET_LATENCY")
+        self.error_rate = settings.getfloat("ADAPTIVE_THROTTLE_ERROR_RATE")
+        self.window = max(1, settings.getint("ADAPTIVE_THROTTLE_WINDOW"))
+        self.backoff = settings.getfloat("ADAPTIVE_THROTTLE_BACKOFF")
+        self.cooldown = settings.getfloat("ADAPTIVE_THROTTLE_COOLDOWN")
+        self.debug = settings.getbool("ADAPTIVE_THROTTLE_DEBUG")
+        self.controls: Dict[str, _SlotControl] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("ADAPTIVE_THROTTLE_ENABLED"):
+            raise NotConfigured
+        if crawler.settings.getbool("AUTOTHROTTLE_ENABLED"):
+            raise NotConfigured("AdaptiveThrottleExtension replaces AutoThrottle")
+        ext = cls(crawler)
+        # response_downloaded fires before RetryMiddleware turns 429/503 into retries
+        crawler.signals.connect(
+            ext.response_downloaded, signal=signals.response_downloaded
+        )
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def _slot(self, request):
+        key = request.meta.get("download_slot")
+        if key is None:
+            return None, None
+        return key, self.crawler.engine.downloader.slots.get(key)
+
+    def response_downloaded(self, response, request, spider):
+        key, slot = self._slot(request)
+        if slot is None:
+            return
+        control = self.controls.get(key)
+        if control is None:
+            # First response of a new slot, start from the configured values
+            control = self.controls[key] = _SlotControl(slot)
+            slot.concurrency = self.start_concurrency
+            slot.delay = max(self.min_delay, self.start_delay)
+            self._record(key, slot, "start", spider)
+        elif control.slot is not slot:
+            # Idle slots are garbage collected, carry the learned values over
+            slot.concurrency = control.slot.concurrency
+            slot.delay = control.slot.delay
+            control.slot = slot
+
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            control.latency = (
+                latency
+                if control.latency is None
+                else 0.8 * control.latency + 0.2 * latency
+            )
+        control.responses += 1
+        if request.meta.get("retry_times", 0):
+            control.retried += 1
+
+        if response.status in self.THROTTLE_STATUSES:
+            control.throttled += 1
+            retry_after = self._retry_after(response)
+            # The server said how long to wait, back off now instead of at the
+            # end of the window
+            if (
+                retry_after
+                and time.monotonic() - control.last_decrease >= self.cooldown
+            ):
+                self._decrease(key, slot, control, spider)
+                slot.delay = min(self.max_delay, max(slot.delay, retry_after))
+                return
+
+        if control.responses >= self.window:
+            responses = control.responses
+            if (
+                control.throttled / responses > self.error_rate
+                or control.retried / responses > self.error_rate
+                or (control.latency or 0.0) > self.target_latency
+            ):
+                self._decrease(key, slot, control, spider)
+            else:
+                self._increase(key, slot, control, spider)
+
+    @staticmethod
+    def _retry_after(response) -> float:
+        value = response.headers.get(b"Retry-After")
+        try:
+            return float(value) if value else 0.0
+        except ValueError:
+            # HTTP dates are not worth parsing here, fall back to the backoff
+            return 0.0
+
+    def _decrease(self, key, slot, control, spider) -> None:
+        # Concurrency and delay form one ladder, lower concurrency first and
+        # only start adding delay once a single request at a time is too much
+        if slot.concurrency > self.min_concurrency:
+            slot.concurrency = max(
+                self.min_concurrency, int(slot.concurrency * self.backoff)
+            )
+        else:
+            slot.delay = min(self.max_delay, max(slot.delay / self.backoff, 0.25))
+        control.last_decrease = time.monotonic()
+        control.reset_window()
+        self._record(key, slot, "decrease", spider)
+
+    def _increase(self, key, slot, control, spider) -> None:
+        if slot.delay > self.min_delay:
+            slot.delay = slot.delay * self.backoff
+            if slot.delay < 0.05:
+                slot.delay = self.min_delay
+            slot.delay = max(self.min_delay, slot.delay)
+        elif slot.concurrency < self.max_concurrency:
+            slot.concurrency += 1
+        else:
+            control.reset_window()
+            return
+        control.reset_window()
+        self._record(key, slot, "increase", spider)
+
+    def _record(self, key, slot, decision: str, spider) -> None:
+        prefix = f"adaptive_throttle/{key}"
+        self.stats.inc_value(f"{prefix}/{decision}")
+        self.stats.set_value(f"{prefix}/concurrency", slot.concurrency)
+        self.stats.set_value(f"{prefix}/delay", round(slot.delay, 3))
+        self.stats.max_value(f"{prefix}/max_concurrency", slot.concurrency)
+        self.stats.max_value(f"{prefix}/max_delay", round(slot.delay, 3))
+        if self.debug:
+            spider.logger.info(
+                f"Adaptive throttle {key}: {decision} -> "
+                f"concurrency={slot.concurrency} delay={slot.delay:.3f}s"
+            )
+
+    def spider_closed(self, spider, reason):
+        for key, control in sorted(self.controls.items()):
+            if control.latency is not None:
+                self.stats.set_value(
+                    f"adaptive_throttle/{key}/latency_ewma", round(control.latency, 3)
+                )
@@ -11,6 +11,7 @@ import scrapy
 
 class NovelItem(scrapy.Item):
     # define the fields for your item here like:
+    novel_code = scrapy.Field()
     novel_title = scrapy.Field()
     novel_description = scrapy.Field()
     volume_title = scrapy.Field()
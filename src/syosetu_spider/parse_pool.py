@@ -0,0 +1,84 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# One pool per process, shared by the spiders running in it
+_executor: Optional[ProcessPoolExecutor] = None
+_users = 0
+
+
+def parse_pool_workers(configured: int) -> int:
+    """Worker processes of the pool, 0 leaves one core to the reactor."""
+    if configured > 0:
+        return configured
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+class ParsePoolMixin:
+    """Run CPU heavy page parsing on a process pool instead of the reactor.
+
+    While BeautifulSoup parses a page in a callback, the reactor dispatches no
+    downloads and handles no responses. Callbacks await run_parser instead,
+    so the reactor keeps I/O going while the pool parses on the other cores.
+    The parse function and its arguments are sent to a worker process, so
+    they have to be picklable: module level functions taking page text.
+
+    The pool is started by the first spider that parses a page and shut down
+    when the last one using it closes, unless PARSE_POOL_KEEP_ALIVE is set for
+    a process that runs one crawl after another. If PARSE_POOL_ENABLED is
+    False or the pool broke, the function runs in the callback.
+    """
+
+    _uses_parse_pool = False
+
+    async def run_parser(self, function: Callable, *args):
+        global _executor, _users
+        if not self.settings.getbool("PARSE_POOL_ENABLED", True):
+            return function(*args)
+        if not self._uses_parse_pool:
+            _users += 1
+            self._uses_parse_pool = True
+        if _executor is None:
+            # Spawned, a forked copy of a running reactor is not safe to use
+            _executor = ProcessPoolExecutor(
+                max_workers=parse_pool_workers(
+                    self.settings.getint("PARSE_POOL_WORKERS")
+                ),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        executor = _executor
+        try:
+            return await asyncio.wrap_future(executor.submit(function, *args))
+        except BrokenProcessPool:
+            # A worker died, e.g. killed for memory, the next call starts a new pool
+            logger.warning("Parse pool broke, parsing in the reactor process")
+            executor.shutdown(wait=False, cancel_futures=True)
+            if _executor is executor:
+                _executor = None
+            return function(*args)
+
+    def release_parse_pool(self) -> None:
+        """Call from closed(), shuts the pool down after its last spider."""
+        global _executor, _users
+        if not self._uses_parse_pool:
+            return
+        self._uses_parse_pool = False
+        _users -= 1
+        if self.settings.getbool("PARSE_POOL_KEEP_ALIVE"):
+            return
+        if _users == 0:
+            shutdown_parse_pool()
+
+
+def shutdown_parse_pool() -> None:
+    """Shut the pool down, e.g. when a process with PARSE_POOL_KEEP_ALIVE exits."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,112 @@
+# Page parsing helpers of the spiders: the chapter pages of both sites, and the
+# plain-text chapter download of Syosetu used with text_download=True.
+import re
+from typing import Dict, List, Optional
+from bs4 import BeautifulSoup
+
+# The text export puts the foreword before and the afterword after the chapter
+# text, each separated by a line of asterisks of different length
+FOREWORD_SEPARATOR = "*" * 44
+AFTERWORD_SEPARATOR = "*" * 48
+
+TEXT_DOWNLOAD_ID_PATTERN = re.compile(r"/txtdownload/top/ncode/(\d+)/")
+TEXT_DOWNLOAD_PATH = (
+    "/txtdownload/dlstart/ncode/{novel_id}/?no={number}&hankaku=0&code=utf-8&kaigyo=lf"
+)
+
+
+def text_download_id(soup) -> Optional[str]:
+    """Find the numeric novel id of the text download link on the main page."""
+    link = soup.select_one("a[href*='/txtdownload/top/ncode/']")
+    if link is None:
+        return None
+    match = TEXT_DOWNLOAD_ID_PATTERN.search(link["href"])
+    return match.group(1) if match else None
+
+
+def toc_chapters(soup) -> List[List]:
+    """List [chapter_number, chapter_title, volume_title] from a main page.
+
+    The volume title is only set on the first chapter after a volume heading,
+    where the chapter pages show it too.
+    """
+    chapters = []
+    volume_title = ""
+    for element in soup.select(
+        "div.p-eplist div.p-eplist__chapter-title, div.p-eplist div.p-eplist__sublist"
+    ):
+        if "p-eplist__chapter-title" in element.get("class", []):
+            volume_title = element.text.strip()
+            continue
+        link = element.select_one("a")
+        if link is None:
+            continue
+        number = [part for part in link["href"].split("/") if part][-1]
+        if not number.isdigit():
+            continue
+        chapters.append([int(number), link.text.strip(), volume_title])
+        volume_title = ""
+    return chapters
+
+
+def parse_text_export(text: str) -> Dict[str, str]:
+    """Split a chapter text export into foreword, chapter text and afterword."""
+    lines = text.replace("\r\n", "\n").split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    foreword: List[str] = []
+    afterword: List[str] = []
+    if FOREWORD_SEPARATOR in lines:
+        index = lines.index(FOREWORD_SEPARATOR)
+        foreword, lines = lines[:index], lines[index + 1 :]
+    if AFTERWORD_SEPARATOR in lines:
+        index = lines.index(AFTERWORD_SEPARATOR)
+        lines, afterword = lines[:index], lines[index + 1 :]
+    fields = {"chapter_text": "\n".join(lines)}
+    if foreword:
+        fields["chapter_foreword"] = "\n".join(foreword)
+    if afterword:
+        fields["chapter_afterword"] = "\n".join(afterword)
+    return fields
+
+
+def parse_chapter_page(html: str) -> Dict[str, Optional[str]]:
+    """Extract the chapter fields of a Syosetu or Nocturne chapter page.
+
+    Runs on the parse pool, so it takes and returns plain strings. The keys
+    are the NovelItem chapter fields in item order, followed by next_href,
+    the link of the next chapter or None on the last one.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    volume_title = soup.select_one("div.c-announce-box span")
+    chapter_start_end = soup.select_one("div.p-novel__number").text
+    fields = {
+        "novel_title": soup.select("div.c-announce-box div.c-announce a")[1].text,
+        "volume_title": volume_title.text if volume_title else "",
+        "chapter_start_end": chapter_start_end,
+        "chapter_number": chapter_start_end.split("/")[0],
+        "chapter_title": soup.select_one(
+            "h1.p-novel__title.p-novel__title--rensai"
+        ).text,
+    }
+    foreword = soup.select_one(
+        "div.p-novel__body div.js-novel-text.p-novel__text--preface"
+    )
+    if foreword:
+        fields["chapter_foreword"] = "\n".join(p.text for p in foreword.select("p"))
+    fields["chapter_text"] = "\n".join(
+        p.text
+        for p in soup.select_one(
+            "div.p-novel__body div.js-novel-text.p-novel__text"
+        ).select("p[id^='L']")
+    )
+    afterword = soup.select_one(
+        "div.p-novel__body div.js-novel-text.p-novel__text--afterword"
+    )
+    if afterword:
+        fields["chapter_afterword"] = "\n".join(p.text for p in afterword.select("p"))
+    next_page_element = soup.select_one("div.c-pager a.c-pager__item--next")
+    fields["next_href"] = (
+        next_page_element["href"] if next_page_element is not None else None
+    )
+    return fields
@@ -2,12 +2,250 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-
+import os
+import json
+import time
+import heapq
+from asyncio import Future
+from typing import Dict, List, Tuple
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import threads
+
+from novel_store import CrawlState, NovelFileWriter, RecordEncoder
+from novel_package_v2 import Novel, Chapter, chapter_from_record
+from utils_translate import translate_title
 
 
 class SyosetuSpiderPipeline:
     def process_item(self, item, spider):
         return item
+
+
+class NovelStoragePipeline:
+    """Write each novel to its own canonical file keyed by novel code.
+
+    Items land in NOVEL_STORAGE_DIR/<spider name>/<novel_code>.jl through a
+    large write buffer. Every NOVEL_STORAGE_FSYNC_ITEMS items or
+    NOVEL_STORAGE_FSYNC_SECONDS seconds the files are fsynced, then the chapter
+    index and the crawl state store are updated. Chapters that are already
+    stored are not written twice.
+
+    Files use the v2 layout: a header record with the novel fields, written
+    again whenever they change, followed by slim chapter records.
+
+    With NOVEL_STORAGE_SHARED several crawler processes can store chapters of
+    the same novel, each sync appends under a file lock and starts with a
+    header of its own since other processes may have appended in between.
+    """
+
+    def __init__(
+        self,
+        storage_directory: str,
+        buffer_size: int,
+        fsync_items: int,
+        fsync_seconds: float,
+        compression: str,
+        shared: bool = False,
+    ):
+        self.storage_directory = storage_directory
+        self.buffer_size = buffer_size
+        self.fsync_items = fsync_items
+        self.fsync_seconds = fsync_seconds
+        self.extension = ".jl.gz" if compression == "gzip" else ".jl"
+        self.shared = shared
+        self.writers: Dict[str, NovelFileWriter] = {}
+        self.encoders: Dict[str, RecordEncoder] = {}
+        self.novels: Dict[str, Dict] = {}
+        self.unsynced_items = 0
+        self.last_sync = time.monotonic()
+        self.crawl_state = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            storage_directory=os.path.expanduser(
+                settings.get("NOVEL_STORAGE_DIR", "~/storage_jl")
+            ),
+            buffer_size=settings.getint("NOVEL_STORAGE_BUFFER_SIZE", 1024 * 1024),
+            fsync_items=settings.getint("NOVEL_STORAGE_FSYNC_ITEMS", 100),
+            fsync_seconds=settings.getfloat("NOVEL_STORAGE_FSYNC_SECONDS", 30.0),
+            compression=settings.get("NOVEL_STORAGE_COMPRESSION"),
+            shared=settings.getbool("NOVEL_STORAGE_SHARED"),
+        )
+
+    def open_spider(self, spider):
+        self.crawl_state = CrawlState(self.storage_directory)
+
+    def close_spider(self, spider):
+        self.sync(spider)
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+        self.encoders.clear()
+        self.crawl_state.close()
+
+    def novel_path(self, spider, novel_code: str) -> str:
+        # Spiders repairing existing files name them in storage_paths
+        path = getattr(spider, "storage_paths", {}).get(novel_code)
+        if path:
+            return path
+        return os.path.join(
+            self.storage_directory, spider.name, f"{novel_code}{self.extension}"
+        )
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        novel_code = adapter.get("novel_code")
+        chapter_number = int(adapter.get("chapter_number"))
+
+        writer = self.writers.get(novel_code)
+        if writer is None:
+            writer = NovelFileWriter(
+                self.novel_path(spider, novel_code),
+                buffer_size=self.buffer_size,
+                shared=self.shared,
+            )
+            self.writers[novel_code] = writer
+            # Each run starts its appends with a header of its own
+            self.encoders[novel_code] = RecordEncoder()
+
+        if chapter_number in writer:
+            spider.logger.debug(
+                f"Chapter {chapter_number} of {novel_code} already stored"
+            )
+            return item
+
+        *headers, record = self.encoders[novel_code].encode(adapter.asdict())
+        for header in headers:
+            line = json.dumps(header, ensure_ascii=False) + "\n"
+            writer.write_header(line.encode("utf-8"))
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        writer.write(chapter_number, line.encode("utf-8"))
+        self.novels[novel_code] = {
+            "site": spider.name,
+            "path": writer.filepath,
+            "novel_title": adapter.get("novel_title"),
+            "last_chapter": chapter_number,
+            "total_chapters": int(adapter.get("chapter_start_end").split("/")[1]),
+        }
+
+        self.unsynced_items += 1
+        if (
+            self.unsynced_items >= self.fsync_items
+            or time.monotonic() - self.last_sync >= self.fsync_seconds
+        ):
+            self.sync(spider)
+        return item
+
+    def sync(self, spider) -> None:
+        """Make written chapters durable and record them in the index and crawl state."""
+        for novel_code, writer in self.writers.items():
+            writer.sync()
+            if self.shared:
+                self.encoders[novel_code] = RecordEncoder()
+            if novel_code in self.novels:
+                values = self.novels.pop(novel_code)
+                # Repaired chapters can come after the last stored chapter
+                values["last_chapter"] = max(writer.index.entries)
+                self.crawl_state.update(
+                    novel_code,
+                    chapters_stored=len(writer.index.entries),
+                    **values,
+                )
+        self.unsynced_items = 0
+        self.last_sync = time.monotonic()
+
+
+class StreamingUnpackPipeline:
+    """Unpack chapters into text chunks while the crawl is still running.
+
+    Each NovelItem is fed straight into a novel_package_v2.Novel chunker, so
+    finished 'start-end title.txt' chunks are written as soon as
+    STREAM_UNPACK_LENGTH chapters are in, without re-reading the .jl file.
+    Items that arrive out of order wait in a small heap of at most
+    STREAM_UNPACK_BUFFER chapters until the missing chapter_number shows up.
+    """
+
+    def __init__(self, output_directory: str, chunk_size: int, buffer_size: int):
+        self.output_directory = output_directory
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.novels: Dict[str, Novel] = {}
+        self.pending: Dict[str, List[Tuple[int, int, Chapter]]] = {}
+        self.next_chapter: Dict[str, int] = {}
+        self.english_titles: Dict[str, Future] = {}
+        self.sequence = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("STREAM_UNPACK_ENABLED"):
+            raise NotConfigured
+        return cls(
+            output_directory=os.path.expanduser(
+                settings.get("STREAM_UNPACK_DIR", "~/storage_jl_text")
+            ),
+            chunk_size=settings.getint("STREAM_UNPACK_LENGTH", 10),
+            buffer_size=settings.getint("STREAM_UNPACK_BUFFER", 64),
+        )
+
+    async def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        novel_code = adapter.get("novel_code")
+        chapter = chapter_from_record(adapter)
+
+        if novel_code not in self.novels:
+            novel = Novel(
+                title=adapter.get("novel_title", ""),
+                description=adapter.get("novel_description", ""),
+                output_dir=os.path.join(self.output_directory, spider.name),
+                chunk_size=self.chunk_size,
+            )
+            self.novels[novel_code] = novel
+            self.pending[novel_code] = []
+            self.next_chapter[novel_code] = int(
+                getattr(spider, "start_chapter", None) or chapter.number
+            )
+            # translate_title runs its own event loop, so keep it off the reactor
+            self.english_titles[novel_code] = maybe_deferred_to_future(
+                threads.deferToThread(translate_title, novel.title)
+            )
+
+        # Chunks are only written once the novel's English title is known
+        self.novels[novel_code].english_title = await self.english_titles[novel_code]
+        self._feed(novel_code, chapter, force=False)
+        return item
+
+    def _feed(self, novel_code: str, chapter: Chapter, force: bool) -> None:
+        """Queue a chapter and pass every chapter that is now in order to the chunker."""
+        pending = self.pending[novel_code]
+        if chapter is not None:
+            self.sequence += 1
+            heapq.heappush(pending, (chapter.number, self.sequence, chapter))
+
+        novel = self.novels[novel_code]
+        while pending and (
+            pending[0][0] <= self.next_chapter[novel_code]
+            or len(pending) > self.buffer_size
+            or force
+        ):
+            number, _, next_chapter = heapq.heappop(pending)
+            if number < self.next_chapter[novel_code]:
+                # Duplicate of a chapter that was already unpacked
+                continue
+            novel.add_chapter(next_chapter)
+            self.next_chapter[novel_code] = number + 1
+            if novel.should_flush_chunk():
+                novel.flush_chunk()
+                # Only the current chunk is needed while streaming
+                novel.chapters.clear()
+
+    def close_spider(self, spider):
+        for novel_code, novel in self.novels.items():
+            self._feed(novel_code, None, force=True)
+            novel.flush_chunk()
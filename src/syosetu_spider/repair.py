@@ -0,0 +1,56 @@
+import time
+import scrapy
+from typing import Dict
+from urllib.parse import urljoin
+
+
+class ChapterRepairMixin:
+    """Fetch only listed chapters of stored novels, used by the repair command.
+
+    The repair spider argument is {novel_code: target} with the novel "url",
+    the stored file "path", the missing "chapters" and the stored
+    "novel_description". Chapter pages are requested directly, all at once,
+    and parse_chapters does not follow the next link of repair responses.
+    NovelStoragePipeline appends the chapters to the file in storage_paths.
+    """
+
+    repair = None
+    # Cookies sent with every repair request, e.g. to pass an age gate
+    repair_cookies: Dict[str, str] = {}
+
+    @property
+    def storage_paths(self) -> Dict[str, str]:
+        return {code: target["path"] for code, target in (self.repair or {}).items()}
+
+    async def start(self):
+        if not self.repair:
+            async for item_or_request in super().start():
+                yield item_or_request
+            return
+        for request in self.repair_requests():
+            yield request
+
+    def start_requests(self):
+        # Scrapy before 2.13 starts the crawl from start_requests
+        if not self.repair:
+            yield from super().start_requests()
+            return
+        yield from self.repair_requests()
+
+    def repair_requests(self):
+        for novel_code, target in self.repair.items():
+            # parse_chapters looks the description up by novel code
+            self.novel_meta.set(
+                novel_code, novel_description=target.get("novel_description", "")
+            )
+            for number in target["chapters"]:
+                yield scrapy.Request(
+                    urljoin(target["url"], f"/{novel_code}/{number}/"),
+                    callback=self.parse_chapters,
+                    cookies=self.repair_cookies,
+                    meta={
+                        "novel_code": novel_code,
+                        "start_time": time.time(),
+                        "repair": True,
+                    },
+                )
@@ -46,6 +46,9 @@ ROBOTSTXT_OBEY = True
 # SPIDER_MIDDLEWARES = {
 #    "syosetu_spider.middlewares.SyosetuSpiderSpiderMiddleware": 543,
 # }
+SPIDER_MIDDLEWARES = {
+    "syosetu_spider.extensions.CrawlStatsSpiderMiddleware": 100,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
@@ -64,12 +67,92 @@ ROBOTSTXT_OBEY = True
 # EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
 # }
+EXTENSIONS = {
+    "syosetu_spider.extensions.CrawlStatsExtension": 500,
+    "syosetu_spider.extensions.AdaptiveThrottleExtension": 510,
+}
+
+# Crawl performance histograms per spider and domain (download latency, parse
+# time, queue wait, item size). A summary is logged every CRAWLSTATS_INTERVAL
+# seconds and JSON plus Prometheus textfile metrics are written on close.
+CRAWLSTATS_ENABLED = True
+CRAWLSTATS_INTERVAL = 60.0
+CRAWLSTATS_DIR = "~/storage_jl/crawl_stats"
+
+# AIMD throttle adjusting concurrency and delay per domain from latency,
+# 429/503 responses and retries, replaces AUTOTHROTTLE. Decisions are counted in
+# the crawl stats under adaptive_throttle/<domain>/.
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_START_CONCURRENCY = 2
+ADAPTIVE_THROTTLE_MIN_CONCURRENCY = 1
+ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 8
+ADAPTIVE_THROTTLE_START_DELAY = 0.5
+ADAPTIVE_THROTTLE_MIN_DELAY = 0.0
+ADAPTIVE_THROTTLE_MAX_DELAY = 60.0
+# Average latency in seconds above which a domain counts as overloaded
+ADAPTIVE_THROTTLE_TARGET_LATENCY = 3.0
+# Share of 429/503 responses or retried requests that triggers a backoff
+ADAPTIVE_THROTTLE_ERROR_RATE = 0.05
+# Responses per domain between two decisions
+ADAPTIVE_THROTTLE_WINDOW = 20
+ADAPTIVE_THROTTLE_BACKOFF = 0.5
+# Minimum seconds between two backoffs caused by Retry-After headers
+ADAPTIVE_THROTTLE_COOLDOWN = 5.0
+ADAPTIVE_THROTTLE_DEBUG = False
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 # ITEM_PIPELINES = {
 #    "syosetu_spider.pipelines.SyosetuSpiderPipeline": 300,
 # }
+ITEM_PIPELINES = {
+    "syosetu_spider.pipelines.NovelStoragePipeline": 800,
+    "syosetu_spider.pipelines.StreamingUnpackPipeline": 900,
+}
+
+# Per-novel storage, each novel is written to NOVEL_STORAGE_DIR/<spider>/<ncode>.jl
+# Set NOVEL_STORAGE_COMPRESSION = "gzip" to write <ncode>.jl.gz instead.
+NOVEL_STORAGE_DIR = "~/storage_jl"
+NOVEL_STORAGE_BUFFER_SIZE = 1024 * 1024
+NOVEL_STORAGE_FSYNC_ITEMS = 100
+NOVEL_STORAGE_FSYNC_SECONDS = 30.0
+NOVEL_STORAGE_COMPRESSION = None
+# Append under a file lock so several crawler processes can share novel files,
+# crawl-workers turns this on for its worker processes
+NOVEL_STORAGE_SHARED = False
+
+# Fused crawl-and-unpack, writes text chunks to STREAM_UNPACK_DIR/<spider> as
+# chapters arrive. Enabled per crawl with the --unpack option.
+STREAM_UNPACK_ENABLED = False
+STREAM_UNPACK_DIR = "~/storage_jl_text"
+STREAM_UNPACK_LENGTH = 10
+STREAM_UNPACK_BUFFER = 64
+
+# Chapter pages are parsed on a process pool so parsing does not hold up the
+# reactor. 0 workers uses all cores but one, crawl-workers turns the pool off
+# since its crawler processes already use the cores. The daemon keeps the pool
+# alive between crawls.
+PARSE_POOL_ENABLED = True
+PARSE_POOL_WORKERS = 0
+PARSE_POOL_KEEP_ALIVE = False
+
+# Chrome profile of the Nocturne spider. "light" blocks images, stylesheets,
+# fonts, media and third-party scripts and returns from page loads at
+# DOMContentLoaded, "full" loads pages like a desktop browser. Page loads and
+# the waits for the age gate and the chapter text time out after
+# NOCTURNE_BROWSER_TIMEOUT seconds. NOCTURNE_BLOCKED_URLS adds
+# Network.setBlockedURLs patterns to the light profile, e.g. "*.example.com*".
+NOCTURNE_BROWSER_PROFILE = "light"
+NOCTURNE_BROWSER_TIMEOUT = 30
+NOCTURNE_BLOCKED_URLS = []
+
+# Chapters that are already stored are not requested again, the chapter index
+# of each novel file is the persistent seen set. DUPEFILTER_REFETCH requests
+# them anyway (--refetch). The chapter sets of at most DUPEFILTER_OPEN_NOVELS
+# novels are kept in memory.
+DUPEFILTER_CLASS = "syosetu_spider.dupefilter.StoredChapterDupeFilter"
+DUPEFILTER_REFETCH = False
+DUPEFILTER_OPEN_NOVELS = 64
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
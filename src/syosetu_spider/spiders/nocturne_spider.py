@@ -8,15 +8,23 @@ from bs4 import BeautifulSoup
 sys.path.append("../../..")
 
 from syosetu_spider.items import NovelItem
-from selenium import webdriver
-from selenium.webdriver.common.by import By
+from syosetu_spider.repair import ChapterRepairMixin
+from syosetu_spider.parse_pool import ParsePoolMixin
+from syosetu_spider.dupefilter import SkipStoredChaptersMixin
+from syosetu_spider.parsing import parse_chapter_page
+from syosetu_spider.browser import build_chrome_driver, load_page
+from syosetu_spider.extensions import page_loaded
+from novel_store import NovelMetaStore, novel_code_from_url
 from urllib.parse import urljoin
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from datetime import datetime
 
 HOME_USER = os.path.expanduser("~")
 
 
-class NocturneSpider(scrapy.Spider):
+class NocturneSpider(
+    ChapterRepairMixin, ParsePoolMixin, SkipStoredChaptersMixin, scrapy.Spider
+):
     name = "nocturne_spider"
     allowed_domains = ["syosetu.com", "novel18.syosetu.com"]  # Add base domain
     current_dt = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -31,56 +39,84 @@ class NocturneSpider(scrapy.Spider):
             "Accept-Language": "en-US,en;q=0.5",
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
         },
-        "FEEDS": {
-            # f"{name}_{current_dt}.jsonl": {
-            os.path.join(HOME_USER, "storage_jl", f"{name}_{current_dt}.jl"): {
-                "format": "jsonlines",
-                "encoding": "utf8",
-                "store_empty": False,
-                "overwrite": True,
-            }
-        },
     }
-
-    def __init__(self, start_urls=None, start_chapter=None, *args, **kwargs):
+    # The age gate only checks this cookie, so repair requests skip the browser
+    repair_cookies = {"over18": "yes"}
+    # Elements the parser reads, waited for after a page load
+    main_page_selector = "div#novel_ex.p-novel__summary"
+    chapter_page_selector = "div.p-novel__body"
+
+    def __init__(
+        self, start_urls=None, start_chapter=None, end_chapter=None, *args, **kwargs
+    ):
         super(NocturneSpider, self).__init__(*args, **kwargs)
         self.start_chapter = start_chapter
+        # Last chapter to crawl, crawl-workers splits novels into chapter ranges
+        self.end_chapter = int(end_chapter) if end_chapter else None
+        self._novel_meta = None
         if start_urls:
             self.start_urls = [start_urls]
         else:
             self.start_urls = ["https://novel18.syosetu.com/n0153ce/"]
-        # Initialize single chrome driver instance for server environment
-        options = webdriver.ChromeOptions()
-        options.add_argument("--headless")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-gpu")
-        # options.add_argument("--log-level=3") #Levels: 0=INFO, 1=WARNING, 2=ERROR, 3=FATAL
-        # options.add_experimental_option("excludeSwitches", ["enable-logging"])
-        self.driver = webdriver.Chrome(options=options)
-        self.driver.implicitly_wait(5)
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        if not spider.repair:
+            # Initialize single chrome driver instance for server environment
+            spider.driver = build_chrome_driver(crawler.settings)
+        return spider
+
+    @property
+    def novel_meta(self) -> NovelMetaStore:
+        """Per-novel metadata referenced by novel code from request meta."""
+        if self._novel_meta is None:
+            self._novel_meta = NovelMetaStore(self.settings.get("JOBDIR"))
+        return self._novel_meta
 
     def closed(self, reason):
         # Clean up driver when spider closes
         if hasattr(self, "driver"):
             self.driver.quit()
+        self.release_parse_pool()
+        if self._novel_meta is not None:
+            self._novel_meta.close()
+
+    def browse(self, url: str, ready_selector: str):
+        """Load a page in Chrome past the age gate, return its source and url.
+
+        Links on the page are relative to the returned url, which is past the
+        gate, not to the Scrapy response: that request has no over18 cookie
+        and can end on the age gate host. The load time goes to the crawl
+        stats, (None, None) if the page did not load.
+        """
+        try:
+            seconds = load_page(
+                self.driver,
+                url,
+                ready_selector,
+                self.settings.getfloat("NOCTURNE_BROWSER_TIMEOUT", 30),
+            )
+        except (TimeoutException, WebDriverException) as e:
+            logging.error(f"Could not load {url} past the age gate: {e}")
+            return None, None
+        self.crawler.signals.send_catch_log(
+            page_loaded, url=url, seconds=seconds, spider=self
+        )
+        self.crawler.stats.inc_value("browser/pages")
+        self.logger.debug(f"Loaded {url} in Chrome in {seconds:.2f} seconds")
+        return self.driver.page_source, self.driver.current_url
 
     # Parse novel main page first before parsing chapter content
     def parse(self, response):
         logging.info("Start nocturne spider parse main_page crawl\n")
 
         try:
-            self.driver.get(response.url)
-            # Handle age verification
-            try:
-                enter_button = self.driver.find_element(By.ID, "yes18")
-                enter_button.click()
-            except:
-                logging.error("Could not find age verification button")
-                self.driver.quit()
+            page_source, page_url = self.browse(response.url, self.main_page_selector)
+            if page_source is None:
                 return
 
-            soup_parser = BeautifulSoup(self.driver.page_source, "html.parser")
+            soup_parser = BeautifulSoup(page_source, "html.parser")
             main_page = soup_parser.select_one("div#novel_ex.p-novel__summary").text
 
             if main_page is not None:
@@ -94,6 +130,8 @@ class NocturneSpider(scrapy.Spider):
                 # logging.info(f"first_chapter_link: {first_chapter_link}")
                 # "https://ncode.syosetu.com / n1313ff / 74 /"
                 novel_code = first_chapter_link.split("/")[1]
+                # Requests only carry the novel code, the description is looked up by it
+                self.novel_meta.set(novel_code, novel_description=novel_description)
                 # logging.info(f"novel_code: {novel_code}")
                 # start_chapter = "55"
                 if self.start_chapter:
@@ -102,15 +140,19 @@ class NocturneSpider(scrapy.Spider):
                     chapter_link = first_chapter_link
 
                 # get the first chapter link and pass novel desc to the parse_chapters method
-                starting_page = urljoin("https://novel18.syosetu.com/", chapter_link)
+                starting_page = urljoin(page_url, chapter_link)
                 logging.info(f"Starting page: {starting_page}\n")
                 yield scrapy.Request(
                     starting_page,
                     callback=self.parse_chapters,
-                    dont_filter=True,  # Disable URL filtering
+                    # Stored chapters are skipped unless refetching
+                    dont_filter=self.settings.getbool("DUPEFILTER_REFETCH"),
+                    # Past the gate a chapter after the last one is a 404, which
+                    # never reaches the browser
+                    cookies=self.repair_cookies,
                     meta={
-                        "novel_description": novel_description,
-                        "start_time": time.perf_counter(),
+                        "novel_code": novel_code,
+                        "start_time": time.time(),
                         # "driver": driver,
                     },
                 )
@@ -118,85 +160,68 @@ class NocturneSpider(scrapy.Spider):
             self.logger.error(f"Error in parse_chapters: {e}")
             raise e
 
-    def parse_chapters(self, response):
+    async def parse_chapters(self, response):
         try:
-            self.driver.get(response.url)
-
-            try:
-                enter_button = self.driver.find_element(By.ID, "yes18")
-                enter_button.click()
-            except:
-                logging.error("Could not find age verification button")
-                self.driver.quit()
-                return
+            if response.meta.get("repair"):
+                # Fetched with the over18 cookie, the page is past the age gate
+                page_source, page_url = response.text, response.url
+            else:
+                # Read before awaiting, other callbacks use the driver meanwhile
+                page_source, page_url = self.browse(
+                    response.url, self.chapter_page_selector
+                )
+                if page_source is None:
+                    return
 
-            soup_parser = BeautifulSoup(self.driver.page_source, "html.parser")
+            fields = await self.run_parser(parse_chapter_page, page_source)
+            next_page_href = fields.pop("next_href")
             # Calculate the time taken to crawl the chapter from request to end of processing
             time_start = response.meta.get("start_time")
 
-            # novel_description retrieved from meta dictionary, and passed to next parse_chapters
-            novel_item = NovelItem()
-            novel_item["novel_title"] = soup_parser.select(
-                "div.c-announce-box div.c-announce a"
-            )[1].text
-
-            novel_description = response.meta.get("novel_description")
-            novel_item["novel_description"] = novel_description
-            volume_title = soup_parser.select_one("div.c-announce-box span")
-            novel_item["volume_title"] = volume_title.text if volume_title else ""
-
-            chapter_start_end = soup_parser.select_one("div.p-novel__number").text
-            novel_item["chapter_start_end"] = chapter_start_end
-            novel_item["chapter_number"] = chapter_start_end.split("/")[0]
-            novel_item["chapter_title"] = soup_parser.select_one(
-                "h1.p-novel__title.p-novel__title--rensai"
-            ).text
-
-            foreword = soup_parser.select_one(
-                "div.p-novel__body div.js-novel-text.p-novel__text--preface"
-            )
-            if foreword:
-                novel_item["chapter_foreword"] = "\n".join(
-                    p.text for p in foreword.select("p")
-                )
-            novel_item["chapter_text"] = "\n".join(
-                p.text
-                for p in soup_parser.select_one(
-                    "div.p-novel__body div.js-novel-text.p-novel__text"
-                ).select("p[id^='L']")
+            # novel_description retrieved from the novel metadata store by novel code
+            novel_code = response.meta.get("novel_code") or novel_code_from_url(
+                response.url
             )
-            afterword = soup_parser.select_one(
-                "div.p-novel__body div.js-novel-text.p-novel__text--afterword"
+            novel_item = NovelItem(
+                novel_code=novel_code,
+                novel_title=fields.pop("novel_title"),
+                novel_description=self.novel_meta.get(novel_code).get(
+                    "novel_description", ""
+                ),
+                **fields,
             )
-            if afterword:
-                novel_item["chapter_afterword"] = "\n".join(
-                    p.text for p in afterword.select("p")
-                )
 
             yield novel_item
 
             # Log the time taken to crawl the chapter
-            time_end = time.perf_counter()
+            time_end = time.time()
             crawl_time = time_end - time_start
             self.logger.info(
                 f"Crawled chapter {novel_item['chapter_number']} in {crawl_time:.2f} seconds\n"
             )
 
-            next_page_element = soup_parser.select_one(
-                "div.c-pager a.c-pager__item--next"
-            )
-            if next_page_element is not None:
-                next_page_href = next_page_element["href"]
+            if (
+                self.end_chapter
+                and int(novel_item["chapter_number"]) >= self.end_chapter
+            ):
+                return
+            # Repair requests fetch single chapters, the rest are already stored
+            if next_page_href is not None and not response.meta.get("repair"):
                 # logging.info(f"Next page href: {next_page_href}")
-                # next_page = response.urljoin(next_page_href)
-                next_page = urljoin("https://novel18.syosetu.com/", next_page_href)
+                next_page = urljoin(page_url, next_page_href)
                 yield scrapy.Request(
                     next_page,
                     callback=self.parse_chapters,
-                    dont_filter=True,  # Disable URL filtering
+                    # Stored chapters are skipped unless refetching
+                    dont_filter=self.settings.getbool("DUPEFILTER_REFETCH"),
+                    cookies=self.repair_cookies,
                     meta={
-                        "novel_description": novel_description,
-                        "start_time": time.perf_counter(),
+                        "novel_code": novel_code,
+                        "start_time": time.time(),
+                        # Where skipping stored chapters stops
+                        "chapter_total": int(
+                            novel_item["chapter_start_end"].split("/")[1]
+                        ),
                         # "driver": driver,
                     },
                 )
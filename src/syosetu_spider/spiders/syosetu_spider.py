@@ -8,12 +8,26 @@ sys.path.append("../../..")
 
 from bs4 import BeautifulSoup
 from syosetu_spider.items import NovelItem
+from syosetu_spider.repair import ChapterRepairMixin
+from syosetu_spider.parse_pool import ParsePoolMixin
+from syosetu_spider.dupefilter import SkipStoredChaptersMixin
+from syosetu_spider.parsing import (
+    TEXT_DOWNLOAD_PATH,
+    parse_chapter_page,
+    parse_text_export,
+    text_download_id,
+    toc_chapters,
+)
+from novel_store import NovelMetaStore, novel_code_from_url
 from datetime import datetime
+from urllib.parse import urljoin
 
 HOME_USER = os.path.expanduser("~")
 
 
-class SyosetuSpider(scrapy.Spider):
+class SyosetuSpider(
+    ChapterRepairMixin, ParsePoolMixin, SkipStoredChaptersMixin, scrapy.Spider
+):
     name = "syosetu_spider"
     allowed_domains = ["syosetu.com", "ncode.syosetu.com"]
     current_dt = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -23,25 +37,41 @@ class SyosetuSpider(scrapy.Spider):
         "USER_AGENT": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
         # "DOWNLOAD_DELAY": 1,  # Respect robots.txt crawl delay
         # "RANDOMIZE_DOWNLOAD_DELAY": 0.5,  # Randomize delay (0.5 * to 1.5 * DOWNLOAD_DELAY)
-        "FEEDS": {
-            #     f"{name}_{current_dt}.jsonl": {
-            os.path.join(HOME_USER, "storage_jl", f"{name}_{current_dt}.jl"): {
-                "format": "jsonlines",
-                "encoding": "utf8",
-                "store_empty": False,
-                "overwrite": True,
-            }
-        },
     }
 
-    def __init__(self, start_urls=None, start_chapter=None, *args, **kwargs):
+    def __init__(
+        self,
+        start_urls=None,
+        start_chapter=None,
+        text_download=False,
+        end_chapter=None,
+        *args,
+        **kwargs,
+    ):
         super(SyosetuSpider, self).__init__(*args, **kwargs)
         self.start_chapter = start_chapter
+        # Last chapter to crawl, crawl-workers splits novels into chapter ranges
+        self.end_chapter = int(end_chapter) if end_chapter else None
+        # Spider arguments from the command line arrive as strings
+        self.text_download = str(text_download).lower() in ("1", "true", "yes")
+        self._novel_meta = None
         if start_urls:
             self.start_urls = [start_urls]
         else:
             self.start_urls = ["https://ncode.syosetu.com/n4750dy/"]
 
+    @property
+    def novel_meta(self) -> NovelMetaStore:
+        """Per-novel metadata referenced by novel code from request meta."""
+        if self._novel_meta is None:
+            self._novel_meta = NovelMetaStore(self.settings.get("JOBDIR"))
+        return self._novel_meta
+
+    def closed(self, reason):
+        self.release_parse_pool()
+        if self._novel_meta is not None:
+            self._novel_meta.close()
+
     def parse(self, response):
         """
         Parses the main page of the novel and extracts the novel description and link to the first chapter.
@@ -63,6 +93,23 @@ class SyosetuSpider(scrapy.Spider):
                 "href"
             ]
             novel_code = first_chapter_link.split("/")[1]
+            # Requests only carry the novel code, the description is looked up by it
+            self.novel_meta.set(novel_code, novel_description=novel_description)
+
+            if self.text_download:
+                novel_id = text_download_id(soup_parser)
+                if novel_id:
+                    self.novel_meta.set(
+                        novel_code,
+                        novel_title=soup_parser.select_one("h1.p-novel__title").text,
+                        text_download_id=novel_id,
+                        toc=[],
+                    )
+                    yield from self.parse_toc(response, soup_parser, novel_code)
+                    return
+                self.logger.info(
+                    f"No text download for {novel_code}, crawling the HTML pages"
+                )
 
             if self.start_chapter:
                 chapter_link: str = f"/{novel_code}/{self.start_chapter}/"
@@ -74,79 +121,183 @@ class SyosetuSpider(scrapy.Spider):
                 starting_page,
                 callback=self.parse_chapters,
                 meta={
-                    "novel_description": novel_description,
-                    "start_time": time.perf_counter(),
+                    "novel_code": novel_code,
+                    "start_time": time.time(),
                 },
             )
 
-    def parse_chapters(self, response):
+    async def parse_chapters(self, response):
         """
         Parses the content of a single chapter and yields a NovelItem object containing the extracted information.
+        The page is parsed on the parse pool, the reactor keeps downloading meanwhile.
         Args:
             response: The response object representing a chapter's page.
         Returns:
             A NovelItem object containing the extracted information from the chapter.
         """
-        soup = BeautifulSoup(response.text, "html.parser")
+        fields = await self.run_parser(parse_chapter_page, response.text)
+        next_page_href = fields.pop("next_href")
         # Calculate the time taken to crawl the chapter from request to end of processing
         time_start = response.meta.get("start_time")
 
-        # novel_description retrieved from meta dictionary, and passed to next parse_chapters
-        novel_item = NovelItem()
-        novel_item["novel_title"] = soup.select("div.c-announce-box div.c-announce a")[
-            1
-        ].text
-        novel_description = response.meta.get("novel_description")
-        novel_item["novel_description"] = novel_description
-        volume_title = soup.select_one("div.c-announce-box span")
-        novel_item["volume_title"] = volume_title.text if volume_title else ""
-
-        chapter_start_end = soup.select_one("div.p-novel__number").text
-        novel_item["chapter_start_end"] = chapter_start_end
-        novel_item["chapter_number"] = chapter_start_end.split("/")[0]
-        novel_item["chapter_title"] = soup.select_one(
-            "h1.p-novel__title.p-novel__title--rensai"
-        ).text
-
-        foreword = soup.select_one(
-            "div.p-novel__body div.js-novel-text.p-novel__text--preface"
-        )
-        if foreword:
-            novel_item["chapter_foreword"] = "\n".join(
-                p.text for p in foreword.select("p")
-            )
-        novel_item["chapter_text"] = "\n".join(
-            p.text
-            for p in soup.select_one(
-                "div.p-novel__body div.js-novel-text.p-novel__text"
-            ).select("p[id^='L']")
+        # novel_description retrieved from the novel metadata store by novel code
+        novel_code = response.meta.get("novel_code") or novel_code_from_url(
+            response.url
         )
-        afterword = soup.select_one(
-            "div.p-novel__body div.js-novel-text.p-novel__text--afterword"
+        novel_item = NovelItem(
+            novel_code=novel_code,
+            novel_title=fields.pop("novel_title"),
+            novel_description=self.novel_meta.get(novel_code).get(
+                "novel_description", ""
+            ),
+            **fields,
         )
-        if afterword:
-            novel_item["chapter_afterword"] = "\n".join(
-                p.text for p in afterword.select("p")
-            )
 
         yield novel_item
 
         # Log the time taken to crawl the chapter
-        time_end = time.perf_counter()
+        time_end = time.time()
         crawl_time = time_end - time_start
         self.logger.info(
             f"Crawled chapter {novel_item['chapter_number']} in {crawl_time:.2f} seconds\n"
         )
 
-        next_page_element = soup.select_one("div.c-pager a.c-pager__item--next")
-        if next_page_element is not None:
-            next_page_href = next_page_element["href"]
+        if self.end_chapter and int(novel_item["chapter_number"]) >= self.end_chapter:
+            return
+        # Repair requests fetch single chapters, the rest are already stored
+        if next_page_href is not None and not response.meta.get("repair"):
             next_page = response.urljoin(next_page_href)
             yield scrapy.Request(
                 next_page,
                 callback=self.parse_chapters,
                 meta={
-                    "novel_description": novel_description,
-                    "start_time": time.perf_counter(),
+                    "novel_code": novel_code,
+                    "start_time": time.time(),
+                    # Where skipping stored chapters stops
+                    "chapter_total": int(novel_item["chapter_start_end"].split("/")[1]),
                 },
             )
+
+    def parse_toc(self, response, soup_parser=None, novel_code=None):
+        """
+        Collects the chapter list of the main page, following the main page
+        pager, and starts the plain-text chapter downloads after the last page.
+        Args:
+            response: The response object representing a main page of the novel.
+        Returns:
+            None. Sends a request for the next main page or the first chapter text.
+        """
+        soup_parser = soup_parser or BeautifulSoup(response.text, "html.parser")
+        novel_code = novel_code or response.meta["novel_code"]
+        toc = self.novel_meta.get(novel_code)["toc"] + toc_chapters(soup_parser)
+        self.novel_meta.set(novel_code, toc=toc)
+
+        next_page_element = soup_parser.select_one("div.c-pager a.c-pager__item--next")
+        if next_page_element is not None:
+            yield scrapy.Request(
+                response.urljoin(next_page_element["href"]),
+                callback=self.parse_toc,
+                meta={"novel_code": novel_code},
+            )
+            return
+
+        start_chapter = int(self.start_chapter) if self.start_chapter else 0
+        for toc_index, (number, _, _) in enumerate(toc):
+            if number >= start_chapter:
+                yield self._text_request(response.url, novel_code, toc_index)
+                break
+
+    def _text_request(self, base_url, novel_code, toc_index):
+        meta = self.novel_meta.get(novel_code)
+        number = meta["toc"][toc_index][0]
+        return scrapy.Request(
+            urljoin(
+                base_url,
+                TEXT_DOWNLOAD_PATH.format(
+                    novel_id=meta["text_download_id"], number=number
+                ),
+            ),
+            callback=self.parse_chapter_text,
+            errback=self.text_download_failed,
+            meta={
+                "novel_code": novel_code,
+                "toc_index": toc_index,
+                # The dupefilter sees the text and the HTML page as one chapter
+                "chapter_number": number,
+                "start_time": time.time(),
+            },
+        )
+
+    def missing_chapter_request(self, request, number):
+        if "toc_index" not in request.meta:
+            return super().missing_chapter_request(request, number)
+        novel_code = request.meta["novel_code"]
+        toc = self.novel_meta.get(novel_code)["toc"]
+        for toc_index in range(request.meta["toc_index"], len(toc)):
+            if toc[toc_index][0] >= number:
+                return self._text_request(request.url, novel_code, toc_index)
+        return None
+
+    def _html_fallback(self, url, request):
+        """Continue the crawl through the HTML chapter pages from this chapter on."""
+        novel_code = request.meta["novel_code"]
+        number = self.novel_meta.get(novel_code)["toc"][request.meta["toc_index"]][0]
+        self.logger.info(
+            f"Text download unavailable for {novel_code} chapter {number}, "
+            "falling back to HTML"
+        )
+        return scrapy.Request(
+            urljoin(url, f"/{novel_code}/{number}/"),
+            callback=self.parse_chapters,
+            # The dupefilter already saw this chapter as the text request
+            dont_filter=True,
+            meta={"novel_code": novel_code, "start_time": time.time()},
+        )
+
+    def text_download_failed(self, failure):
+        request = failure.request
+        yield self._html_fallback(request.url, request)
+
+    def parse_chapter_text(self, response):
+        """
+        Builds a NovelItem from the plain-text export of a chapter, with the
+        chapter title and volume taken from the main page chapter list.
+        Args:
+            response: The response object with the chapter text.
+        Returns:
+            A NovelItem object and the request for the next chapter text.
+        """
+        content_type = response.headers.get(b"Content-Type", b"").decode("latin-1")
+        if not content_type.startswith("text/plain") or not response.body:
+            yield self._html_fallback(response.url, response.request)
+            return
+
+        time_start = response.meta.get("start_time")
+        novel_code = response.meta["novel_code"]
+        toc_index = response.meta["toc_index"]
+        meta = self.novel_meta.get(novel_code)
+        number, chapter_title, volume_title = meta["toc"][toc_index]
+
+        novel_item = NovelItem()
+        novel_item["novel_code"] = novel_code
+        novel_item["novel_title"] = meta.get("novel_title", "")
+        novel_item["novel_description"] = meta.get("novel_description", "")
+        novel_item["volume_title"] = volume_title
+        novel_item["chapter_start_end"] = f"{number}/{meta['toc'][-1][0]}"
+        novel_item["chapter_number"] = str(number)
+        novel_item["chapter_title"] = chapter_title
+        text_fields = parse_text_export(response.body.decode("utf-8"))
+        # Same field order as the HTML path so stored records are identical
+        for field_name in ("chapter_foreword", "chapter_text", "chapter_afterword"):
+            if field_name in text_fields:
+                novel_item[field_name] = text_fields[field_name]
+
+        yield novel_item
+
+        crawl_time = time.time() - time_start
+        self.logger.info(f"Crawled chapter {number} text in {crawl_time:.2f} seconds\n")
+
+        if self.end_chapter and number >= self.end_chapter:
+            return
+        if toc_index + 1 < len(meta["toc"]):
+            yield self._text_request(response.url, novel_code, toc_index + 1)
@@ -1,19 +1,22 @@
 import os
 import glob
-import jsonlines
 from typing import Optional
 from novel_package import NovelPackage, Chapter
 from novel_package_v2 import process_jsonl_file3
+from profiling import NULL_PROFILER
+from novel_store import iter_chapter_records
 
 
 def find_jsonl_files(directory: str):
-    """Find all jl files recursively in the given directory.
+    """Find all jl files recursively in the given directory, including gzip compressed .jl.gz.
     Args:
         directory (str): The directory to search for JSONL files.
     Returns:
         list: A list of paths to JSONL files.
     """
-    return glob.glob(os.path.join(directory, "**", "*.jl"), recursive=True)
+    return glob.glob(os.path.join(directory, "**", "*.jl"), recursive=True) + glob.glob(
+        os.path.join(directory, "**", "*.jl.gz"), recursive=True
+    )
 
 
 def get_new_directory(file, home_user: str, directory: str, name: str) -> str:
@@ -40,6 +43,7 @@ def process_jsonl_file(
     directory_path: str,
     output_chapter_length: int = 10,
     start_at_chapter: Optional[int] = None,
+    profiler=NULL_PROFILER,
 ):
     """Process JSONL file and write chapter chunks."""
     novel = NovelPackage(
@@ -47,27 +51,32 @@ def process_jsonl_file(
         directory_path=directory_path,
         output_chapter_length=output_chapter_length,
         start_at_chapter=start_at_chapter,
+        profiler=profiler,
     )
 
     # Get novel title and last chapter from the first chapter
-    with jsonlines.open(filepath_jl, "r") as reader:
-        for chapter_data in reader.iter(type=dict):
-            chapter = Chapter(
-                chapter_number=int(chapter_data.get("chapter_number")),
-                volume_title=chapter_data.get("volume_title"),
-                chapter_title=chapter_data.get("chapter_title"),
-                chapter_foreword=chapter_data.get("chapter_foreword"),
-                chapter_text=chapter_data.get("chapter_text"),
-                chapter_afterword=chapter_data.get("chapter_afterword"),
-            )
+    for chapter_data in profiler.iterate(
+        "read_decode", iter_chapter_records(filepath_jl)
+    ):
+        chapter = Chapter(
+            chapter_number=int(chapter_data.get("chapter_number")),
+            volume_title=chapter_data.get("volume_title"),
+            chapter_title=chapter_data.get("chapter_title"),
+            chapter_foreword=chapter_data.get("chapter_foreword"),
+            chapter_text=chapter_data.get("chapter_text"),
+            chapter_afterword=chapter_data.get("chapter_afterword"),
+        )
 
-            # Handle chapter skipping with new logic
-            if chapter.check_skip_chapter():
-                novel.process_chunk_position(chapter.chapter_number)
-                continue
+        # Handle chapter skipping with new logic
+        with profiler.stage("skip_check"):
+            skip_chapter = chapter.check_skip_chapter()
+        if skip_chapter:
+            novel.process_chunk_position(chapter.chapter_number)
+            continue
 
+        with profiler.stage("chunk_assembly"):
             _update_novel_metadata(novel, chapter_data, chapter)
-            _process_novel_chunk(novel, chapter.chapter_number)
+        _process_novel_chunk(novel, chapter.chapter_number)
 
 
 def _update_novel_metadata(novel: NovelPackage, chapter_data: dict, chapter: Chapter):
@@ -80,16 +89,20 @@ def _update_novel_metadata(novel: NovelPackage, chapter_data: dict, chapter: Cha
 
 def _process_novel_chunk(novel: NovelPackage, chapter_number: int):
     """Process novel chunk and write to file if needed."""
-    # Check if start new chunk
-    novel.check_start_new_chunk(chapter_number)
+    with novel.profiler.stage("chunk_assembly"):
+        # Check if start new chunk
+        novel.check_start_new_chunk(chapter_number)
+        write_chunk = novel.should_write_chunk(chapter_number)
 
     # Write chunk if needed
-    if novel.should_write_chunk(chapter_number):
-        chapter_start_end, prefix = novel.add_chapter_prefix_start_end(
-            novel.current_chapter_number, chapter_number
-        )
+    if write_chunk:
+        with novel.profiler.stage("chunk_assembly"):
+            chapter_start_end, prefix = novel.add_chapter_prefix_start_end(
+                novel.current_chapter_number, chapter_number
+            )
+            text_content = prefix + novel.get_novel_text()
         novel.write_chunk_to_file(
-            text_content=prefix + novel.get_novel_text(),
+            text_content=text_content,
             chapter_start_end=chapter_start_end,
         )
         novel.chapters.clear()
@@ -1,6 +1,7 @@
 import os
-import jsonlines
 from typing import Optional
+from profiling import NULL_PROFILER
+from novel_store import iter_chapter_records
 
 
 def check_title_text_skip(chapter: dict):
@@ -101,6 +102,7 @@ def process_jsonl_file_old(
     directory_path: str,
     output_chapter_range: int = 10,
     start_chapter: Optional[int] = None,
+    profiler=NULL_PROFILER,
 ):
     """
     Read a JSON lines file containing a novel content, split into sized chapters, then write each
@@ -117,10 +119,12 @@ def process_jsonl_file_old(
 
     start_chapter_numbering = start_chapter if start_chapter else 1
 
-    with jsonlines.open(file, "r") as jsonlinesReader:
-        for chapter in jsonlinesReader.iter(type=dict, skip_invalid=True):
-            chapter_number = chapter.get("chapter_number")
-            # Skip chapter content if chapter title in the skip list
+    for chapter in profiler.iterate(
+        "read_decode", iter_chapter_records(file, skip_invalid=True)
+    ):
+        chapter_number = chapter.get("chapter_number")
+        # Skip chapter content if chapter title in the skip list
+        with profiler.stage("skip_check"):
             title_skip = check_title_text_skip(chapter)
 
             skip_result, chapter_start_modulo_rest, chapter_end_modulo_rest = (
@@ -131,10 +135,11 @@ def process_jsonl_file_old(
                     chapter_end_modulo_rest,
                 )
             )
-            if skip_result:
-                # continue to next loop on if
-                continue
+        if skip_result:
+            # continue to next loop on if
+            continue
 
+        with profiler.stage("chunk_assembly"):
             # save start and end chapter num to add to file text name
             if int(chapter_number) % output_chapter_range == chapter_start_modulo_rest:
                 if chapter.get("volume_title"):
@@ -144,39 +149,40 @@ def process_jsonl_file_old(
             # add chapter title to main output text and foreword and afterword if exist
             main_text = add_main_text_content(chapter, main_text)
 
-            # get last novel chapter number from the start, end list
-            chapter_last_num = chapter.get("chapter_start_end").split("/")[1]
-            # Every output_chapter_range chapter section and save novel title, last chapter number to the text file output
-            if (
-                int(chapter_number) % output_chapter_range == chapter_end_modulo_rest
-                or chapter_number == chapter_last_num
-            ):
-                novel_title = chapter.get("novel_title")
-                # novel_title = translate_safe_title(chapter.get("novel_title"))
-                novel_description = chapter.get("novel_description")
-                start_end_chapter_number = f"{start_chapter_numbering}-{chapter_number}"
-                # add start and end chapter prefix to main text, novel title and description if first txt output
-                if int(start_chapter_numbering) <= output_chapter_range:
-                    main_text = f"{start_end_chapter_number} {novel_title}\n{novel_description}\n{main_text}"
-                else:
-                    main_text = f"{start_end_chapter_number} {main_text}"
-
-                # Get the base directory name and add _text suffix
-                base_dir = os.path.basename(os.path.dirname(file))
-                output_text_directory = os.path.join(
-                    os.path.dirname(os.path.dirname(file)), f"{base_dir}_text"
-                )
-                # typer.echo(f"Output directory: {output_text_directory}")
-                # /home/btnm/storage_jl/scrapyd_webnovel_jsonl/syosetu_spider_text
+        # get last novel chapter number from the start, end list
+        chapter_last_num = chapter.get("chapter_start_end").split("/")[1]
+        # Every output_chapter_range chapter section and save novel title, last chapter number to the text file output
+        if (
+            int(chapter_number) % output_chapter_range == chapter_end_modulo_rest
+            or chapter_number == chapter_last_num
+        ):
+            novel_title = chapter.get("novel_title")
+            # novel_title = translate_safe_title(chapter.get("novel_title"))
+            novel_description = chapter.get("novel_description")
+            start_end_chapter_number = f"{start_chapter_numbering}-{chapter_number}"
+            # add start and end chapter prefix to main text, novel title and description if first txt output
+            if int(start_chapter_numbering) <= output_chapter_range:
+                main_text = f"{start_end_chapter_number} {novel_title}\n{novel_description}\n{main_text}"
+            else:
+                main_text = f"{start_end_chapter_number} {main_text}"
+
+            # Get the base directory name and add _text suffix
+            base_dir = os.path.basename(os.path.dirname(file))
+            output_text_directory = os.path.join(
+                os.path.dirname(os.path.dirname(file)), f"{base_dir}_text"
+            )
+            # typer.echo(f"Output directory: {output_text_directory}")
+            # /home/btnm/storage_jl/scrapyd_webnovel_jsonl/syosetu_spider_text
 
-                # Create output directory if it doesn't exist
-                os.makedirs(output_text_directory, exist_ok=True)
+            # Create output directory if it doesn't exist
+            os.makedirs(output_text_directory, exist_ok=True)
 
-                filename = f"{start_end_chapter_number} {novel_title[:30]}.txt"
-                # typer.echo(f"Filename: {filename}")
+            filename = f"{start_end_chapter_number} {novel_title[:30]}.txt"
+            # typer.echo(f"Filename: {filename}")
 
-                # Create the full output path by joining the output directory and filename
-                file_path = os.path.join(output_text_directory, filename)
+            # Create the full output path by joining the output directory and filename
+            file_path = os.path.join(output_text_directory, filename)
+            with profiler.stage("write"):
                 output_text_to_file(file_path, main_text)
-                # Clear main_text after writing to file
-                main_text = ""
+            # Clear main_text after writing to file
+            main_text = ""
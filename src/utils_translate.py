@@ -1,6 +1,8 @@
 import asyncio
-import json
+import threading
+from typing import Dict, Optional
 from googletrans import Translator
+from novel_store import iter_chapter_records
 
 
 async def translate_to_eng(text: str, lang: str = "ja"):
@@ -21,6 +23,76 @@ async def translate_to_eng(text: str, lang: str = "ja"):
         return f"Translation error: {str(e)}"
 
 
+class TitleTranslator:
+    """One translation client kept open for the life of a process.
+
+    translate_to_eng creates a Translator, and asyncio.run a new event loop,
+    for every title. This keeps both on a thread of their own, so their
+    connections are reused, and caches the titles it translated. It can be
+    called from any thread. A title that takes longer than timeout seconds
+    gives the usual error text.
+    """
+
+    def __init__(self, timeout: float = 30.0):
+        # Seconds to wait for one title, a stalled request must not hang a crawl
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="title-translator", daemon=True
+        )
+        self.thread.start()
+        self.translator: Optional[Translator] = None
+        self.cache: Dict[str, str] = {}
+
+    async def _translate(self, text: str, lang: str) -> str:
+        if self.translator is None:
+            self.translator = Translator()
+        result = await self.translator.translate(text, src=lang, dest="en")
+        return result.text
+
+    def translate(self, text: str, lang: str = "ja") -> str:
+        """Same result as translate_to_eng, errors are not cached."""
+        key = f"{lang}:{text}"
+        if key in self.cache:
+            return self.cache[key]
+        future = asyncio.run_coroutine_threadsafe(
+            self._translate(text, lang), self.loop
+        )
+        try:
+            translated = future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            return f"Translation error: no answer within {self.timeout:g}s"
+        except Exception as e:
+            return f"Translation error: {str(e)}"
+        self.cache[key] = translated
+        return translated
+
+    def close(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+# Set by use_title_translator, translate_title then goes through it
+_title_translator: Optional[TitleTranslator] = None
+
+
+def use_title_translator() -> TitleTranslator:
+    """Translate titles with one long-lived client from now on, for long running processes."""
+    global _title_translator
+    if _title_translator is None:
+        _title_translator = TitleTranslator()
+    return _title_translator
+
+
+def close_title_translator() -> None:
+    global _title_translator
+    if _title_translator is not None:
+        _title_translator.close()
+        _title_translator = None
+
+
 async def test_translate():
     print(await translate_to_eng("こんにちは、世界！"))
     print(await translate_to_eng("おはようございます", "ja"))
@@ -48,6 +120,8 @@ def translate_safe_title(title: str):
 
 def translate_title(title: str):
     """Translate the title of the novel from Japanese to English."""
+    if _title_translator is not None:
+        return _title_translator.translate(title, "ja")
     translated_title = asyncio.run(translate_to_eng(title, "ja"))
     # typer.echo(f"Translating: {title} -> {translated_title}")
 
@@ -57,9 +131,9 @@ def translate_title(title: str):
 def translate_file_title(file: str):
     """Translate the title of the novel from Japanese to English."""
     # Read and translate title
-    with open(file, "r", encoding="utf-8") as f:
-        first_line = f.readline()
-        data = json.loads(first_line)
+    novel_title = ""
+    for data in iter_chapter_records(file):
         novel_title = data.get("novel_title", "")
+        break
 
     return translate_safe_title(novel_title)
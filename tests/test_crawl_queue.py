@@ -0,0 +1,32 @@
+from crawl_queue import CrawlQueue
+from syosetu_api import site_of
+
+
+def test_paths_include_files_of_failed_and_expired_jobs(tmp_path):
+    queue = CrawlQueue(str(tmp_path / "queue.sqlite3"), max_attempts=1)
+    for start_chapter, end_chapter in [(1, 10), (11, 20), (21, 30)]:
+        queue.add(
+            "syosetu", "https://ncode.syosetu.com/n0001aa/", start_chapter, end_chapter
+        )
+    queue.add("syosetu", "https://ncode.syosetu.com/n0002bb/")
+
+    done, failed, expired = (queue.lease("worker", 300) for _ in range(3))
+    queue.set_path(done.id, "worker", "n0001aa.jl")
+    queue.complete(done.id, "worker", "n0001aa.jl")
+    queue.set_path(failed.id, "worker", "n0001aa.jl")
+    queue.fail(failed.id, "worker", "no chapters stored")
+    # A lease that ran out, e.g. a killed worker
+    queue.set_path(expired.id, "worker", "n0001aa-expired.jl")
+    queue.renew([expired.id], "worker", -1)
+    assert queue.lease("other", 300).url.endswith("/n0002bb/")
+
+    assert queue.counts()["failed"] == 2
+    assert sorted(queue.paths()) == ["n0001aa-expired.jl", "n0001aa.jl"]
+    queue.close()
+
+
+def test_site_of_urls_and_stored_files():
+    assert site_of("https://novel18.syosetu.com/n0153ce/") == "nocturne"
+    assert site_of("https://ncode.syosetu.com/n4750dy/") == "syosetu"
+    assert site_of("/home/user/storage_jl/nocturne_spider/n0153ce.jl") == "nocturne"
+    assert site_of("/home/user/storage_jl/syosetu_spider/n4750dy.jl") == "syosetu"
@@ -0,0 +1,129 @@
+import json
+
+import pytest
+import scrapy
+from scrapy import signals
+from scrapy.utils.test import get_crawler
+
+from syosetu_spider.dupefilter import (
+    SkipStoredChaptersMixin,
+    StoredChapterDupeFilter,
+)
+from syosetu_spider.parsing import TEXT_DOWNLOAD_PATH
+
+BASE_URL = "https://ncode.syosetu.com"
+
+
+class ChapterSpider(SkipStoredChaptersMixin, scrapy.Spider):
+    name = "syosetu_spider"
+
+
+class RecordingEngine:
+    """Stand-in for the execution engine, keeps the requests it is given."""
+
+    def __init__(self):
+        self.requests = []
+
+    def crawl(self, request):
+        self.requests.append(request)
+
+
+def store_chapters(storage, novel_code, numbers):
+    path = storage / "syosetu_spider" / f"{novel_code}.jl"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for number in numbers:
+            record = {"chapter_number": str(number), "chapter_title": f"第{number}話"}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def chapter_request(number, novel_code="n0001aa", **meta):
+    return scrapy.Request(
+        f"{BASE_URL}/{novel_code}/{number}/",
+        meta={"novel_code": novel_code, "chapter_total": 10, **meta},
+    )
+
+
+@pytest.fixture
+def crawl(tmp_path):
+    """Make a spider, its dupefilter and a recording engine for some settings."""
+
+    def make(**settings):
+        crawler = get_crawler(
+            ChapterSpider, {"NOVEL_STORAGE_DIR": str(tmp_path), **settings}
+        )
+        crawler.spider = ChapterSpider.from_crawler(crawler)
+        crawler.engine = RecordingEngine()
+        return crawler, StoredChapterDupeFilter.from_crawler(crawler)
+
+    return make
+
+
+def drop(crawler, dupefilter, request):
+    """Ask the dupefilter, sending request_dropped like the scheduler does."""
+    seen = dupefilter.request_seen(request)
+    if seen:
+        crawler.signals.send_catch_log(
+            signals.request_dropped, request=request, spider=crawler.spider
+        )
+    return seen
+
+
+def test_stored_chapter_is_dropped_and_the_crawl_continues(tmp_path, crawl):
+    store_chapters(tmp_path, "n0001aa", [1, 2, 3, 5])
+    crawler, dupefilter = crawl()
+
+    assert drop(crawler, dupefilter, chapter_request(2))
+
+    assert crawler.stats.get_value("dupefilter/stored") == 1
+    [next_request] = crawler.engine.requests
+    assert next_request.url == f"{BASE_URL}/n0001aa/4/"
+    assert "next_missing_chapter" not in next_request.meta
+    assert next_request.meta["chapter_total"] == 10
+    assert not drop(crawler, dupefilter, next_request)
+
+
+@pytest.mark.parametrize(
+    "stored, end_chapter", [([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], None), ([1, 2, 3], 3)]
+)
+def test_crawl_stops_at_the_last_chapter(tmp_path, crawl, stored, end_chapter):
+    store_chapters(tmp_path, "n0001aa", stored)
+    crawler, dupefilter = crawl()
+    crawler.spider.end_chapter = end_chapter
+
+    assert drop(crawler, dupefilter, chapter_request(2))
+
+    assert crawler.engine.requests == []
+
+
+def test_refetch_turns_filtering_off(tmp_path, crawl):
+    store_chapters(tmp_path, "n0001aa", [1, 2, 3])
+    crawler, dupefilter = crawl(DUPEFILTER_REFETCH=True)
+
+    assert not drop(crawler, dupefilter, chapter_request(2))
+    assert drop(crawler, dupefilter, chapter_request(2))
+    assert crawler.engine.requests == []
+    assert crawler.stats.get_value("dupefilter/stored") is None
+
+
+def test_html_page_and_text_download_are_one_chapter(tmp_path, crawl):
+    crawler, dupefilter = crawl()
+    text_request = scrapy.Request(
+        BASE_URL + TEXT_DOWNLOAD_PATH.format(novel_id=1234, number=4),
+        meta={"novel_code": "n0001aa", "chapter_number": 4},
+    )
+
+    assert not dupefilter.request_seen(text_request)
+    assert dupefilter.request_seen(chapter_request(4))
+    assert not dupefilter.request_seen(chapter_request(5))
+
+
+def test_requested_chapters_are_kept_when_a_novel_is_closed(tmp_path, crawl):
+    crawler, dupefilter = crawl(DUPEFILTER_OPEN_NOVELS=1)
+
+    assert not dupefilter.request_seen(chapter_request(4))
+    # Opening another novel closes n0001aa, its chapter 4 is not stored yet
+    assert not dupefilter.request_seen(chapter_request(1, novel_code="n0002bb"))
+
+    assert list(dupefilter.novels) == ["n0002bb"]
+    assert dupefilter.request_seen(chapter_request(4))
@@ -0,0 +1,47 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from file_links import LINK_MODES, place_file, same_novel
+
+
+def write_novel(path, novel_code, chapters=3):
+    with open(path, "w", encoding="utf-8") as f:
+        for number in range(1, chapters + 1):
+            record = {"novel_code": novel_code, "chapter_number": str(number)}
+            f.write(json.dumps(record) + "\n")
+    return str(path)
+
+
+@pytest.mark.parametrize("mode", LINK_MODES)
+def test_threads_placing_at_one_destination_do_not_collide(tmp_path, mode):
+    sources = [
+        write_novel(tmp_path / f"n000{number}aa.jl", f"n000{number}aa", number)
+        for number in range(1, 9)
+    ]
+    os.makedirs(tmp_path / "out")
+    destination = str(tmp_path / "out" / "Translation_error.jl")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        methods = list(
+            executor.map(lambda source: place_file(source, destination, mode), sources)
+        )
+
+    assert len(methods) == 8
+    assert os.listdir(tmp_path / "out") == ["Translation_error.jl"]
+    with open(destination, encoding="utf-8") as f:
+        assert json.loads(f.readline())["novel_code"] in {
+            f"n000{number}aa" for number in range(1, 9)
+        }
+
+
+def test_same_novel_tells_outdated_copies_from_other_novels(tmp_path):
+    source = write_novel(tmp_path / "a.jl", "n0001aa", chapters=5)
+    outdated = write_novel(tmp_path / "b.jl", "n0001aa", chapters=2)
+    other = write_novel(tmp_path / "c.jl", "n0002bb", chapters=5)
+
+    assert same_novel(source, outdated)
+    assert not same_novel(source, other)
+    assert not same_novel(source, str(tmp_path / "missing.jl"))
@@ -0,0 +1,120 @@
+import os
+import gzip
+import json
+import shutil
+
+import pytest
+
+from corpus import generate_novel
+from novel_store import (
+    ChapterIndex,
+    RecordEncoder,
+    is_header,
+    iter_chapter_records,
+    migrate_jl_file,
+    open_jl,
+    read_records,
+    scan_chapters,
+)
+
+
+def v1_novel(path, chapters=12):
+    """A v1 file like the spiders wrote before the header record, .jl or .jl.gz."""
+    if not str(path).endswith(".gz"):
+        return generate_novel(str(path), chapters=chapters, chapter_chars=300)
+    plain = generate_novel(str(path)[: -len(".gz")], chapters=chapters)
+    with open(plain, "rb") as reader, gzip.open(path, "wb") as writer:
+        shutil.copyfileobj(reader, writer)
+    os.remove(plain)
+    return str(path)
+
+
+def read_lines(path):
+    with open_jl(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_lines(path, records, mode="w"):
+    with open_jl(path, mode) as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+@pytest.mark.parametrize("name", ["n0001aa.jl", "n0001aa.jl.gz"])
+def test_migrated_file_expands_to_the_same_records(tmp_path, name):
+    path = v1_novel(tmp_path / name)
+    before = list(iter_chapter_records(path))
+
+    assert migrate_jl_file(path)
+    assert not migrate_jl_file(path)
+
+    lines = read_lines(path)
+    assert is_header(lines[0]) and lines[0]["chapter_total"] == 12
+    assert not any("novel_title" in line for line in lines[1:])
+    assert list(iter_chapter_records(path)) == before
+    assert sorted(os.listdir(tmp_path)) == [name, f"{name}.idx"]
+
+
+def test_file_mixing_v1_and_v2_records(tmp_path):
+    path = v1_novel(tmp_path / "n0001aa.jl", chapters=4)
+    expected = list(iter_chapter_records(path))
+    migrate_jl_file(path)
+    # A crawl with an older version appends v1 records to the v2 file
+    v1_record = {**expected[-1], "chapter_number": "5", "chapter_start_end": "5/5"}
+    write_lines(path, [v1_record], "a")
+
+    records = list(iter_chapter_records(path))
+
+    assert records == expected + [v1_record]
+    assert scan_chapters(path)["chapters"] == [1, 2, 3, 4, 5]
+    assert scan_chapters(path)["chapter_total"] == 5
+
+
+def test_header_written_partway_applies_to_the_chapters_after_it(tmp_path):
+    path = str(tmp_path / "n0001aa.jl")
+    v1_records = [
+        {
+            "novel_title": "旧題" if number < 3 else "新しい題名",
+            "novel_description": "あらすじ" if number < 3 else "新しいあらすじ",
+            "chapter_start_end": f"{number}/{3 if number < 3 else 4}",
+            "chapter_number": str(number),
+            "chapter_title": f"第{number}話",
+            "chapter_text": "本文",
+        }
+        for number in range(1, 5)
+    ]
+    encoder = RecordEncoder()
+    write_lines(path, [v2 for record in v1_records for v2 in encoder.encode(record)])
+
+    assert [is_header(record) for record in read_lines(path)] == [
+        True,
+        False,
+        False,
+        True,
+        False,
+        False,
+    ]
+    assert list(iter_chapter_records(path)) == v1_records
+    assert scan_chapters(path)["novel_title"] == "新しい題名"
+
+
+def test_migrate_leaves_a_consistent_chapter_index(tmp_path):
+    path = v1_novel(tmp_path / "n0001aa.jl")
+    # An index of the v1 offsets, out of date once the file is migrated
+    assert len(ChapterIndex.load(path).entries) == 12
+
+    migrate_jl_file(path)
+
+    with open(f"{path}.idx", encoding="utf-8") as f:
+        written = {
+            int(number): (int(offset), int(length))
+            for number, offset, length in (line.split("\t") for line in f)
+        }
+    scanned = ChapterIndex(path)
+    scanned.rebuild(write=False)
+    assert written == scanned.entries
+    assert os.path.getmtime(f"{path}.idx") >= os.path.getmtime(path)
+    records = read_records(path, list(written.values()))
+    assert sorted(record["chapter_number"] for record in records.values()) == list(
+        range(1, 13)
+    )
@@ -0,0 +1,181 @@
+import json
+import asyncio
+
+import pytest
+
+from paragraph_translate import (
+    FakeBackend,
+    GoogleBackend,
+    ParagraphCache,
+    translate_library,
+    translate_missing,
+)
+
+
+class RecordingBackend(FakeBackend):
+    """FakeBackend that keeps the batches it was sent, failing after fail_after."""
+
+    def __init__(self, max_batch_chars=4500, fail_after=None):
+        super().__init__()
+        self.max_batch_chars = max_batch_chars
+        self.fail_after = fail_after
+        self.batches = []
+
+    async def translate_batch(self, paragraphs):
+        if self.fail_after is not None and len(self.batches) >= self.fail_after:
+            raise ConnectionError("connection reset")
+        self.batches.append(list(paragraphs))
+        return await super().translate_batch(paragraphs)
+
+    def sent(self):
+        return [paragraph for batch in self.batches for paragraph in batch]
+
+
+class Result:
+    def __init__(self, text):
+        self.text = text
+
+
+class RecordingTranslator:
+    """Stand-in for googletrans.Translator, merges lines if merge_lines is set."""
+
+    def __init__(self, merge_lines=False):
+        self.merge_lines = merge_lines
+        self.texts = []
+
+    async def translate(self, text, src, dest):
+        assert isinstance(text, str)
+        self.texts.append(text)
+        lines = [f"[en] {line}" for line in text.split("\n")]
+        return Result(" ".join(lines) if self.merge_lines else "\n".join(lines))
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    async def acquire(self):
+        self.acquired += 1
+
+
+def write_novel(path, paragraphs_per_chapter):
+    with open(path, "w", encoding="utf-8") as f:
+        for number, paragraphs in enumerate(paragraphs_per_chapter, 1):
+            record = {
+                "chapter_number": str(number),
+                "chapter_title": f"第{number}話",
+                "chapter_text": "\n".join(paragraphs),
+            }
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return str(path)
+
+
+def read_texts(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["chapter_text"] for line in f]
+
+
+@pytest.fixture
+def library(tmp_path):
+    input_directory = tmp_path / "storage_jl"
+    input_directory.mkdir()
+    note = "いつも読んでいただきありがとうございます。"
+    files = [
+        write_novel(input_directory / "n0001aa.jl", [["朝が来た。", note], ["雨だ。"]]),
+        write_novel(input_directory / "n0002bb.jl", [["夜が来た。", "", note]]),
+    ]
+    return input_directory, files
+
+
+def test_repeated_paragraphs_are_translated_once(tmp_path, library):
+    input_directory, files = library
+    backend = RecordingBackend()
+
+    counts = translate_library(
+        files,
+        str(input_directory),
+        str(tmp_path / "storage_jl_en"),
+        backend,
+        str(tmp_path / "cache.sqlite3"),
+        rate=0,
+        echo=lambda message: None,
+    )
+
+    # The note and 第1話 are in both files
+    assert counts == {"files": 2, "paragraphs": 8, "unique": 6, "translated": 6}
+    assert sorted(backend.sent()) == sorted(set(backend.sent()))
+    assert read_texts(tmp_path / "storage_jl_en" / "n0002bb.jl") == [
+        "[en] 夜が来た。\n\n[en] いつも読んでいただきありがとうございます。"
+    ]
+
+
+def test_interrupted_run_resumes_from_the_cache(tmp_path, library):
+    input_directory, files = library
+    arguments = (
+        str(input_directory),
+        str(tmp_path / "storage_jl_en"),
+    )
+    cache_path = str(tmp_path / "cache.sqlite3")
+    # Small batches, the second one fails
+    failing = RecordingBackend(max_batch_chars=10, fail_after=1)
+    with pytest.raises(ConnectionError):
+        translate_library(
+            files,
+            *arguments,
+            failing,
+            cache_path,
+            concurrency=1,
+            rate=0,
+            echo=lambda message: None,
+        )
+    assert len(failing.batches) == 1
+
+    backend = RecordingBackend(max_batch_chars=10)
+    counts = translate_library(
+        files, *arguments, backend, cache_path, rate=0, echo=lambda message: None
+    )
+
+    assert counts["translated"] == 6 - len(failing.sent())
+    assert not set(backend.sent()) & set(failing.sent())
+    assert read_texts(tmp_path / "storage_jl_en" / "n0001aa.jl")[1] == "[en] 雨だ。"
+
+
+def test_oversize_paragraph_is_sent_in_pieces(tmp_path):
+    paragraph = "一文目です。二文目はもう少し長いです。三文目。"
+    backend = RecordingBackend(max_batch_chars=12)
+    cache = ParagraphCache(str(tmp_path / "cache.sqlite3"))
+
+    asyncio.run(translate_missing({"key": paragraph}, cache, backend, rate=0))
+
+    assert backend.sent() == ["一文目です。", "二文目はもう少し長いです", "。三文目。"]
+    assert all(len(batch) == 1 for batch in backend.batches)
+    assert cache.get_many(["key"]) == {
+        "key": "[en] 一文目です。 [en] 二文目はもう少し長いです [en] 。三文目。"
+    }
+    cache.close()
+
+
+def test_google_backend_sends_one_request_per_batch():
+    backend = GoogleBackend()
+    backend.translator = RecordingTranslator()
+    backend.limiter = CountingLimiter()
+    paragraphs = [f"「台詞{number}」" for number in range(100)]
+
+    translations = asyncio.run(backend.translate_batch(paragraphs))
+
+    assert translations == [f"[en] {paragraph}" for paragraph in paragraphs]
+    assert backend.translator.texts == ["\n".join(paragraphs)]
+    assert backend.requests == backend.limiter.acquired == 1
+
+
+def test_google_backend_falls_back_when_lines_do_not_match():
+    backend = GoogleBackend()
+    backend.translator = RecordingTranslator(merge_lines=True)
+    backend.limiter = CountingLimiter()
+
+    translations = asyncio.run(backend.translate_batch(["はい。", "いいえ。"]))
+
+    assert translations == ["[en] はい。", "[en] いいえ。"]
+    assert backend.translator.texts == ["はい。\nいいえ。", "はい。", "いいえ。"]
+    # Every request waits for the rate limit, not only the batch
+    assert backend.requests == backend.limiter.acquired == 3
@@ -0,0 +1,122 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import threading
+import http.client
+
+import pytest
+
+from corpus import generate_novel
+from reading_server import ChapterStore, ReadingServer
+
+
+@pytest.fixture
+def storage(tmp_path):
+    generate_novel(
+        str(tmp_path / "syosetu_spider" / "n0001aa.jl"),
+        chapters=12,
+        chapter_chars=2000,
+        skip_density=0,
+    )
+    return tmp_path
+
+
+@pytest.fixture
+def server(storage):
+    """A ReadingServer on a free port, running its event loop in a thread."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    reading_server = ReadingServer(ChapterStore(str(storage)))
+    listener = asyncio.run_coroutine_threadsafe(
+        asyncio.start_server(reading_server.handle_connection, "127.0.0.1", 0), loop
+    ).result(10)
+    yield listener.sockets[0].getsockname()[1]
+    listener.close()
+    asyncio.run_coroutine_threadsafe(listener.wait_closed(), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+    loop.close()
+
+
+def get(port, path, **headers):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    connection.request("GET", path, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response, body
+
+
+def test_etag_answers_a_repeated_request_with_304(server):
+    response, body = get(server, "/novels/n0001aa/chapters/1-3")
+    assert response.status == 200
+    assert body.startswith("1-3 ベンチマーク用の小説0\n".encode("utf-8"))
+
+    response, body = get(
+        server,
+        "/novels/n0001aa/chapters/1-3",
+        **{"If-None-Match": response.headers["ETag"]},
+    )
+    assert response.status == 304
+    assert body == b""
+
+
+def test_gzip_for_clients_that_accept_it(server):
+    _, plain = get(server, "/novels/n0001aa/chapters/2")
+
+    response, body = get(
+        server, "/novels/n0001aa/chapters/2", **{"Accept-Encoding": "gzip"}
+    )
+
+    assert response.status == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"].endswith('-gzip"')
+    assert gzip.decompress(body) == plain
+
+
+def test_byte_ranges(server):
+    _, plain = get(server, "/novels/n0001aa/chapters/2")
+
+    response, body = get(server, "/novels/n0001aa/chapters/2", Range="bytes=0-9")
+    assert response.status == 206
+    assert response.headers["Content-Range"] == f"bytes 0-9/{len(plain)}"
+    assert body == plain[:10]
+
+    response, body = get(
+        server, "/novels/n0001aa/chapters/2", Range=f"bytes={len(plain)}-"
+    )
+    assert response.status == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(plain)}"
+
+
+def test_line_still_being_written_is_left_out(server, storage):
+    path = storage / "syosetu_spider" / "n0001aa.jl"
+    with open(path, "ab") as f:
+        f.write(b'{"novel_code": "n0001aa", "chapter_number": "13", "chapter_ti')
+    before = sorted(os.listdir(storage / "syosetu_spider"))
+
+    response, body = get(server, "/novels/n0001aa")
+    assert response.status == 200
+    assert json.loads(body)["chapters"] == 12
+
+    response, body = get(server, "/novels/n0001aa/chapters/11-13")
+    assert response.status == 200
+    assert body.startswith("11-12 ".encode("utf-8"))
+    assert get(server, "/novels/n0001aa/chapters/13")[0].status == 404
+    # The server leaves the chapter index to the crawl that appends the file
+    assert sorted(os.listdir(storage / "syosetu_spider")) == before
+
+
+def test_huge_chapter_range_costs_only_the_stored_chapters(server):
+    started = time.monotonic()
+
+    response, body = get(server, "/novels/n0001aa/chapters/1-99999999999")
+    assert response.status == 200
+    assert body.startswith("1-12 ".encode("utf-8"))
+    response, _ = get(server, "/novels/n0001aa/chapters/13-99999999999")
+    assert response.status == 404
+
+    assert time.monotonic() - started < 5
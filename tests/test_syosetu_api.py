@@ -0,0 +1,79 @@
+import os
+import glob
+
+import pytest
+
+from corpus import generate_novel
+from mock_site import MockSiteConfig, start_mock_site
+from syosetu_api import SyosetuApiClient, compare_library, find_local_novels
+
+
+@pytest.fixture
+def api_url():
+    """Stand-in for api.syosetu.com, every novel has 12 chapters."""
+    server = start_mock_site(MockSiteConfig(chapters=12))
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def storage(tmp_path):
+    for site, ncode, chapters in [
+        ("syosetu_spider", "n0001aa", 12),
+        ("syosetu_spider", "n0002bb", 5),
+        ("nocturne_spider", "n0003cc", 3),
+    ]:
+        os.makedirs(tmp_path / site, exist_ok=True)
+        generate_novel(str(tmp_path / site / f"{ncode}.jl"), chapters=chapters)
+    return tmp_path
+
+
+def test_fetch_batches_ncodes_and_keys_them_lower_case(api_url):
+    client = SyosetuApiClient("syosetu", base_url=api_url, batch_size=2, pause=0)
+
+    novels = client.fetch(["N0001AA", "n0002bb", "n0003cc", "n0001aa"])
+
+    assert sorted(novels) == ["n0001aa", "n0002bb", "n0003cc"]
+    assert client.requests == 2
+    assert novels["n0002bb"].general_all_no == 12
+    assert novels["n0002bb"].title == "モック小説 n0002bb"
+    assert novels["n0002bb"].general_lastup == "2025-01-01 12:00:00"
+
+
+def test_fetch_nocturne_uses_the_r18_api(api_url):
+    novels = SyosetuApiClient("nocturne", base_url=api_url, pause=0).fetch(["n0003cc"])
+
+    assert novels["n0003cc"].general_all_no == 12
+
+
+def test_compare_library_reports_new_chapters(api_url, storage):
+    local_novels = find_local_novels(glob.glob(str(storage / "*" / "*.jl")))
+
+    report = {
+        entry["ncode"]: entry
+        for entry in compare_library(local_novels, base_url=api_url, pause=0)
+    }
+
+    assert report["n0001aa"]["status"] == "up_to_date"
+    assert report["n0002bb"]["status"] == "new_chapters"
+    assert report["n0002bb"]["local_chapters"] == 5
+    assert report["n0002bb"]["remote_chapters"] == 12
+    assert report["n0002bb"]["start_chapter"] == 6
+    assert report["n0002bb"]["url"] == "https://ncode.syosetu.com/n0002bb/"
+    assert report["n0003cc"]["site"] == "nocturne"
+    assert report["n0003cc"]["url"] == "https://novel18.syosetu.com/n0003cc/"
+    assert report["n0003cc"]["start_chapter"] == 4
+
+
+def test_find_local_novels_writes_nothing(storage):
+    before = sorted(os.listdir(storage / "syosetu_spider"))
+
+    novels = find_local_novels(glob.glob(str(storage / "*" / "*.jl")))
+
+    assert {novel.ncode: novel.last_chapter for novel in novels} == {
+        "n0001aa": 12,
+        "n0002bb": 5,
+        "n0003cc": 3,
+    }
+    assert sorted(os.listdir(storage / "syosetu_spider")) == before